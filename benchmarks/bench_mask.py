@@ -0,0 +1,71 @@
+"""
+Benchmark of the mask functions in nmiq.mask.
+
+Times cylinder_3d and sparse_cylinder_3d on cubic grids of increasing size,
+keeping the physical geometry of the cylinder fixed so that the number of
+masked voxels grows with the cube of the grid size, and hottest_cylinder_3d
+with a large radius on a finely sampled image. Run from the repository root
+with
+    python benchmarks/bench_mask.py
+"""
+import time
+
+import numpy as np
+import SimpleITK as sitk
+
+import nmiq.mask
+
+
+def bench_cylinder_3d(func, repeats: int = 3):
+    print(f"{func.__name__}: 200 mm field of view, 80 mm radius, "
+          f"160 mm length")
+    print(f"{'grid':>12} {'voxels':>12} {'time [s]':>10} {'ns/voxel':>10}")
+    for n in (64, 128, 256, 400):
+        spacing = 200.0 / n
+        best = float('inf')
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            func(
+                image_size=(n, n, n),
+                image_spacing=(spacing, spacing, spacing),
+                image_origin=(-100.0, -100.0, -100.0),
+                cylinder_start_z=-80.0,
+                cylinder_end_z=80.0,
+                cylinder_center_x=0.0,
+                cylinder_center_y=0.0,
+                cylinder_radius=80.0)
+            best = min(best, time.perf_counter() - t0)
+        print(f"{f'{n}^3':>12} {n ** 3:>12} {best:>10.4f} "
+              f"{1e9 * best / n ** 3:>10.2f}")
+
+
+def bench_hottest_cylinder_3d(repeats: int = 3):
+    print("hottest_cylinder_3d: 512 x 512 x 20 voxels of 0.5 mm, "
+          "18.5 mm radius")
+    n, nz, spacing = 512, 20, 0.5
+    z, y, x = np.mgrid[0:nz, 0:n, 0:n]
+    data = np.exp(-((x - 280) ** 2 + (y - 240) ** 2) / 2000.0)
+    image = sitk.GetImageFromArray(data.astype(np.float32))
+    image.SetSpacing((spacing, spacing, spacing))
+    image.SetOrigin((0.0, 0.0, 0.0))
+    start_z, end_z = 1.0, 8.0
+    n_slices = int(round((end_z - start_z) / spacing)) + 1
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        nmiq.mask.hottest_cylinder_3d(
+            image=image,
+            cylinder_start_z=start_z,
+            cylinder_end_z=end_z,
+            cylinder_center_x=128.0,
+            cylinder_center_y=128.0,
+            cylinder_radius=18.5)
+        best = min(best, time.perf_counter() - t0)
+    print(f"{'time [s]':>10} {'s/slice':>10}")
+    print(f"{best:>10.4f} {best / n_slices:>10.4f}")
+
+
+if __name__ == "__main__":
+    bench_cylinder_3d(nmiq.mask.cylinder_3d)
+    bench_cylinder_3d(nmiq.mask.sparse_cylinder_3d)
+    bench_hottest_cylinder_3d()
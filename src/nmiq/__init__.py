@@ -1,12 +1,21 @@
 # from .image import series_roi_calcs, roi_volumes
-from .core import load_images, jackknife, resample_image
-from .mask import spheres_in_cylinder_3d, hottest_cylinder_3d, cylinder_3d
-from .fwhm import nema_fwhm_from_line_profile, gaussfit_fwhm_from_line_profile
+from .core import load_images, jackknife, bootstrap, resample_image
+from .mask import spheres_in_cylinder_3d, hottest_cylinder_3d, cylinder_3d, \
+    sparse_spheres_in_cylinder_3d, sparse_hottest_cylinder_3d, \
+    sparse_cylinder_3d
+from .roi import SparseROI
+from .fwhm import nema_fwhm_from_line_profile, nema_fwhm_batch, \
+    nema_widths_from_line_profile, nema_widths_batch, \
+    gaussfit_fwhm_from_line_profile, gaussfit_fwhm_batch
+from .labelstats import label_statistics
 
 from . import tasks
 
-__all__ = ["load_images", "jackknife", "spheres_in_cylinder_3d",
+__all__ = ["load_images", "jackknife", "bootstrap", "spheres_in_cylinder_3d",
            "hottest_cylinder_3d", "cylinder_3d",
-           "resample_image", "nema_fwhm_from_line_profile",
-           "gaussfit_fwhm_from_line_profile",
-           "tasks"]
+           "sparse_spheres_in_cylinder_3d", "sparse_hottest_cylinder_3d",
+           "sparse_cylinder_3d", "SparseROI",
+           "resample_image", "nema_fwhm_from_line_profile", "nema_fwhm_batch",
+           "nema_widths_from_line_profile", "nema_widths_batch",
+           "gaussfit_fwhm_from_line_profile", "gaussfit_fwhm_batch",
+           "label_statistics", "tasks"]
@@ -1,23 +1,37 @@
 import SimpleITK as sitk
 import numpy as np
 import numpy.typing as npt
-from collections.abc import Callable
+from collections.abc import Callable, Sequence
 from typing import Any
 
 from nmiq import tasks
+from nmiq.roi import SparseROI as SparseROI
 
 def load_images(image_path: str) -> sitk.Image: ...
 
 def resample_image(image: sitk.Image,
                    new_spacing: tuple[float, ...]) -> sitk.Image: ...
 
-def jackknife(func: Callable[[npt.NDArray[np.float64]], float],
-              data: npt.NDArray[np.float64]) -> tuple[float, float]: ...
+def jackknife(func: Callable[..., Any] | str,
+              data: npt.NDArray[np.float64],
+              batched: bool = False,
+              d: int = 1,
+              groups: npt.ArrayLike | None = None) -> tuple[float, float]: ...
+
+def bootstrap(func: Callable[..., Any] | str,
+              data: npt.NDArray[np.float64],
+              n_resamples: int = 2000,
+              seed: int | None = None,
+              confidence: float = 0.95,
+              method: str = 'percentile',
+              batched: bool = False,
+              workers: int | None = None
+              ) -> tuple[float, float, tuple[float, float]]: ...
 
 def spheres_in_cylinder_3d(
         image_size: tuple[int, int, int],
-        image_spacing: tuple[int, int, int],
-        image_origin: tuple[int, int, int],
+        image_spacing: tuple[float, float, float],
+        image_origin: tuple[float, float, float],
         cylinder_start_z: float,
         cylinder_end_z: float,
         cylinder_center_x: float,
@@ -25,6 +39,17 @@ def spheres_in_cylinder_3d(
         cylinder_radius: float,
         roi_radius: float) -> sitk.Image: ...
 
+def sparse_spheres_in_cylinder_3d(
+        image_size: tuple[int, int, int],
+        image_spacing: tuple[float, float, float],
+        image_origin: tuple[float, float, float],
+        cylinder_start_z: float,
+        cylinder_end_z: float,
+        cylinder_center_x: float,
+        cylinder_center_y: float,
+        cylinder_radius: float,
+        roi_radius: float) -> SparseROI: ...
+
 def cylinder_3d(
         image_size: tuple[int, int, int],
         image_spacing: tuple[float, float, float],
@@ -33,7 +58,19 @@ def cylinder_3d(
         cylinder_end_z: float,
         cylinder_center_x: float,
         cylinder_center_y: float,
-        cylinder_radius: float) -> sitk.Image: ...
+        cylinder_radius: float,
+        partial_volume: bool = ...) -> sitk.Image: ...
+
+def sparse_cylinder_3d(
+        image_size: tuple[int, int, int],
+        image_spacing: tuple[float, float, float],
+        image_origin: tuple[float, float, float],
+        cylinder_start_z: float,
+        cylinder_end_z: float,
+        cylinder_center_x: float,
+        cylinder_center_y: float,
+        cylinder_radius: float,
+        partial_volume: bool = ...) -> SparseROI: ...
 
 def hottest_cylinder_3d(
         image: sitk.Image,
@@ -44,12 +81,63 @@ def hottest_cylinder_3d(
         cylinder_radius: float,
         mask_size: tuple[int, int, int] | None = ...,
         mask_spacing: tuple[float, float, float] | None = ...,
-        mask_origin: tuple[float, float, float] | None = ...)\
+        mask_origin: tuple[float, float, float] | None = ...,
+        warm_start: bool = ...,
+        search_stats: dict[str, int] | None = ...,
+        workers: int | None = ...,
+        axis_fit_step: int | None = ...,
+        subvoxel: bool = ...,
+        partial_volume: bool = ...)\
         -> sitk.Image: ...
 
+def sparse_hottest_cylinder_3d(
+        image: sitk.Image,
+        cylinder_start_z: float,
+        cylinder_end_z: float,
+        cylinder_center_x: float,
+        cylinder_center_y: float,
+        cylinder_radius: float,
+        mask_size: tuple[int, int, int] | None = ...,
+        mask_spacing: tuple[float, float, float] | None = ...,
+        mask_origin: tuple[float, float, float] | None = ...,
+        warm_start: bool = ...,
+        search_stats: dict[str, int] | None = ...,
+        workers: int | None = ...,
+        axis_fit_step: int | None = ...,
+        subvoxel: bool = ...,
+        partial_volume: bool = ...)\
+        -> SparseROI: ...
+
 def nema_fwhm_from_line_profile(
         line_profile: npt.NDArray[np.float64]) \
         -> tuple[float, dict[str, Any]]: ...
 
+def nema_fwhm_batch(
+        line_profiles: npt.NDArray[np.float64]) \
+        -> dict[str, npt.NDArray[Any]]: ...
+
+def nema_widths_batch(
+        line_profiles: npt.NDArray[np.float64],
+        fractions: Sequence[float] = (0.5, 0.1)) \
+        -> dict[str, npt.NDArray[Any]]: ...
+
+def nema_widths_from_line_profile(
+        line_profile: npt.NDArray[np.float64],
+        fractions: Sequence[float] = (0.5, 0.1)) -> list[float]: ...
+
 def gaussfit_fwhm_from_line_profile(
-        line_profile: npt.NDArray[np.float64]) -> list[float]: ...
+        line_profile: npt.NDArray[np.float64],
+        fast_tol: float = 1e-6) -> list[float]: ...
+
+def gaussfit_fwhm_batch(
+        line_profiles: npt.NDArray[np.float64],
+        max_iter: int = 200,
+        tol: float = 1e-10,
+        fast_tol: float = 1e-6) \
+        -> tuple[npt.NDArray[np.float64], npt.NDArray[np.bool_]]: ...
+
+def label_statistics(
+        image: sitk.Image | npt.ArrayLike,
+        labels: sitk.Image | npt.ArrayLike | SparseROI,
+        weights: sitk.Image | npt.ArrayLike | None = ...,
+        per_slice: bool = ...) -> dict[str, npt.NDArray[Any]]: ...
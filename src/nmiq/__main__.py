@@ -6,6 +6,18 @@ import time
 from typing import Any
 
 
+def _bootstrap_args(args: argparse.Namespace, task_dict: dict[str, Any]):
+    """
+    Copy the optional bootstrap arguments to the task dictionary.
+    """
+    if args.bootstrap:
+        task_dict['bootstrap'] = args.bootstrap
+    if args.bootstrap_method:
+        task_dict['bootstrap_method'] = args.bootstrap_method
+    if args.seed is not None:
+        task_dict['seed'] = args.seed
+
+
 def main(sys_args: list[str]):
 
     # Get version number from pyproject.toml
@@ -60,14 +72,61 @@ def main(sys_args: list[str]):
                              '[usage: contrast_cyl3d]')
     parser.add_argument('--direction', nargs='*', choices=['x', 'y'],
                         help='Line profile direction [usage: lsf]')
+    parser.add_argument('--angle', nargs='*', type=float,
+                        help='In-plane line profile angle in degrees, '
+                             'replaces direction [usage: lsf]')
+    parser.add_argument('--profile_step', type=float,
+                        help='Sampling distance along interpolated line '
+                             'profiles [usage: lsf]')
+    parser.add_argument('--band', type=int,
+                        help='Number of rows summed into each line profile '
+                             '[usage: lsf]')
+    parser.add_argument('--target_se', type=float,
+                        help='Stop adding slices when the standard errors '
+                             'of the mean FWHMs reach this value '
+                             '[usage: lsf]')
     parser.add_argument('--radius', nargs='*',
                         help='Radius '
                              '[usage: lsf, contrast_cyl3d]')
     parser.add_argument('--cyl_radius',
                         help='Cylinder radius '
                              '[usage: bkgvar3d, contrast_cyl3d]')
-    parser.add_argument('--roi_radius',
-                        help='ROI radius [usage: bkgvar3d]')
+    parser.add_argument('--roi_radius', nargs='+',
+                        help='ROI radius, or a list of radii '
+                             '[usage: bkgvar3d]')
+    parser.add_argument('--block_jackknife', action='store_true',
+                        help='Estimate the standard error by deleting one '
+                             'layer of ROIs at a time [usage: bkgvar3d]')
+    parser.add_argument('--bootstrap', type=int,
+                        help='Number of bootstrap resamples for standard '
+                             'errors and confidence intervals '
+                             '[usage: bkgvar3d, lsf]')
+    parser.add_argument('--bootstrap_method',
+                        choices=['percentile', 'bca'],
+                        help='Bootstrap confidence interval method '
+                             '[usage: bkgvar3d, lsf]')
+    parser.add_argument('--seed', type=int,
+                        help='Seed for bootstrap resampling '
+                             '[usage: bkgvar3d, lsf]')
+    parser.add_argument('--workers', type=int,
+                        help='Number of parallel worker processes, not '
+                             'used with --warm_start '
+                             '[usage: lsf, contrast_cyl3d]')
+    parser.add_argument('--track', type=int,
+                        help='Number of slices used to fit the line source '
+                             'trajectories [usage: lsf]')
+    parser.add_argument('--warm_start', action='store_true',
+                        help='Search each slice for the hot cylinder from '
+                             'the position found on the previous slice '
+                             '[usage: contrast_cyl3d]')
+    parser.add_argument('--axis_fit_step', type=int,
+                        help='Search every n\'th slice for the hot cylinder '
+                             'and fit a straight cylinder axis '
+                             '[usage: contrast_cyl3d]')
+    parser.add_argument('--subvoxel', action='store_true',
+                        help='Place cylinders with sub-voxel precision and '
+                             'partial volume weights '
+                             '[usage: contrast_cyl3d]')
 
     args = parser.parse_args(sys_args)
 
@@ -108,8 +167,14 @@ def main(sys_args: list[str]):
         task_dict['cylinder_center_x'] = float(args.center_x[0])
         task_dict['cylinder_center_y'] = float(args.center_y[0])
         task_dict['cylinder_radius'] = float(args.cyl_radius)
-        task_dict['roi_radius'] = float(args.roi_radius)
+        if len(args.roi_radius) == 1:
+            task_dict['roi_radius'] = float(args.roi_radius[0])
+        else:
+            task_dict['roi_radius'] = [float(r) for r in args.roi_radius]
         task_dict['output_path'] = args.o
+        if args.block_jackknife:
+            task_dict['block_jackknife'] = True
+        _bootstrap_args(args, task_dict)
         nmiq.tasks.bkgvar3d(task_dict)
         print()
     if args.task == 'lsf':
@@ -121,6 +186,19 @@ def main(sys_args: list[str]):
         task_dict['direction'] = args.direction
         task_dict['radius'] = [float(x) for x in args.radius]
         task_dict['output_path'] = args.o
+        if args.workers:
+            task_dict['workers'] = args.workers
+        if args.track:
+            task_dict['track'] = args.track
+        if args.angle:
+            task_dict['angle'] = args.angle
+        if args.profile_step:
+            task_dict['profile_step'] = args.profile_step
+        if args.band:
+            task_dict['band'] = args.band
+        if args.target_se is not None:
+            task_dict['target_se'] = args.target_se
+        _bootstrap_args(args, task_dict)
         nmiq.tasks.lsf(task_dict)
         print()
     if args.task == 'contrast_cyl3d':
@@ -132,6 +210,14 @@ def main(sys_args: list[str]):
         task_dict['background_center_y'] = float(args.bkg_center_y)
         task_dict['cylinder_radius'] = float(args.cyl_radius)
         task_dict['output_path'] = args.o
+        if args.workers:
+            task_dict['workers'] = args.workers
+        if args.warm_start:
+            task_dict['warm_start'] = True
+        if args.axis_fit_step:
+            task_dict['axis_fit_step'] = args.axis_fit_step
+        if args.subvoxel:
+            task_dict['subvoxel'] = True
         nmiq.tasks.contrast_cyl3d(task_dict)
         print()
 
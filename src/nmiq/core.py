@@ -1,9 +1,13 @@
 import os.path
-from math import ceil
+from math import ceil, comb
 import SimpleITK as sitk
 import numpy as np
 import numpy.typing as npt
 from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, repeat
+from typing import Any
+from scipy.special import ndtr, ndtri
 
 
 def resample_image(image: sitk.Image,
@@ -59,32 +63,294 @@ def load_images(image_path: str) -> sitk.Image:
     return series_reader.Execute()  # type: ignore
 
 
-def jackknife(func: Callable[[npt.NDArray[np.float64]], float],
-              data: npt.NDArray[np.float64]) -> tuple[float, float]:
+# Largest number of jackknife subsamples that will be enumerated
+_MAX_SUBSAMPLES = 1000000
+
+# Largest number of data values gathered in one batch of subsamples
+_BATCH_VALUES = 2 ** 22
+
+
+def _deleted_units(n_units: int, d: int) -> npt.NDArray[np.intp]:
+    """
+    Index matrix of the units deleted in each delete-d jackknife subsample.
+    Row j holds the d units left out of subsample j, and the rows run
+    through all combinations of d out of n_units units in lexicographic
+    order.
+    """
+    if d == 1:
+        return np.arange(n_units)[:, np.newaxis]
+    return np.fromiter(combinations(range(n_units), d),
+                       dtype=np.dtype((np.intp, d)),
+                       count=comb(n_units, d))
+
+
+def _subsample_statistics(func: str,
+                          data: npt.NDArray[np.float64],
+                          unit_index: npt.NDArray[np.intp],
+                          deleted: npt.NDArray[np.intp]
+                          ) -> npt.NDArray[np.float64]:
+    """
+    Closed form jackknife values of a built-in statistic: element j is the
+    statistic of the sample with all data in the units deleted[j] removed.
+    Data value i belongs to unit unit_index[i]. The values are computed
+    from per-unit sums of the data and of the squared deviations from the
+    full sample mean, so no subsamples are formed.
+    """
+
+    n = len(data)
+    n_units = int(unit_index.max(initial=-1)) + 1
+    total = np.sum(data)
+    dev = data - total / max(n, 1)
+
+    # Number of values kept and the sums removed in each subsample
+    kept = n - np.bincount(unit_index, minlength=n_units)[deleted].sum(axis=1)
+    removed_sum = np.bincount(unit_index, data, n_units)[deleted].sum(axis=1)
+    removed_dev = np.bincount(unit_index, dev, n_units)[deleted].sum(axis=1)
+    removed_dev2 = np.bincount(unit_index, dev ** 2,
+                               n_units)[deleted].sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Subsample means
+        sub_mean = np.where(kept > 0, (total - removed_sum) / kept, np.nan)
+        if func == 'mean':
+            return np.array(sub_mean)
+
+        # Subsample standard deviations (ddof=1). Removing values with
+        # deviations dev_r from the full mean leaves the sum of squared
+        # deviations sum(dev^2) - sum(dev_r^2) - sum(dev_r)^2 / kept.
+        ss = np.sum(dev ** 2) - removed_dev2 - removed_dev ** 2 / kept
+        sub_std = np.where(kept > 1,
+                           np.sqrt(np.maximum(ss, 0.0) / (kept - 1)), np.nan)
+        if func == 'std':
+            return np.array(sub_std)
+        return np.array(sub_std / sub_mean)
+
+
+# Built-in statistics with closed form jackknife values
+_STATISTICS: dict[str, Callable[[npt.NDArray[np.float64]], float]] = {
+    'mean': lambda x: float(np.mean(x)),
+    'std': lambda x: float(np.std(x, ddof=1)),
+    'cv': lambda x: float(np.std(x, ddof=1) / np.mean(x))
+}
+
+
+def _check_statistic(func: str):
+    """
+    Raise a ValueError if func is not the name of a built-in statistic.
+    """
+    if func not in _STATISTICS:
+        raise ValueError(f"Unknown statistic: {func}")
+
+
+def _evaluate_rows(func: Callable[..., Any] | str,
+                   samples: npt.NDArray[np.float64],
+                   batched: bool) -> npt.NDArray[np.float64]:
+    """
+    Evaluate a statistic on each row of a 2D array of samples. Built-in
+    statistics and batched functions are evaluated on all rows at once,
+    other functions are called once per row.
+    """
+    if isinstance(func, str):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.mean(samples, axis=1)
+            if func == 'mean':
+                return np.array(mean)
+            std = np.std(samples, ddof=1, axis=1) \
+                if samples.shape[1] > 1 else np.full(len(samples), np.nan)
+            if func == 'std':
+                return np.array(std)
+            return np.array(std / mean)
+    if batched:
+        return np.asarray(func(samples, axis=1), dtype=np.float64)
+    return np.array([func(sample) for sample in samples], dtype=np.float64)
+
+
+def _jackknife_values(func: Callable[..., Any] | str,
+                      data: npt.NDArray[np.float64],
+                      unit_index: npt.NDArray[np.intp],
+                      deleted: npt.NDArray[np.intp],
+                      batched: bool) -> npt.NDArray[np.float64]:
+    """
+    Values of a statistic on the jackknife samples, where sample j holds the
+    data not in the units deleted[j], and data value i belongs to unit
+    unit_index[i].
+    """
+
+    if isinstance(func, str):
+        return _subsample_statistics(func, data, unit_index, deleted)
+
+    # Placeholder for function evaluations on the jackknife samples
+    n = len(data)
+    n_units = int(unit_index.max(initial=-1)) + 1
+    jks = np.zeros(len(deleted))
+
+    # Jackknife samples of equal length are evaluated together, in
+    # batches of rows of an index matrix of the kept values. The deleted
+    # units of each batch are marked per batch, to bound the memory used.
+    kept = n - np.bincount(unit_index, minlength=n_units)[deleted].sum(axis=1)
+    batch_size = max(_BATCH_VALUES // max(n, 1), 1)
+    for length in np.unique(kept):
+        rows = np.flatnonzero(kept == length)
+        for b in range(0, len(rows), batch_size):
+            batch = rows[b:b + batch_size]
+            is_deleted = np.zeros((len(batch), n_units), dtype=bool)
+            is_deleted[np.arange(len(batch))[:, np.newaxis],
+                       deleted[batch]] = True
+            keep = ~is_deleted[:, unit_index]
+            index = np.nonzero(keep)[1].reshape(len(batch), length)
+
+            # Evaluate function on all jackknife samples in the batch
+            jks[batch] = _evaluate_rows(func, data[index], batched)
+    return jks
+
+
+def jackknife(func: Callable[..., Any] | str,
+              data: npt.NDArray[np.float64],
+              batched: bool = False,
+              d: int = 1,
+              groups: npt.ArrayLike | None = None) -> tuple[float, float]:
     """
     Jackknife resampling to estimate the standard error of a distribution
     property.
     Parameters:
-         func: the function describing the distribution property of interest.
+         func: the function describing the distribution property of interest,
+               or the name of a built-in statistic: 'mean', 'std' (sample
+               standard deviation, ddof=1) or 'cv' (coefficient of
+               variation, std/mean). The built-in statistics are computed in
+               closed form from sums over the deleted data.
          data: a sample of the distribution.
+         batched: if True, func is called with a batch of jackknife
+                  samples as the rows of a 2D array and the keyword argument
+                  axis=1, and must return one value per row. Otherwise func
+                  is called once per jackknife sample.
+         d: the number of data values (or blocks) deleted from each
+            jackknife sample. All combinations are used.
+         groups: optional block labels, one per data value. If given, whole
+                 blocks of data with the same label are deleted at a time
+                 (block jackknife), e.g. to account for correlated data.
     Returns:
         A tuple with two floats: the first is the estimate of the mean (simply
         the function evaluated on the entire data sample), the second is the
         jackknife estimate of the standard error on the mean.
     """
 
-    # Number of jackknife samples to generate
+    # Units deleted from the jackknife samples: single values or blocks
     n = len(data)
+    if groups is None:
+        unit_index = np.arange(n)
+    else:
+        _, unit_index = np.unique(np.asarray(groups), return_inverse=True)
+        unit_index = unit_index.reshape(-1)
+        if len(unit_index) != n:
+            raise ValueError(f"Number of groups does not match data: "
+                             f"{len(unit_index)} != {n}")
+    n_units = int(unit_index.max(initial=-1)) + 1
+    if d < 1 or (n_units > 0 and d > n_units):
+        raise ValueError(f"Cannot delete {d} of {n_units} values")
+    if comb(n_units, d) > _MAX_SUBSAMPLES:
+        raise ValueError(f"Too many jackknife samples: "
+                         f"{comb(n_units, d)} > {_MAX_SUBSAMPLES}")
 
-    # Placeholder for function evaluations on the jackknife samples
-    jks = np.zeros_like(data)
+    # Index matrix of the deleted units in each jackknife sample
+    deleted = _deleted_units(n_units, d)
 
-    # Evaluate function on all jackknife samples
-    for i in range(n):
-        jks[i] = func(np.delete(data, i))
+    if isinstance(func, str):
+        _check_statistic(func)
+        estimate = _STATISTICS[func](data)
+    else:
+        estimate = func(data)
+    jks = _jackknife_values(func, data, unit_index, deleted, batched)
 
     # Evaluate jackknife mean and compute standard error
     jkm = np.mean(jks)
-    se = np.sqrt(((n-1)/n)*np.sum(np.pow(jks-jkm, 2)))
+    factor = np.float64(n_units - d) / (d * len(jks))
+    se = np.sqrt(factor*np.sum(np.pow(jks-jkm, 2)))
+
+    return estimate, se
+
+
+def bootstrap(func: Callable[..., Any] | str,
+              data: npt.NDArray[np.float64],
+              n_resamples: int = 2000,
+              seed: int | None = None,
+              confidence: float = 0.95,
+              method: str = 'percentile',
+              batched: bool = False,
+              workers: int | None = None
+              ) -> tuple[float, float, tuple[float, float]]:
+    """
+    Bootstrap resampling to estimate the standard error and a confidence
+    interval of a distribution property.
+    Parameters:
+         func: the function describing the distribution property of interest,
+               or the name of a built-in statistic: 'mean', 'std' (sample
+               standard deviation, ddof=1) or 'cv' (coefficient of
+               variation, std/mean). Built-in statistics are evaluated on all
+               resamples at once.
+         data: a sample of the distribution.
+         n_resamples: the number of bootstrap resamples.
+         seed: seed for the random number generator. Runs with the same seed
+               give the same result.
+         confidence: the confidence level of the interval.
+         method: 'percentile' for the percentile interval or 'bca' for the
+                 bias-corrected and accelerated interval.
+         batched: if True, func is called with a batch of resamples as the
+                  rows of a 2D array and the keyword argument axis=1, and
+                  must return one value per row. Otherwise func is called
+                  once per resample.
+         workers: if given, resamples are evaluated in a pool of this many
+                  processes. func must then be picklable (e.g. a module
+                  level function). Not used for built-in statistics.
+    Returns:
+        A tuple with three values: the estimate (the function evaluated on
+        the entire data sample), the bootstrap estimate of the standard error
+        and a tuple with the lower and upper limits of the confidence
+        interval.
+    """
+
+    if method not in ('percentile', 'bca'):
+        raise ValueError(f"Unknown confidence interval method: {method}")
+    if isinstance(func, str):
+        _check_statistic(func)
+        estimate = _STATISTICS[func](data)
+    else:
+        estimate = func(data)
+
+    # Index matrix of all resamples, drawn with replacement
+    n = len(data)
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0, n, size=(n_resamples, n))
+
+    # Evaluate function on the resamples, in batches of rows
+    batch_size = max(_BATCH_VALUES // max(n, 1), 1)
+    if workers is None or workers < 2 or isinstance(func, str):
+        values = [_evaluate_rows(func, data[index[b:b + batch_size]], batched)
+                  for b in range(0, n_resamples, batch_size)]
+    else:
+        n_batches = max(workers, -(-n_resamples // batch_size))
+        batches = np.array_split(index, n_batches)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            values = list(executor.map(_evaluate_rows, repeat(func),
+                                       (data[b] for b in batches),
+                                       repeat(batched)))
+    boot = np.concatenate(values)
+    se = np.std(boot, ddof=1)
 
-    return func(data), se
+    # Quantiles of the bootstrap distribution bounding the interval
+    alpha = 0.5 * (1.0 - confidence)
+    quantiles = np.array([alpha, 1.0 - alpha])
+    if method == 'bca':
+        # Bias correction from the fraction of resamples below the estimate
+        # and acceleration from the skewness of the jackknife values
+        jks = _jackknife_values(func, data, np.arange(n),
+                                _deleted_units(n, 1), batched)
+        diff = np.mean(jks) - jks
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z0 = ndtri(np.mean(boot < estimate))
+            a = np.sum(diff ** 3) / (6.0 * np.sum(diff ** 2) ** 1.5)
+            z = z0 + ndtri(quantiles)
+            quantiles = ndtr(z0 + z / (1.0 - a * z))
+    if np.any(np.isnan(boot)) or not np.all(np.isfinite(quantiles)):
+        return estimate, se, (np.nan, np.nan)
+    low, high = np.quantile(boot, quantiles)
+    return estimate, se, (float(low), float(high))
@@ -1,6 +1,7 @@
 import numpy as np
 import numpy.typing as npt
 import scipy.optimize as so
+from collections.abc import Sequence
 from typing import Any
 
 
@@ -95,6 +96,183 @@ def nema_fwhm_from_line_profile(
     return float(xr - xl), img_dict
 
 
+def nema_widths_batch(
+        line_profiles: npt.NDArray[np.float64],
+        fractions: Sequence[float] = (0.5, 0.1)) \
+        -> dict[str, npt.NDArray[Any]]:
+    """
+    Compute the full widths at a set of fractions of the maximum (e.g. FWHM
+    and FWTM) of a stack of equal length line profiles according to the
+    NEMA algorithm (see nema_fwhm_from_line_profile), for all profiles and
+    fractions at once. The peak is found once per profile, and the
+    crossings of all levels are found in one search. The results are
+    returned as arrays, with one row per profile and one column per
+    fraction where it applies:
+        widths      --  The computed widths, an (m, k) array.
+        x1          --  The index of the first of the three points included in
+                        the polynomial fit.
+        coeffs      --  The coefficients (a, b, c) of the 2nd deg. polynomial
+                        a * x**2 + b * x + c fitted to the three points
+                        (assuming the line profile starts at x=0), as an
+                        (m, 3) array.
+        levels      --  The fractions of the maximum of the polynomial.
+        left        --  The index of the point just before the line profile
+                        goes above each level.
+        left_int    --  The interpolated x-value where the line profile goes
+                        above each level.
+        right       --  The index of the point just before the line profile
+                        goes below each level.
+        right_int   --  The interpolated x-value where the line profile goes
+                        below each level.
+    Profiles with the maximum at either end get NaN values (and index -1),
+    as do levels without crossings on both sides of the maximum, e.g. when
+    a tail of the profile is cut off above the level.
+    Arguments:
+        line_profiles   --  The line profiles, one per row
+        fractions       --  The fractions of the maximum to find widths at
+    Returns:
+        A dict with the arrays described above.
+    """
+
+    y = np.asarray(line_profiles, dtype=np.float64)
+    f = np.asarray(fractions, dtype=np.float64)
+    m, n = y.shape
+    rows = np.arange(m)[:, np.newaxis]
+
+    # Find maximum point and neighbours
+    x2 = np.argmax(y, axis=1)
+    peak_valid = (x2 > 0) & (x2 < n - 1)
+    x2 = np.clip(x2, 1, max(n - 2, 1))
+    x1 = x2 - 1
+    x3 = x2 + 1
+
+    # Corresponding y-values.
+    y1 = y[rows[:, 0], x1]
+    y2 = y[rows[:, 0], x2]
+    y3 = y[rows[:, 0], x3]
+
+    # Solve second degree polynomial
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d = (x1 - x2) * (x1 - x3) * (x2 - x3)
+        a = (x3 * (y2 - y1) + x2 * (y1 - y3) + x1 * (y3 - y2)) / d
+        b = ((x1 * x1) * (y2 - y3) +
+             (x3 * x3) * (y1 - y2) +
+             (x2 * x2) * (y3 - y1)) / d
+        c = ((x2 * x2) * (x3 * y1 - x1 * y3) +
+             x2 * (x1 * x1 * y3 - x3 * x3 * y1) +
+             x1 * x3 * (x3 - x1) * y2) / d
+
+        # Calculate the levels, f times the maximum of the polynomial
+        level = ((4 * a * c - b * b)[:, np.newaxis]
+                 / (4 * a[:, np.newaxis] / f))
+
+    # Left crossings: the first point from index 1 on at or above each level,
+    # preceded by a point below it
+    y_next = y[:, np.newaxis, 1:]
+    above = y_next >= level[:, :, np.newaxis]
+    left = np.argmax(above, axis=2)
+    valid = (peak_valid[:, np.newaxis] & np.any(above, axis=2)
+             & (y[rows, left] < level))
+
+    # Right crossings: the first point from there on followed by a point at
+    # or below each level
+    k = np.arange(n - 1)
+    below = ((y_next <= level[:, :, np.newaxis])
+             & (k > left[:, :, np.newaxis]))
+    right = np.argmax(below, axis=2)
+    valid &= np.any(below, axis=2)
+
+    # Interpolate crossings
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xl = left + (level - y[rows, left]) / (y[rows, left + 1]
+                                               - y[rows, left])
+        xr = right + ((level - y[rows, right])
+                      / (y[rows, right + 1] - y[rows, right]))
+        widths = xr - xl
+
+    def _float(v: npt.NDArray[Any]) -> npt.NDArray[np.float64]:
+        return np.where(valid, v, np.nan)
+
+    def _index(v: npt.NDArray[Any]) -> npt.NDArray[np.intp]:
+        return np.where(valid, v, -1)
+
+    return {
+        'widths': _float(widths),
+        'x1': np.where(peak_valid, x1, -1),
+        'coeffs': np.where(peak_valid[:, np.newaxis],
+                           np.stack([a, b, c], axis=1), np.nan),
+        'levels': _float(level),
+        'left': _index(left),
+        'left_int': _float(xl),
+        'right': _index(right),
+        'right_int': _float(xr)
+    }
+
+
+def nema_fwhm_batch(
+        line_profiles: npt.NDArray[np.float64]) \
+        -> dict[str, npt.NDArray[Any]]:
+    """
+    Compute FWHMs of a stack of equal length line profiles according to the
+    NEMA algorithm (see nema_fwhm_from_line_profile), for all profiles at
+    once. Instead of a dict per profile, the documentation of the
+    calculation is returned as arrays with one element per profile:
+        fwhm        --  The computed FWHM.
+        x1          --  The index of the first of the three points included in
+                        the polynomial fit.
+        coeffs      --  The coefficients (a, b, c) of the 2nd deg. polynomial
+                        a * x**2 + b * x + c fitted to the three points
+                        (assuming the line profile starts at x=0), as an
+                        (m, 3) array.
+        hm          --  The half-maximum value of the polynomial.
+        left        --  The index of the point just before the line profile
+                        goes above the half maximum value.
+        left_int    --  The interpolated x-value where the line profile goes
+                        above the half maximum value.
+        right       --  The index of the point just before the line profile
+                        goes below the half maximum value.
+        right_int   --  The interpolated x-value where the line profile goes
+                        below the half maximum value.
+    Profiles with the maximum at either end, or without half maximum
+    crossings on both sides of the maximum, get NaN values (and index -1).
+    Arguments:
+        line_profiles   --  The line profiles, one per row
+    Returns:
+        A dict with the arrays described above.
+    """
+
+    res = nema_widths_batch(line_profiles, [0.5])
+    valid = ~np.isnan(res['widths'][:, 0])
+    return {
+        'fwhm': res['widths'][:, 0],
+        'x1': np.where(valid, res['x1'], -1),
+        'coeffs': np.where(valid[:, np.newaxis], res['coeffs'], np.nan),
+        'hm': res['levels'][:, 0],
+        'left': res['left'][:, 0],
+        'left_int': res['left_int'][:, 0],
+        'right': res['right'][:, 0],
+        'right_int': res['right_int'][:, 0]
+    }
+
+
+def nema_widths_from_line_profile(
+        line_profile: npt.NDArray[np.float64],
+        fractions: Sequence[float] = (0.5, 0.1)) -> list[float]:
+    """
+    Compute the full widths of a line profile at a set of fractions of the
+    maximum according to the NEMA algorithm (see nema_widths_batch). With
+    fractions 0.5 and 0.1 the widths are the FWHM and the FWTM.
+    Arguments:
+        line_profile    --  The line profile of the source
+        fractions       --  The fractions of the maximum to find widths at
+    Returns:
+        The widths at each fraction (NaN where no width was found).
+    """
+    res = nema_widths_batch(np.asarray(line_profile)[np.newaxis, :],
+                            fractions)
+    return [float(w) for w in res['widths'][0]]
+
+
 def _gauss(x: npt.NDArray[np.float64],
            a: float, b: float, w: float) -> npt.NDArray[np.float64]:
     """
@@ -103,8 +281,63 @@ def _gauss(x: npt.NDArray[np.float64],
     return np.array(a * np.exp(-4 * np.log(2.0) * (x - b)**2 / (w ** 2)))
 
 
+def _gauss_jacobian(x: npt.NDArray[np.float64],
+                    a: float, b: float, w: float) -> npt.NDArray[np.float64]:
+    """
+    The derivatives of _gauss with respect to a, b and w, as columns.
+    """
+    return np.array(_gauss_batch(x, np.array([[a, b, w]]))[1][0])
+
+
+def _gauss_initial_guess(
+        y: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """
+    Initial values (a, b, w) of a gaussian fit for each row of a stack of
+    line profiles. The logarithm of a gaussian is a parabola, so a parabola
+    through the logarithms of the maximum point and its two neighbours
+    gives all three parameters in closed form. Where the maximum is at the
+    end of the profile or the points are not all positive, the parameters
+    are estimated from the moments of the profile instead. If that also
+    fails, the guess is the maximum value at the centre with a FWHM of 1.
+    """
+
+    m, n = y.shape
+    x = np.arange(n, dtype=np.float64)
+    rows = np.arange(m)
+
+    # Default: maximum value at the centre of the profile
+    p0 = np.stack([np.max(y, axis=1), np.full(m, n / 2), np.ones(m)],
+                  axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Moments of the profile, clipped at zero
+        yc = np.maximum(y, 0.0)
+        total = np.sum(yc, axis=1)
+        mean = np.sum(yc * x, axis=1) / total
+        var = np.sum(yc * (x - mean[:, np.newaxis]) ** 2, axis=1) / total
+        w = np.sqrt(8 * np.log(2.0) * var)
+        a = np.max(y, axis=1)
+        ok = np.isfinite(mean) & np.isfinite(w) & (w > 0)
+        p0[ok] = np.stack([a, mean, w], axis=1)[ok]
+
+        # Parabola through the logarithm of the maximum and its neighbours
+        k = np.clip(np.argmax(y, axis=1), 1, max(n - 2, 1))
+        if n >= 3:
+            log_y = np.log(y[rows[:, np.newaxis], k[:, np.newaxis]
+                             + np.arange(-1, 2)])
+            curv = log_y[:, 0] - 2 * log_y[:, 1] + log_y[:, 2]
+            offset = 0.5 * (log_y[:, 0] - log_y[:, 2]) / curv
+            w = np.sqrt(-8 * np.log(2.0) / curv)
+            a = np.exp(log_y[:, 1] - 0.5 * curv * offset ** 2)
+            ok = (np.all(np.isfinite(log_y), axis=1) & (curv < 0)
+                  & (np.abs(offset) <= 1.0) & np.isfinite(a) & (w > 0))
+            p0[ok] = np.stack([a, k + offset, w], axis=1)[ok]
+    return p0
+
+
 def gaussfit_fwhm_from_line_profile(
-        line_profile: npt.NDArray[np.float64]) \
+        line_profile: npt.NDArray[np.float64],
+        fast_tol: float = 1e-6) \
         -> list[float]:
     """
     Compute FWHM of a line profile by fitting a gaussian. The gaussian is
@@ -112,18 +345,157 @@ def gaussfit_fwhm_from_line_profile(
     y = a * exp(-4 * np.log(2.0) * (x - b)**2 / (w ** 2)).
     It is assumed that the line profile starts at x=0 and that the distance
     between the points is 1. The FWHM is w.
+    The fit starts from a closed form estimate (see _gauss_initial_guess).
+    If the residual norm of the estimate is already below fast_tol times
+    the norm of the profile, the estimate is returned without fitting.
     Arguments:
         line_profile  --  The line profile of the source
+        fast_tol      --  Relative residual tolerance of the closed form
+                          estimate
     Returns:
         The optimal parameters of the gauss function: a, b, w
     """
 
     # Construct artificial x-axis
-    x = np.arange(len(line_profile))
+    x = np.arange(len(line_profile), dtype=np.float64)
 
-    # Guess starting values
-    p0 = [np.max(line_profile), len(line_profile)/2, 1.0]
+    # Guess starting values, and skip the fit if they are good enough
+    y = np.asarray(line_profile, dtype=np.float64)
+    p0 = _gauss_initial_guess(y[np.newaxis, :])[0]
+    residual = y - _gauss(x, *p0)
+    if np.sum(residual ** 2) <= fast_tol ** 2 * np.sum(y ** 2):
+        return list(p0)
 
     # Fit and return optimal values
-    p = so.curve_fit(_gauss, x, line_profile, p0)
+    p = so.curve_fit(_gauss, x, line_profile, p0, jac=_gauss_jacobian,
+                     ftol=1e-12, xtol=1e-12)
     return list(p[0])
+
+
+def _gauss_batch(
+        x: npt.NDArray[np.float64],
+        p: npt.NDArray[np.float64]) \
+        -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """
+    Gaussian bell curves (see _gauss) and their Jacobians for a stack of
+    parameter rows p = (a, b, w). Returns the (m, n) function values at x
+    and the (m, n, 3) derivatives with respect to a, b and w.
+    """
+    a, b, w = p[:, 0:1], p[:, 1:2], p[:, 2:3]
+    k = 4 * np.log(2.0)
+    e = np.exp(-k * (x - b)**2 / (w ** 2))
+    f = a * e
+    jac = np.stack([e,
+                    f * 2 * k * (x - b) / w ** 2,
+                    f * 2 * k * (x - b) ** 2 / w ** 3], axis=-1)
+    return f, jac
+
+
+def gaussfit_fwhm_batch(
+        line_profiles: npt.NDArray[np.float64],
+        max_iter: int = 200,
+        tol: float = 1e-10,
+        fast_tol: float = 1e-6) \
+        -> tuple[npt.NDArray[np.float64], npt.NDArray[np.bool_]]:
+    """
+    Compute FWHMs of a stack of equal length line profiles by fitting a
+    gaussian to each (see gaussfit_fwhm_from_line_profile), starting from
+    the same closed form estimates. All profiles are fitted at once with a
+    vectorized Levenberg-Marquardt iteration. A profile's fit stops as soon
+    as it has converged, so the result for a profile does not depend on
+    the other profiles in the stack.
+    Arguments:
+        line_profiles   --  The line profiles, one per row
+        max_iter        --  The maximum number of iterations
+        tol             --  Convergence tolerance on the relative step size.
+                            A fit also stops when the sum of squared
+                            residuals stops decreasing.
+        fast_tol        --  Relative residual tolerance below which the
+                            closed form estimate is returned unfitted
+    Returns:
+        A tuple with the following values:
+            --  The optimal parameters of the gauss function for each
+                profile, an (m, 3) array with columns a, b, w (w >= 0)
+            --  Boolean array of the profiles where the fit converged
+    """
+
+    y = np.asarray(line_profiles, dtype=np.float64)
+    m, n = y.shape
+
+    # Construct artificial x-axis
+    x = np.arange(n, dtype=np.float64)
+
+    # Guess starting values. Fits are skipped where the closed form
+    # estimate already meets the residual tolerance.
+    p = _gauss_initial_guess(y)
+    f, jac = _gauss_batch(x, p)
+    r = y - f
+    cost = np.sum(r ** 2, axis=1)
+    fast = cost <= fast_tol ** 2 * np.sum(y ** 2, axis=1)
+
+    # Damping factors, parameter scales and the profiles still being fitted
+    lam = np.full(m, 1e-3)
+    nu = np.full(m, 2.0)
+    scale = np.zeros((m, 3))
+    converged = fast | (cost == 0.0)
+    active = np.flatnonzero(~converged)
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+
+        # Damped normal equations (J^T J + lam D) dp = J^T r, where D holds
+        # the largest diagonal of J^T J seen so far for each parameter
+        ja = jac[active]
+        jtj = np.sum(ja[:, :, :, np.newaxis] * ja[:, :, np.newaxis, :],
+                     axis=1)
+        jtr = np.sum(ja * r[active, :, np.newaxis], axis=1)
+        scale[active] = np.maximum(scale[active],
+                                   np.diagonal(jtj, axis1=1, axis2=2))
+        diag = np.maximum(scale[active], np.finfo(np.float64).tiny)
+        a_mat = jtj + (lam[active, np.newaxis, np.newaxis]
+                       * np.eye(3) * diag[:, np.newaxis, :])
+        step = np.linalg.solve(a_mat, jtr[:, :, np.newaxis])[:, :, 0]
+
+        # Actual and predicted decrease of the sum of squared residuals
+        p_new = p[active] + step
+        f_new, jac_new = _gauss_batch(x, p_new)
+        r_new = y[active] - f_new
+        cost_new = np.sum(r_new ** 2, axis=1)
+        decrease = cost[active] - cost_new
+        predicted = np.sum(step * (lam[active, np.newaxis] * diag * step
+                                   + jtr), axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rho = decrease / predicted
+        accept = (decrease > 0.0) & np.isfinite(cost_new)
+
+        # Check convergence of the accepted steps
+        small_step = np.all(np.abs(step) <= tol * (np.abs(p_new) + tol),
+                            axis=1)
+        small_decrease = decrease <= 4 * np.finfo(np.float64).eps * cost[
+            active]
+        done = accept & (small_step | small_decrease)
+
+        # Update accepted fits and the damping (Nielsen's strategy)
+        acc = active[accept]
+        p[acc] = p_new[accept]
+        jac[acc] = jac_new[accept]
+        r[acc] = r_new[accept]
+        cost[acc] = cost_new[accept]
+        lam[acc] *= np.maximum(1.0 / 3.0,
+                               1.0 - (2.0 * np.clip(rho[accept], 0, 1)
+                                      - 1.0) ** 3)
+        nu[acc] = 2.0
+        rej = active[~accept]
+        lam[rej] *= nu[rej]
+        nu[rej] *= 2.0
+
+        # Rejected steps below the resolution of the parameters leave the
+        # fit at its minimum
+        stuck = ~accept & small_step
+        converged[active[done | stuck]] = True
+        active = active[~(done | stuck)]
+
+    # The fit only depends on the square of the width
+    p[:, 2] = np.abs(p[:, 2])
+    converged &= np.all(np.isfinite(p), axis=1)
+    return p, converged
@@ -0,0 +1,207 @@
+import SimpleITK as sitk
+import numpy as np
+import numpy.typing as npt
+from typing import Any
+
+from .roi import SparseROI
+
+
+# Number of voxels handled at a time when computing deviations
+_CHUNK_VOXELS = 2 ** 20
+
+
+def _array_view(image: sitk.Image | npt.ArrayLike) -> npt.NDArray[Any]:
+    """
+    View of the voxels of an image or array in (z, y, x) order, without
+    copying the data where possible.
+    """
+    if isinstance(image, sitk.Image):
+        return sitk.GetArrayViewFromImage(image)
+    return np.asarray(image)
+
+
+def _key_dtype(n_keys: int) -> type[np.unsignedinteger[Any]]:
+    """
+    The smallest unsigned integer type holding the keys 0, ..., n_keys - 1.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_keys <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+def label_statistics(image: sitk.Image | npt.ArrayLike,
+                     labels: sitk.Image | npt.ArrayLike | SparseROI,
+                     weights: sitk.Image | npt.ArrayLike | None = None,
+                     per_slice: bool = False) -> dict[str, npt.NDArray[Any]]:
+    """
+    Compute statistics of the voxel values of an image inside every label of
+    a label image, similar to SimpleITK.LabelStatisticsImageFilter. The
+    label image is read through a view of its voxels, and all labels are
+    handled together with np.bincount, so the statistics of all labels take
+    a few sweeps over the voxels whatever the number of labels.
+    The statistics are returned in a dict object with the keys:
+        count       --  The number of voxels with the label (the sum of
+                        their weights, if weights are given).
+        sum         --  The (weighted) sum of the voxel values.
+        mean        --  The (weighted) mean of the voxel values.
+        variance    --  The sample variance of the voxel values (the
+                        weighted sum of squared deviations from the mean
+                        divided by count - 1).
+        min         --  The minimum voxel value.
+        max         --  The maximum voxel value.
+        first_slice --  The first z-slice (first array axis) with a voxel
+                        of the label.
+        last_slice  --  The last z-slice with a voxel of the label.
+    Entry k of each array belongs to the label k, for k from 0 to the largest
+    label. Statistics that are not defined for a label (e.g. the mean of a
+    label without voxels) are NaN. With weights, voxels with zero weight do
+    not count towards the minimum and maximum.
+    If the labels are given as a SparseROI, only the voxels of the ROI are
+    read from the image and label 0 has no voxels. The weights of the ROI,
+    if any, multiply the given weights.
+
+    Arguments:
+        image       --  The image (SimpleITK Image or array).
+        labels      --  Non-negative integer (or boolean) labels of the
+                        voxels, with the same size as the image, or a
+                        SparseROI on the image grid.
+        weights     --  Optional weights of the voxels, e.g. partial volume
+                        fractions, with the same size as the image.
+        per_slice   --  If True, the statistics are computed for every label
+                        on every z-slice (first array axis) separately.
+    Returns:
+        A dict object with the statistics above. Each value is an array of
+        length n_labels, or of shape (n_labels, n_slices) with per_slice.
+    """
+
+    image_data = _array_view(image)
+    n_slices = image_data.shape[0] if image_data.ndim > 0 else 1
+    values = image_data.ravel()
+    slice_size = values.size // max(n_slices, 1)
+
+    # Flat voxel positions of the values read, or None for all voxels in
+    # memory order
+    positions = None
+    if isinstance(labels, SparseROI):
+        if image_data.shape != labels.size[::-1]:
+            raise ValueError(f"Image and ROI differ in size "
+                             f"({image_data.shape[::-1]} and {labels.size})")
+        positions = labels.indices
+        label_data = labels.labels()
+        if weights is not None:
+            weights = _array_view(weights).ravel()[positions]
+        if labels.weights is not None:
+            weights = (labels.weights if weights is None
+                       else labels.weights * weights)
+        values = values[positions]
+    else:
+        label_data = _array_view(labels).ravel()
+    if label_data.dtype == np.bool_:
+        label_data = label_data.view(np.uint8)
+    if label_data.shape != values.shape:
+        raise ValueError(f"Image and labels differ in size "
+                         f"({values.size} and {label_data.size} voxels)")
+    if (np.issubdtype(label_data.dtype, np.signedinteger)
+            and label_data.size > 0 and np.min(label_data) < 0):
+        raise ValueError("Labels must be non-negative")
+    n_labels = int(np.max(label_data)) + 1 if label_data.size > 0 else 1
+    if isinstance(labels, SparseROI):
+        n_labels = labels.n_labels + 1
+    w = None
+    if weights is not None:
+        w = _array_view(weights).ravel().astype(np.float64, copy=False)
+        if w.shape != values.shape:
+            raise ValueError(f"Image and weights differ in size "
+                             f"({values.size} and {w.size} voxels)")
+
+    # Combine slice and label into one key
+    if per_slice:
+        n_keys = n_labels * n_slices
+        if positions is None:
+            keys = (label_data.reshape(n_slices, -1).astype(np.intp)
+                    * n_slices + np.arange(n_slices)[:, None]).ravel()
+        else:
+            keys = (label_data.astype(np.intp) * n_slices
+                    + positions // slice_size)
+    else:
+        n_keys = n_labels
+        keys = label_data
+
+    # Counts, sums and means of all keys
+    if w is None:
+        count = np.bincount(keys, minlength=n_keys).astype(np.float64)
+        total = np.bincount(keys, weights=values, minlength=n_keys)
+    else:
+        count = np.bincount(keys, weights=w, minlength=n_keys)
+        total = np.bincount(keys, weights=w * values, minlength=n_keys)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+
+    # Sum of squared deviations from the mean of each key, in chunks of
+    # voxels to bound the size of the temporary arrays
+    squares = np.zeros(n_keys)
+    chunk = max(_CHUNK_VOXELS, n_keys)
+    for lo in range(0, len(values), chunk):
+        part = slice(lo, lo + chunk)
+        dev = values[part] - mean[keys[part]]
+        squares += np.bincount(keys[part], weights=dev * dev if w is None
+                               else w[part] * dev * dev, minlength=n_keys)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.where(count > 1, squares / (count - 1), np.nan)
+
+    # Minimum, maximum and slice range of the labelled voxels, from the
+    # voxels sorted by key. Background voxels (label 0) and voxels with
+    # zero weight are left out of the sort.
+    selected = label_data != 0
+    if w is not None:
+        selected &= w != 0
+    voxels = np.flatnonzero(selected)
+    selected_keys = keys[voxels]
+    n = np.bincount(selected_keys, minlength=n_keys)
+    order = voxels[np.argsort(
+        selected_keys.astype(_key_dtype(n_keys), copy=False), kind='stable')]
+    present = n > 0
+    ends = np.cumsum(n)[present]
+    starts = ends - n[present]
+    sorted_values = values[order]
+    sorted_slices = (order if positions is None
+                     else positions[order]) // max(slice_size, 1)
+    minimum = np.full(n_keys, np.nan)
+    maximum = np.full(n_keys, np.nan)
+    first_slice = np.full(n_keys, np.nan)
+    last_slice = np.full(n_keys, np.nan)
+    if len(sorted_values) > 0:
+        minimum[present] = np.minimum.reduceat(sorted_values, starts)
+        maximum[present] = np.maximum.reduceat(sorted_values, starts)
+        first_slice[present] = np.minimum.reduceat(sorted_slices, starts)
+        last_slice[present] = np.maximum.reduceat(sorted_slices, starts)
+
+    # The same for the background, reduced slice by slice without sorting.
+    # A SparseROI has no background voxels.
+    if positions is None and values.size > 0:
+        background = ~selected if w is None else (label_data == 0) & (w != 0)
+        background = background.reshape(n_slices, -1)
+        grid = values.reshape(n_slices, -1)
+        info = (np.finfo if np.issubdtype(values.dtype, np.floating)
+                else np.iinfo)(values.dtype)
+        slice_min = np.min(grid, axis=1, where=background, initial=info.max)
+        slice_max = np.max(grid, axis=1, where=background, initial=info.min)
+        in_slice = np.flatnonzero(background.any(axis=1))
+        if per_slice:
+            # Keys 0, ..., n_slices - 1 are the background on each slice
+            minimum[in_slice] = slice_min[in_slice]
+            maximum[in_slice] = slice_max[in_slice]
+            first_slice[in_slice] = last_slice[in_slice] = in_slice
+        elif len(in_slice) > 0:
+            minimum[0] = np.min(slice_min[in_slice])
+            maximum[0] = np.max(slice_max[in_slice])
+            first_slice[0], last_slice[0] = in_slice[0], in_slice[-1]
+
+    stats = {'count': count, 'sum': total, 'mean': mean,
+             'variance': variance, 'min': minimum, 'max': maximum,
+             'first_slice': first_slice, 'last_slice': last_slice}
+    if per_slice:
+        stats = {key: value.reshape(n_labels, n_slices)
+                 for key, value in stats.items()}
+    return stats
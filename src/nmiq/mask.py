@@ -1,19 +1,44 @@
 import SimpleITK as sitk
+import multiprocessing
 import numpy as np
+import numpy.typing as npt
+import warnings
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any
+
+from .roi import SparseROI
+
+
+def _grid(image_spacing: tuple[float, ...],
+          image_origin: tuple[float, ...]) -> sitk.Image:
+    """
+    A single voxel image with the given spacing and origin, used to convert
+    between physical points and indices on an image grid without allocating
+    the full image.
+    """
+    grid = sitk.Image((1, 1, 1), sitk.sitkUInt8)
+    grid.SetSpacing(image_spacing)
+    grid.SetOrigin(image_origin)
+    return grid
 
 
 def _check_bounds(image: sitk.Image,
-                  physical_point: tuple[float, float, float]) -> bool:
+                  physical_point: tuple[float, float, float],
+                  size: tuple[int, ...] | None = None) -> bool:
     """
     Check whether a physical point is inside the image boundary (inside the
-    Brillouin zone of a voxel).
+    Brillouin zone of a voxel). If a size is given, the image is only used
+    for its geometry and the boundary is that of an image of the given size.
     """
 
     # Transform physical point to index
     index = image.TransformPhysicalPointToIndex(physical_point)
 
     # Get the image size
-    size = image.GetSize()
+    if size is None:
+        size = image.GetSize()
 
     # Check if the indices are within the image bounds
     for i in range(len(index)):
@@ -22,10 +47,355 @@ def _check_bounds(image: sitk.Image,
     return True
 
 
+def _index_coordinates(
+        image_spacing: tuple[float, ...],
+        image_origin: tuple[float, ...],
+        axis: int,
+        lower: int,
+        upper: int) -> npt.NDArray[np.float64]:
+    """
+    Physical coordinates of the voxel centres with indices lower, ...,
+    upper (both included) along one image axis.
+    """
+    return np.array(image_origin[axis] +
+                    image_spacing[axis] * np.arange(lower, upper + 1),
+                    dtype=np.float64)
+
+
+def _flat_indices(shape: tuple[int, ...],
+                  lower: tuple[int, ...],
+                  stencil: npt.NDArray[Any]) -> npt.NDArray[np.intp]:
+    """
+    Flat indices into a (z, y, x) array of the given shape of the non-zero
+    elements of a (z, y, x) stencil whose first element lies at index lower
+    (given in (z, y, x) order). The indices are in increasing order.
+    """
+    coords = np.nonzero(stencil)
+    indices: npt.NDArray[np.intp] = np.ravel_multi_index(
+        tuple(c + lo for c, lo in zip(coords, lower)), shape)
+    return indices
+
+
+def _disk(image_spacing: tuple[float, ...],
+          image_origin: tuple[float, ...],
+          lower_index: tuple[int, ...],
+          upper_index: tuple[int, ...],
+          center_x: float,
+          center_y: float,
+          radius: float) -> npt.NDArray[np.bool_]:
+    """
+    Boolean (y, x) array of the voxels in the in-plane box between
+    lower_index and upper_index (both included), whose centres lie at most
+    one radius away from the point (center_x, center_y).
+    """
+    vox_x = _index_coordinates(image_spacing, image_origin, 0,
+                               lower_index[0], upper_index[0])
+    vox_y = _index_coordinates(image_spacing, image_origin, 1,
+                               lower_index[1], upper_index[1])
+    return np.array((center_x - vox_x[np.newaxis, :]) ** 2 +
+                    (center_y - vox_y[:, np.newaxis]) ** 2
+                    <= radius ** 2)
+
+
+def _disk_kernel(image_spacing: tuple[float, ...],
+                 radius: float) -> npt.NDArray[np.bool_]:
+    """
+    Boolean (y, x) stencil of a disk with a given radius centred on the
+    middle element. The stencil extends ceil(radius / spacing) voxels to
+    each side of the centre.
+    """
+    x_idx_radius = int(np.ceil(radius / image_spacing[0]))
+    y_idx_radius = int(np.ceil(radius / image_spacing[1]))
+    dx = image_spacing[0] * np.arange(-x_idx_radius, x_idx_radius + 1)
+    dy = image_spacing[1] * np.arange(-y_idx_radius, y_idx_radius + 1)
+    return np.array(dx[np.newaxis, :] ** 2 + dy[:, np.newaxis] ** 2
+                    <= radius ** 2)
+
+
+def _disk_sum_lookup(slice_data: npt.NDArray[Any],
+                     kernel: npt.NDArray[np.bool_]) \
+        -> Callable[[tuple[int, int]], float]:
+    """
+    Disk sums of a (y, x) image slice with a disk stencil, computed when
+    first needed and cached. The returned function maps a voxel index
+    (ix, iy) to the voxel sum inside the disk centred on the voxel, or to
+    -inf where the stencil does not fit inside the slice.
+    Each sum costs one pass over the stencil, whose elements are added one
+    at a time in raster order, so every disk sum is added up in the same
+    order as a voxel-wise sum over the disk would be.
+    """
+    ny, nx = slice_data.shape
+    ky, kx = kernel.shape
+    ry, rx = ky // 2, kx // 2
+    data = slice_data.reshape(-1)
+    dy, dx = np.nonzero(kernel)
+    offsets = (dy - ry) * nx + (dx - rx)
+    cache: dict[tuple[int, int], float] = {}
+
+    def disk_sum(index: tuple[int, int]) -> float:
+        if index not in cache:
+            ix, iy = index
+            if ry <= iy < ny - ry and rx <= ix < nx - rx:
+                values = data[iy * nx + ix + offsets].astype(np.float64)
+                cache[index] = float(np.cumsum(values)[-1])
+            else:
+                cache[index] = -np.inf
+        return cache[index]
+
+    return disk_sum
+
+
+def _hill_climb(disk_sum: Callable[[tuple[int, int]], float],
+                start: tuple[int, int]) -> tuple[tuple[int, int], int]:
+    """
+    Greedy search for the maximum of the disk sums of a slice (see
+    _disk_sum_lookup). Starting from start = (ix, iy), every candidate that
+    improves on the best value so far has its four neighbours queued for
+    testing. Candidates where the disk does not fit are never accepted.
+    Returns the (ix, iy) index of the best candidate found and the number of
+    distinct candidates evaluated.
+    """
+    max_val = -1.0
+    max_index = (0, 0)
+    seen = set()
+    index_list = [start]
+    while index_list:
+
+        # Get next index to test
+        index = index_list.pop()
+        seen.add(index)
+        cur_val = disk_sum(index)
+
+        if cur_val > max_val:
+            # This is the optimal point so far.
+            # Save as new favorite and add neighbour points
+            # to search for better point yet
+            max_val = cur_val
+            max_index = index
+            index_list.append((index[0] - 1, index[1]))
+            index_list.append((index[0] + 1, index[1]))
+            index_list.append((index[0], index[1] - 1))
+            index_list.append((index[0], index[1] + 1))
+
+    return max_index, len(seen)
+
+
+def _fit_axis(points: npt.NDArray[np.float64],
+              z: npt.NDArray[np.float64]) \
+        -> tuple[npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """
+    Least squares fit of a straight line x = a + b * z, y = c + d * z through
+    a (n, 3) array of physical (x, y, z) points. With a single point the line
+    is parallel to the z-axis.
+    Returns the x- and y-coordinates of the line at the given z-values.
+    """
+    if len(points) < 2:
+        return (np.full(len(z), points[0, 0]),
+                np.full(len(z), points[0, 1]))
+    bx, ax = np.polyfit(points[:, 2], points[:, 0], 1)
+    by, ay = np.polyfit(points[:, 2], points[:, 1], 1)
+    return ax + bx * z, ay + by * z
+
+
+def _disk_weights(vox_x: npt.NDArray[np.float64],
+                  vox_y: npt.NDArray[np.float64],
+                  spacing: tuple[float, ...],
+                  centers_x: npt.NDArray[np.float64],
+                  centers_y: npt.NDArray[np.float64],
+                  radius: float,
+                  n_sub: int = 8) -> npt.NDArray[np.float64]:
+    """
+    Partial volume weights of a stack of disks. Each voxel, with centre at
+    (vox_x[ix], vox_y[iy]), is divided into n_sub x n_sub sub-voxels in the
+    plane, and its weight is the fraction of sub-voxel centres inside the
+    disk with centre (centers_x[k], centers_y[k]) on slice k.
+    Returns a (k, y, x) array of weights between 0 and 1.
+    """
+    offsets = (np.arange(n_sub) + 0.5) / n_sub - 0.5
+    cx = centers_x[:, np.newaxis, np.newaxis]
+    cy = centers_y[:, np.newaxis, np.newaxis]
+    dx = vox_x[np.newaxis, np.newaxis, :] - cx
+    dy = vox_y[np.newaxis, :, np.newaxis] - cy
+    weights = np.zeros((len(centers_x), len(vox_y), len(vox_x)))
+    for ox in offsets * spacing[0]:
+        for oy in offsets * spacing[1]:
+            weights += (dx + ox) ** 2 + (dy + oy) ** 2 <= radius ** 2
+    return np.array(weights / n_sub ** 2)
+
+
+def _disk_voxels(shape: tuple[int, ...],
+                 mask: sitk.Image,
+                 start_iz: int,
+                 centers_x: npt.NDArray[np.float64],
+                 centers_y: npt.NDArray[np.float64],
+                 radius: float,
+                 partial_volume: bool = False) \
+        -> tuple[npt.NDArray[np.intp], npt.NDArray[np.float32] | None]:
+    """
+    Find the voxels of a disk on each of the slices start_iz, start_iz + 1,
+    ... of a (z, y, x) voxel array of the given shape with the geometry of
+    mask. Slice start_iz + k has the disk centre at (centers_x[k],
+    centers_y[k]).
+    Returns the flat indices of the voxels whose centres lie at most one
+    radius from the disk centre. With partial_volume, the indices of all
+    voxels partly covered by the disk are returned together with the
+    fraction of each voxel covered by the disk, otherwise the weights are
+    None.
+    """
+
+    # Bounding box of all disks (with a margin of one voxel for partial
+    # volume), restricted to the label array
+    margin = (mask.GetSpacing()[0] if partial_volume else 0.0,
+              mask.GetSpacing()[1] if partial_volume else 0.0)
+    lower_index = mask.TransformPhysicalPointToIndex(
+        (float(np.min(centers_x)) - radius - margin[0],
+         float(np.min(centers_y)) - radius - margin[1],
+         mask.GetOrigin()[2]))
+    upper_index = mask.TransformPhysicalPointToIndex(
+        (float(np.max(centers_x)) + radius + margin[0],
+         float(np.max(centers_y)) + radius + margin[1],
+         mask.GetOrigin()[2]))
+    lower = [max(lower_index[i], 0) for i in range(2)]
+    upper = [min(upper_index[i], shape[2 - i] - 1) for i in range(2)]
+
+    vox_x = _index_coordinates(mask.GetSpacing(), mask.GetOrigin(), 0,
+                               lower[0], upper[0])
+    vox_y = _index_coordinates(mask.GetSpacing(), mask.GetOrigin(), 1,
+                               lower[1], upper[1])
+    box: npt.NDArray[Any]
+    if partial_volume:
+        box = _disk_weights(vox_x, vox_y, mask.GetSpacing(),
+                            centers_x, centers_y, radius)
+    else:
+        box = ((vox_x[np.newaxis, np.newaxis, :] -
+                centers_x[:, np.newaxis, np.newaxis]) ** 2 +
+               (vox_y[np.newaxis, :, np.newaxis] -
+                centers_y[:, np.newaxis, np.newaxis]) ** 2) <= radius ** 2
+    indices = _flat_indices(shape, (start_iz, lower[1], lower[0]), box)
+    if not partial_volume:
+        return indices, None
+    return indices, box[box > 0].astype(np.float32)
+
+
+def _subvoxel_offset(disk_sum: Callable[[tuple[int, int]], float],
+                     index: tuple[int, int]) -> tuple[float, float]:
+    """
+    Sub-voxel position of the maximum of the disk sums of a slice (see
+    _disk_sum_lookup) near the voxel index = (ix, iy), found by parabolic
+    interpolation through the voxel and its two neighbours along each axis
+    separately.
+    Returns the offsets (dx, dy) in voxels, each between -0.5 and 0.5. The
+    offset along an axis is zero if the disk does not fit at a neighbour or
+    the values do not form a maximum.
+    """
+    ix, iy = index
+    s_mid = disk_sum(index)
+    offsets = []
+    for lo, hi in (((ix - 1, iy), (ix + 1, iy)),
+                   ((ix, iy - 1), (ix, iy + 1))):
+        s_lo, s_hi = disk_sum(lo), disk_sum(hi)
+        curvature = s_lo - 2.0 * s_mid + s_hi
+        if not np.isfinite(curvature) or curvature >= 0.0:
+            offsets.append(0.0)
+            continue
+        offsets.append(float(np.clip(0.5 * (s_lo - s_hi) / curvature,
+                                     -0.5, 0.5)))
+    return offsets[0], offsets[1]
+
+
+def _search_slice(slice_data: npt.NDArray[Any],
+                  kernel: npt.NDArray[np.bool_],
+                  seed: tuple[int, int],
+                  subvoxel: bool = False) \
+        -> tuple[tuple[int, int], tuple[float, float], int]:
+    """
+    Search the disk sums of a (y, x) image slice for the hottest disk,
+    starting from seed (see _hill_climb).
+    Returns the (ix, iy) index of the best centre, its sub-voxel offset
+    (dx, dy) in voxels (zero unless subvoxel) and the number of candidates
+    evaluated.
+    """
+    disk_sum = _disk_sum_lookup(slice_data, kernel)
+    index, n_eval = _hill_climb(disk_sum, seed)
+    offset = _subvoxel_offset(disk_sum, index) if subvoxel else (0.0, 0.0)
+    return index, offset, n_eval
+
+
+def _search_slices(img_data: npt.NDArray[Any],
+                   slices: list[int],
+                   kernel: npt.NDArray[np.bool_],
+                   seed: tuple[int, int],
+                   warm_start: bool = False,
+                   subvoxel: bool = False,
+                   workers: int | None = None) \
+        -> Iterator[tuple[tuple[int, int], tuple[float, float], int]]:
+    """
+    Yield the search result (see _search_slice) of each z-slice in a list of
+    slice indices into a (z, y, x) voxel array, in the order of the list.
+    With warm start each slice is searched from the optimum of the previous
+    slice, the first one from the given seed. Without warm start every
+    slice is searched from the seed, and with more than one worker the
+    slices are searched concurrently in a pool of processes (the search is
+    pure Python, so threads would not run it in parallel). Every slice is
+    searched the same way whatever the number of workers.
+    """
+    if warm_start:
+        start = seed
+        for iz in slices:
+            res = _search_slice(img_data[iz], kernel, start, subvoxel)
+            start = res[0]
+            yield res
+        return
+
+    if workers is None or workers <= 1:
+        for iz in slices:
+            yield _search_slice(img_data[iz], kernel, seed, subvoxel)
+        return
+
+    # Spawned rather than forked workers, so the pool is safe to start from
+    # a process with threads
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context) as pool:
+        yield from pool.map(_search_slice,
+                            (np.array(img_data[iz]) for iz in slices),
+                            repeat(kernel), repeat(seed), repeat(subvoxel))
+
+
+def _sphere_voxels(shape: tuple[int, ...],
+                   image_spacing: tuple[float, ...],
+                   image_origin: tuple[float, ...],
+                   lower_index: tuple[int, ...],
+                   upper_index: tuple[int, ...],
+                   center: tuple[float, float, float],
+                   radius: float) -> npt.NDArray[np.intp]:
+    """
+    Flat indices of the voxels in a (z, y, x) voxel array of the given shape,
+    whose centres lie at most one radius away from the sphere centre. Only
+    voxels in the bounding box between lower_index and upper_index (both
+    included and given in (x, y, z) order) are considered.
+    """
+
+    # Restrict bounding box to the voxel array
+    lower = [max(lower_index[i], 0) for i in range(3)]
+    upper = [min(upper_index[i], shape[2 - i] - 1) for i in range(3)]
+
+    # Squared distances to the centre along each axis
+    d2 = [(_index_coordinates(image_spacing, image_origin, i,
+                              lower[i], upper[i]) - center[i]) ** 2
+          for i in range(3)]
+
+    # Sphere stencil in (z, y, x) order
+    stencil = ((d2[0][np.newaxis, np.newaxis, :] +
+                d2[1][np.newaxis, :, np.newaxis]) +
+               d2[2][:, np.newaxis, np.newaxis]) <= radius ** 2
+    return _flat_indices(shape, (lower[2], lower[1], lower[0]), stencil)
+
+
 def spheres_in_cylinder_3d(
         image_size: tuple[int, int, int],
-        image_spacing: tuple[int, int, int],
-        image_origin: tuple[int, int, int],
+        image_spacing: tuple[float, float, float],
+        image_origin: tuple[float, float, float],
         cylinder_start_z: float,
         cylinder_end_z: float,
         cylinder_center_x: float,
@@ -49,7 +419,8 @@ def spheres_in_cylinder_3d(
     voxel is deemed to belong to the sphere if its centre is at most one radius
     away from the centre point.
     All spheres will be given a separate integer label, which will be written
-    to the output SimpleITK image object.
+    to the output SimpleITK image object. The pixel type of the image is the
+    smallest unsigned integer type (8, 16 or 32 bit) that holds all labels.
     Parameters:
         image_size          --  The voxel grid dimension
         image_spacing       --  The physical spacing between voxels
@@ -62,10 +433,32 @@ def spheres_in_cylinder_3d(
         roi_radius          --  The radius of the spheres
     """
 
-    # Create the output image
-    img = sitk.Image(image_size, sitk.sitkUInt8)
-    img.SetOrigin(image_origin)
-    img.SetSpacing(image_spacing)
+    return sparse_spheres_in_cylinder_3d(
+        image_size, image_spacing, image_origin, cylinder_start_z,
+        cylinder_end_z, cylinder_center_x, cylinder_center_y,
+        cylinder_radius, roi_radius).to_image()
+
+
+def sparse_spheres_in_cylinder_3d(
+        image_size: tuple[int, int, int],
+        image_spacing: tuple[float, float, float],
+        image_origin: tuple[float, float, float],
+        cylinder_start_z: float,
+        cylinder_end_z: float,
+        cylinder_center_x: float,
+        cylinder_center_y: float,
+        cylinder_radius: float,
+        roi_radius: float) -> SparseROI:
+    """
+    Place spheres in a cylinder like spheres_in_cylinder_3d, but return the
+    labelled voxels of the spheres as a SparseROI (label k is sphere k)
+    instead of a dense label image. The centres of the spheres are kept in
+    the centres attribute of the ROI; all spheres in a layer of the cylinder
+    share the same centre z-coordinate.
+    """
+
+    # Image grid geometry
+    img = _grid(image_spacing, image_origin)
 
     # Sanity checks:
 
@@ -90,15 +483,15 @@ def spheres_in_cylinder_3d(
         (cyl_max_x, cyl_max_y, cylinder_end_z),
     ]
     for point in check_points:
-        if not _check_bounds(img, point):
+        if not _check_bounds(img, point, image_size):
             raise ValueError(
                 f"Cylinder exceeds image space: "
                 f"({point[0]}, {point[1]}, {point[2]}) outside image.")
 
     # Sanity checks OK - start masking
 
-    # Initiate sphere labels
-    label = 1
+    # Sphere centres, placed piece by piece and shell by shell
+    centres = []
 
     # Get the central z-cooridnate of the first cylinder piece.
     roi_center_z = cylinder_start_z + roi_radius
@@ -123,38 +516,13 @@ def spheres_in_cylinder_3d(
                     roi_radius / (conc_cylinder_radius - roi_radius)
                 ))
 
-            # Iterate through each ROI in the shell
-            for s in range(int(n)):
-                # Determine center point of ROI. (First sphere at 12 o'clock)
-                roi_center_x = (cylinder_center_x -
-                                placement_radius * np.sin(2 * s * np.pi / n))
-                roi_center_y = (cylinder_center_y -
-                                placement_radius * np.cos(2 * s * np.pi / n))
-                # Find a bounding box around centre voxel
-                lower_index = img.TransformPhysicalPointToIndex(
-                    (roi_center_x - roi_radius,
-                     roi_center_y - roi_radius,
-                     roi_center_z - roi_radius))
-                upper_index = img.TransformPhysicalPointToIndex(
-                    (roi_center_x + roi_radius,
-                     roi_center_y + roi_radius,
-                     roi_center_z + roi_radius)
-                )
-                # Iterate through bounding box to check if voxel belongs
-                for ix in range(lower_index[0], upper_index[0] + 1):
-                    for iy in range(lower_index[1], upper_index[1] + 1):
-                        for iz in range(lower_index[2], upper_index[2] + 1):
-                            voxel_center_point = (
-                                img.TransformIndexToPhysicalPoint((ix, iy, iz))
-                            )
-                            d2 = ((voxel_center_point[0] - roi_center_x) ** 2 +
-                                  (voxel_center_point[1] - roi_center_y) ** 2 +
-                                  (voxel_center_point[2] - roi_center_z) ** 2)
-                            if d2 <= roi_radius ** 2:
-                                # Voxel centre inside radius. Add to label.
-                                img.SetPixel(ix, iy, iz, label)
-
-                label = label + 1
+            # Centre points of all ROIs in the shell (first sphere at
+            # 12 o'clock)
+            angles = 2 * np.arange(int(n)) * np.pi / n
+            centres.append(np.column_stack((
+                cylinder_center_x - placement_radius * np.sin(angles),
+                cylinder_center_y - placement_radius * np.cos(angles),
+                np.full(int(n), roi_center_z))))
 
             # Decrease concentric shell radius by one sphere diamater and a
             # safety margin
@@ -164,19 +532,46 @@ def spheres_in_cylinder_3d(
 
         # Advance to next cylinder piece in the z-direction.
         roi_center_z = roi_center_z + 2 * roi_radius + img.GetSpacing()[2]
-
-    return img
+    sphere_centres = (np.concatenate(centres) if centres
+                      else np.empty((0, 3)))
+
+    # The label type of the dense image is the smallest one holding all
+    # sphere labels
+    n_spheres = len(sphere_centres)
+    dtype = next(t for t in (np.uint8, np.uint16, np.uint32)
+                 if n_spheres <= np.iinfo(t).max)
+
+    # Bounding boxes of all spheres (index of the voxels just outside)
+    spacing = np.array(image_spacing, dtype=np.float64)
+    origin = np.array(image_origin, dtype=np.float64)
+    lower_index = np.floor(
+        (sphere_centres - roi_radius - origin) / spacing).astype(int)
+    upper_index = np.ceil(
+        (sphere_centres + roi_radius - origin) / spacing).astype(int)
+
+    # Find the voxels of each sphere in its bounding box, labelled from 1
+    voxels = [_sphere_voxels(image_size[::-1], image_spacing, image_origin,
+                             tuple(lower_index[k]), tuple(upper_index[k]),
+                             tuple(sphere_centres[k]), roi_radius)
+              for k in range(n_spheres)]
+    offsets = np.concatenate(
+        ([0], np.cumsum([len(v) for v in voxels], dtype=np.intp)))
+    indices = (np.concatenate(voxels) if voxels
+               else np.empty(0, dtype=np.intp))
+    return SparseROI(image_size, image_spacing, image_origin,
+                     indices, offsets, dtype=dtype, centres=sphere_centres)
 
 
 def cylinder_3d(
         image_size: tuple[int, int, int],
-        image_spacing: tuple[int, int, int],
-        image_origin: tuple[int, int, int],
+        image_spacing: tuple[float, float, float],
+        image_origin: tuple[float, float, float],
         cylinder_start_z: float,
         cylinder_end_z: float,
         cylinder_center_x: float,
         cylinder_center_y: float,
-        cylinder_radius: float) -> sitk.Image:
+        cylinder_radius: float,
+        partial_volume: bool = False) -> sitk.Image:
     """
     Create a cylindrical mask at a given position.
 
@@ -191,11 +586,36 @@ def cylinder_3d(
          cylinder_center_x  --  Physical x-coordinate of the cylinder centre
          cylinder_center_y  --  Physical y-coordinate of the cylinder centre
          cylinder_radius    --  Cylinder radius (physical units)
+         partial_volume     --  Return a sitkFloat32 mask where each voxel
+                                holds the fraction of it (in the plane)
+                                covered by the cylinder, instead of a
+                                sitkUInt16 mask of the voxels with centres
+                                inside the cylinder (default: False)
+    """
+
+    return sparse_cylinder_3d(
+        image_size, image_spacing, image_origin, cylinder_start_z,
+        cylinder_end_z, cylinder_center_x, cylinder_center_y,
+        cylinder_radius, partial_volume).to_image()
+
+
+def sparse_cylinder_3d(
+        image_size: tuple[int, int, int],
+        image_spacing: tuple[float, float, float],
+        image_origin: tuple[float, float, float],
+        cylinder_start_z: float,
+        cylinder_end_z: float,
+        cylinder_center_x: float,
+        cylinder_center_y: float,
+        cylinder_radius: float,
+        partial_volume: bool = False) -> SparseROI:
+    """
+    Create a cylindrical mask like cylinder_3d, but return the voxels of the
+    cylinder as a SparseROI with a single label (and partial volume weights
+    if partial_volume is set) instead of a dense image.
     """
 
-    mask = sitk.Image(image_size, sitk.sitkUInt16)
-    mask.SetSpacing(image_spacing)
-    mask.SetOrigin(image_origin)
+    mask = _grid(image_spacing, image_origin)
 
     # Sanity checks:
 
@@ -209,7 +629,7 @@ def cylinder_3d(
         (cyl_max_x, cyl_max_y, cylinder_end_z),
     ]
     for point in check_points:
-        if not _check_bounds(mask, point):
+        if not _check_bounds(mask, point, image_size):
             raise ValueError(
                 f"Cylinder exceeds image space: "
                 f"({point[0]}, {point[1]}, {point[2]}) outside image.")
@@ -224,23 +644,40 @@ def cylinder_3d(
                         cylinder_end_z)
     max_index = mask.TransformPhysicalPointToIndex(max_search_point)
 
-    # Iterate through z-slices from start to end
-    iz = min_index[2]
-    while iz <= max_index[2]:
-
-        # Check all voxels in search box for distance to center and include
-        for ix in range(min_index[0], max_index[0] + 1):
-            for iy in range(min_index[1], max_index[1] + 1):
-                vox_point = mask.TransformIndexToPhysicalPoint((ix, iy, iz))
-                if ((cylinder_center_x - vox_point[0]) ** 2 +
-                        (cylinder_center_y - vox_point[1]) ** 2
-                        <= cylinder_radius ** 2):
-                    mask[ix, iy, iz] = 1
-
-        # Move on to next z
-        iz += 1
-
-    return mask
+    if partial_volume:
+        # In-plane disk weights, with a margin of one voxel for partially
+        # covered voxels
+        lower = (max(min_index[0] - 1, 0), max(min_index[1] - 1, 0))
+        upper = (min(max_index[0] + 1, image_size[0] - 1),
+                 min(max_index[1] + 1, image_size[1] - 1))
+        disk = _disk_weights(
+            _index_coordinates(image_spacing, image_origin, 0,
+                               lower[0], upper[0]),
+            _index_coordinates(image_spacing, image_origin, 1,
+                               lower[1], upper[1]),
+            image_spacing,
+            np.array([cylinder_center_x]), np.array([cylinder_center_y]),
+            cylinder_radius)[0]
+    else:
+        # In-plane disk covering the search box
+        lower = (min_index[0], min_index[1])
+        disk = _disk(image_spacing, image_origin, min_index, max_index,
+                     cylinder_center_x, cylinder_center_y, cylinder_radius)
+
+    # Voxels of the disk on the first slice, repeated on all z-slices
+    shape = image_size[::-1]
+    disk_indices = _flat_indices(shape, (min_index[2], lower[1], lower[0]),
+                                 disk[np.newaxis])
+    n_slices = max(max_index[2] - min_index[2] + 1, 0)
+    slice_offsets = shape[1] * shape[2] * np.arange(n_slices)
+    indices = (slice_offsets[:, np.newaxis]
+               + disk_indices[np.newaxis, :]).ravel()
+    weights = None
+    if partial_volume:
+        weights = np.tile(disk[disk > 0].astype(np.float32), n_slices)
+    return SparseROI(image_size, image_spacing, image_origin, indices,
+                     np.array([0, len(indices)], dtype=np.intp), weights,
+                     np.float32 if partial_volume else np.uint16)
 
 
 def hottest_cylinder_3d(
@@ -252,7 +689,13 @@ def hottest_cylinder_3d(
         cylinder_radius: float,
         mask_size: tuple[int, int, int] | None = None,
         mask_spacing: tuple[float, float, float] | None = None,
-        mask_origin: tuple[float, float, float] | None = None) -> sitk.Image:
+        mask_origin: tuple[float, float, float] | None = None,
+        warm_start: bool = False,
+        search_stats: dict[str, int] | None = None,
+        workers: int | None = None,
+        axis_fit_step: int | None = None,
+        subvoxel: bool = False,
+        partial_volume: bool = False) -> sitk.Image:
     """
     Creates a mask which tries to include the hottest circular region with
     a given radius on each slice between to end points. If these circular
@@ -262,6 +705,14 @@ def hottest_cylinder_3d(
     centre should be approximately at the given position. From the given
     position a simple search algorithm is emplyed in order to maximise the
     voxel signal. The cylinder radius will not be allowed to vary.
+    By default every slice is searched from the given position. With warm
+    start the search on each slice instead starts from the optimum found on
+    the previous slice, which saves most of the search on long cylinders
+    but can settle on a different local optimum.
+    Instead of letting the circles move freely, the mask can be made a
+    straight (possibly tilted) cylinder: only every axis_fit_step'th slice is
+    searched, a straight axis is fitted to the centres found by least
+    squares, and the mask is drawn around that axis on every slice.
     The output mask geometry can be set, but if no specific geometry is
     assigned the image geometry is used for the mask.
 
@@ -277,32 +728,78 @@ def hottest_cylinder_3d(
         mask_size           --  Size of the mask (default: image size)
         mask_spacing        --  Spacing of the mask (default: image spacing)
         mask_origin         --  Origin of the mask (default: image origin)
+        warm_start          --  Start the search on each slice from the
+                                optimum of the previous slice
+                                (default: False)
+        search_stats        --  If a dict is given, the number of candidate
+                                centres evaluated is stored in it under the
+                                key 'evaluations'. With warm start, an
+                                estimate of the number of evaluations saved
+                                compared to searching every slice from the
+                                given position is stored under
+                                'evaluations_saved'. The first slice is
+                                searched from the given position either way,
+                                and a search from there is estimated to cost
+                                as much on every slice.
+        workers             --  Number of processes used to search the
+                                slices concurrently. Not used with warm
+                                start, where each slice is searched from
+                                the result of the previous one (a warning
+                                is given). The result does not depend on
+                                the number of workers (default: None, no
+                                concurrency)
+        axis_fit_step       --  If given, search every axis_fit_step'th
+                                slice and draw a straight cylinder around
+                                the fitted axis (default: None, every slice
+                                is searched and drawn separately)
+        subvoxel            --  Refine each centre found by the search to
+                                sub-voxel precision by parabolic
+                                interpolation of the disk sums around it
+                                (default: False)
+        partial_volume      --  Return a sitkFloat32 mask where each voxel
+                                holds the fraction of it covered by the disk,
+                                instead of a sitkUInt16 mask of the voxels
+                                with centres inside the disk (default: False)
 
     Returns:
         A SimpleITK image containing the mask.
     """
 
-    # Create mask for output
-    # Use image geometry in case no required geometry is supplied
-    if mask_size is None:
-        mask = sitk.Image(image.GetSize(), sitk.sitkUInt16)
-    else:
-        mask = sitk.Image(mask_size, sitk.sitkUInt16)
+    return sparse_hottest_cylinder_3d(
+        image, cylinder_start_z, cylinder_end_z, cylinder_center_x,
+        cylinder_center_y, cylinder_radius, mask_size, mask_spacing,
+        mask_origin, warm_start, search_stats, workers, axis_fit_step,
+        subvoxel, partial_volume).to_image()
 
-    if mask_spacing is None:
-        mask.SetSpacing(image.GetSpacing())
-    else:
-        mask.SetSpacing(mask_spacing)
 
-    if mask_origin is None:
-        mask.SetOrigin(image.GetOrigin())
-    else:
-        mask.SetOrigin(mask_origin)
+def sparse_hottest_cylinder_3d(
+        image: sitk.Image,
+        cylinder_start_z: float,
+        cylinder_end_z: float,
+        cylinder_center_x: float,
+        cylinder_center_y: float,
+        cylinder_radius: float,
+        mask_size: tuple[int, int, int] | None = None,
+        mask_spacing: tuple[float, float, float] | None = None,
+        mask_origin: tuple[float, float, float] | None = None,
+        warm_start: bool = False,
+        search_stats: dict[str, int] | None = None,
+        workers: int | None = None,
+        axis_fit_step: int | None = None,
+        subvoxel: bool = False,
+        partial_volume: bool = False) -> SparseROI:
+    """
+    Find the hottest cylinder like hottest_cylinder_3d, but return the voxels
+    of the mask as a SparseROI with a single label (and partial volume
+    weights if partial_volume is set) instead of a dense image.
+    """
 
-    # Create mask used for searching (always image geometry)
-    mask2 = sitk.Image(image.GetSize(), sitk.sitkUInt16)
-    mask2.SetSpacing(image.GetSpacing())
-    mask2.SetOrigin(image.GetOrigin())
+    # Mask grid geometry
+    # Use image geometry in case no required geometry is supplied
+    size = image.GetSize() if mask_size is None else mask_size
+    mask = _grid(image.GetSpacing() if mask_spacing is None
+                 else mask_spacing,
+                 image.GetOrigin() if mask_origin is None else mask_origin)
 
     # Sanity checks:
 
@@ -316,13 +813,13 @@ def hottest_cylinder_3d(
         (cyl_max_x, cyl_max_y, cylinder_end_z),
     ]
     for point in check_points:
-        if not _check_bounds(mask, point):
+        if not _check_bounds(mask, point, size):
             raise ValueError(
                 f"Cylinder exceeds mask space: "
                 f"({point[0]}, {point[1]}, {point[2]}) outside mask "
                 f"(mask origin: {mask.GetOrigin()}, "
                 f"mask spacing: {mask.GetSpacing()}, "
-                f"mask size: {mask.GetSize()}).")
+                f"mask size: {size}).")
         if not _check_bounds(image, point):
             raise ValueError(
                 f"Cylinder exceeds image space: "
@@ -340,101 +837,86 @@ def hottest_cylinder_3d(
     end_point = (cylinder_center_x, cylinder_center_y, cylinder_end_z)
     end_index_msk = mask.TransformPhysicalPointToIndex(end_point)
 
-    # Convert radius to index in x- and y-direction
-    x_idx_radius_img = int(np.ceil(cylinder_radius / image.GetSpacing()[0]))
-    y_idx_radius_img = int(np.ceil(cylinder_radius / image.GetSpacing()[1]))
-    x_idx_radius_msk = int(np.ceil(cylinder_radius / mask.GetSpacing()[0]))
-    y_idx_radius_msk = int(np.ceil(cylinder_radius / mask.GetSpacing()[1]))
-
-    # Prepare stats filter for testing mask
-    label_stats_filter = sitk.LabelStatisticsImageFilter()
-
-    search_dict = {}
-
-    # Iterate through z-slices from start to end
-    iz = start_index_msk[2]
-    while iz <= end_index_msk[2]:
-
-        # Convert iz to image-index z:
-        slice_center_point = mask.TransformIndexToPhysicalPoint(
-            (start_index_msk[0], start_index_msk[1], iz))
-        iz_img = image.TransformPhysicalPointToIndex(slice_center_point)[2]
-
-        max_val = -1.0
-        max_index_img = (0, 0, 0)
-
-        # Start search at centre point
-        index_list = [(start_index_img[0], start_index_img[1], iz_img)]
-        while index_list:
-
-            # Get next index to test
-            index = index_list.pop()
-            if index not in search_dict:
-                # Index has not been seen before
-
-                # Calculate physical point of test voxel
-                point = image.TransformIndexToPhysicalPoint(index)
-
-                # Create test mask at this centre point
-                for ix in range(index[0] - x_idx_radius_img,
-                                index[0] + x_idx_radius_img + 1):
-                    for iy in range(index[1] - y_idx_radius_img,
-                                    index[1] + y_idx_radius_img + 1):
-                        # Calculate distance between voxel and centre
-                        vox_point = image.TransformIndexToPhysicalPoint(
-                            (ix, iy, iz_img))
-                        r2 = ((point[0] - vox_point[0]) ** 2 +
-                              (point[1] - vox_point[1]) ** 2)
-                        # Mask if within radius
-                        if r2 <= cylinder_radius ** 2:
-                            mask2[ix, iy, iz_img] = 2
-
-                # Calculate voxel sum in test mask
-                label_stats_filter.Execute(image, mask2)
-                cur_val = label_stats_filter.GetSum(2)
-
-                # Reset mask
-                for ix in range(index[0] - x_idx_radius_img,
-                                index[0] + x_idx_radius_img + 1):
-                    for iy in range(index[1] - y_idx_radius_img,
-                                    index[1] + y_idx_radius_img + 1):
-                        mask2[ix, iy, iz_img] = 0
-
-                # Add value to search dict
-                search_dict[index] = cur_val
-
-            else:
-                # Index has been tested before, use old value
-                cur_val = search_dict[index]
-
-            if cur_val > max_val:
-                # This is the optimal point so far.
-                # Save as new favorite and add neighbour points
-                # to search for better point yet
-                max_val = cur_val
-                max_index_img = index
-                index_list.append((index[0] - 1, index[1], index[2]))
-                index_list.append((index[0] + 1, index[1], index[2]))
-                index_list.append((index[0], index[1] - 1, index[2]))
-                index_list.append((index[0], index[1] + 1, index[2]))
-
-        # Draw final mask
-        point = image.TransformIndexToPhysicalPoint(max_index_img)
-        max_index_msk = mask.TransformPhysicalPointToIndex(point)
-        for ix in range(max_index_msk[0] - x_idx_radius_msk,
-                        max_index_msk[0] + x_idx_radius_msk + 1):
-            for iy in range(max_index_msk[1] - y_idx_radius_msk,
-                            max_index_msk[1] + y_idx_radius_msk + 1):
-                # Calculate distance between voxel and centre
-                vox_point = mask.TransformIndexToPhysicalPoint(
-                    (ix, iy, iz))
-                r2 = ((point[0] - vox_point[0]) ** 2 +
-                      (point[1] - vox_point[1]) ** 2)
-                # Mask if within radius
-                if r2 <= cylinder_radius ** 2:
-                    mask[ix, iy, iz] = 1
-
-        # Move on to next z
-        iz += 1
-
-    return mask
+    # Disk used for searching (always image geometry)
+    kernel = _disk_kernel(image.GetSpacing(), cylinder_radius)
+
+    # Image voxel array (z, y, x)
+    img_data = sitk.GetArrayViewFromImage(image)
+
+    # Image slice searched for each mask slice from start to end
+    mask_slices = range(start_index_msk[2], end_index_msk[2] + 1)
+    image_slices = [
+        image.TransformPhysicalPointToIndex(
+            mask.TransformIndexToPhysicalPoint(
+                (start_index_msk[0], start_index_msk[1], iz)))[2]
+        for iz in mask_slices]
+
+    # Distinct image slices to search (consecutive mask slices may lie in
+    # the same image slice). When fitting an axis only a subsample of the
+    # slices, always including the last one, is searched.
+    search_slices = [iz_img for i, iz_img in enumerate(image_slices)
+                     if i == 0 or iz_img != image_slices[i - 1]]
+    if axis_fit_step is not None:
+        search_slices = (search_slices[:-1:axis_fit_step] +
+                         search_slices[-1:])
+
+    if warm_start and workers is not None and workers > 1:
+        warnings.warn("workers is ignored with warm_start: the slices are "
+                      "searched one after the other.", stacklevel=2)
+
+    # Search bookkeeping
+    evaluations = 0
+    first_evaluations = 0
+    seed = (start_index_img[0], start_index_img[1])
+
+    # Physical centre of the hottest disk on each searched image slice
+    centers: dict[int, tuple[float, float, float]] = {}
+
+    # Search the disk sums of each slice from the seed point, or from the
+    # optimum of the previous slice with warm start
+    searches = _search_slices(img_data, search_slices, kernel, seed,
+                              warm_start, subvoxel, workers)
+    for i, (iz_img, search) in enumerate(zip(search_slices, searches)):
+        (max_ix, max_iy), (dx, dy), n_eval = search
+        evaluations += n_eval
+        if i == 0:
+            first_evaluations = n_eval
+        centers[iz_img] = image.TransformIndexToPhysicalPoint(
+            (max_ix, max_iy, iz_img))
+        if subvoxel:
+            # Move the centre to the peak of parabolas through the disk sums
+            # of the optimum and its neighbours
+            centers[iz_img] = (
+                centers[iz_img][0] + dx * image.GetSpacing()[0],
+                centers[iz_img][1] + dy * image.GetSpacing()[1],
+                centers[iz_img][2])
+
+    indices = np.empty(0, dtype=np.intp)
+    weights = np.empty(0, dtype=np.float32) if partial_volume else None
+    if len(mask_slices) > 0:
+        if axis_fit_step is None:
+            # Use the hottest disk found on each slice
+            axis_x = np.array([centers[iz_img][0] for iz_img in image_slices])
+            axis_y = np.array([centers[iz_img][1] for iz_img in image_slices])
+        else:
+            # Fit a straight axis through the centres
+            points = np.array([centers[iz_img] for iz_img in search_slices])
+            mask_z = _index_coordinates(mask.GetSpacing(), mask.GetOrigin(),
+                                        2, mask_slices[0], mask_slices[-1])
+            axis_x, axis_y = _fit_axis(points, mask_z)
+
+        # Find the voxels of the disks on all slices at once
+        indices, weights = _disk_voxels(
+            tuple(size[::-1]), mask, mask_slices[0], axis_x, axis_y,
+            cylinder_radius, partial_volume)
+
+    if search_stats is not None:
+        search_stats['evaluations'] = evaluations
+        if warm_start:
+            # Both searches start the first slice from the seed point
+            search_stats['evaluations_saved'] = (
+                first_evaluations * len(search_slices) - evaluations)
+
+    return SparseROI(tuple(size), mask.GetSpacing(), mask.GetOrigin(),
+                     indices, np.array([0, len(indices)], dtype=np.intp),
+                     weights, np.float32 if partial_volume else np.uint16)
@@ -0,0 +1,67 @@
+import SimpleITK as sitk
+import numpy as np
+import numpy.typing as npt
+from dataclasses import dataclass
+
+
+@dataclass
+class SparseROI:
+    """
+    Labelled voxels of an image grid, stored as flat voxel indices instead of
+    a dense label image. The voxels of label k (k = 1, ..., n_labels) are
+    indices[offsets[k - 1]:offsets[k]], where a flat index refers to the
+    (z, y, x) voxel array of the grid in C order. Only the labelled voxels
+    are stored, so the memory used grows with the size of the ROIs rather
+    than the size of the image.
+
+    Attributes:
+        size        --  The size (x, y, z) of the image grid
+        spacing     --  The spacing of the image grid
+        origin      --  The origin of the image grid
+        indices     --  Flat voxel indices of all labels, label by label
+        offsets     --  Start of the voxels of each label in indices, with
+                        the total number of voxels as the last element
+        weights     --  Optional weights of the voxels (e.g. partial volume
+                        fractions), in the order of indices
+        dtype       --  Pixel type of the dense image (see to_image)
+        centres     --  Optional (n_labels, 3) array of the physical (x, y,
+                        z) centre each label was drawn around, e.g. the
+                        centres of spheres
+    """
+    size: tuple[int, int, int]
+    spacing: tuple[float, float, float]
+    origin: tuple[float, float, float]
+    indices: npt.NDArray[np.intp]
+    offsets: npt.NDArray[np.intp]
+    weights: npt.NDArray[np.float32] | None = None
+    dtype: type[np.generic] = np.uint16
+    centres: npt.NDArray[np.float64] | None = None
+
+    @property
+    def n_labels(self) -> int:
+        """
+        The number of labels.
+        """
+        return len(self.offsets) - 1
+
+    def labels(self) -> npt.NDArray[np.intp]:
+        """
+        The label of each voxel, in the order of indices.
+        """
+        return np.repeat(np.arange(1, self.n_labels + 1),
+                         np.diff(self.offsets))
+
+    def to_image(self) -> sitk.Image:
+        """
+        Draw the ROI on a dense SimpleITK image with the grid geometry and
+        the pixel type dtype. Voxels hold their label, or their weight if the
+        ROI has weights, and all other voxels are zero. If several labels
+        share a voxel, the voxel holds the last of them.
+        """
+        dense = np.zeros(self.size[::-1], dtype=self.dtype)
+        dense.reshape(-1)[self.indices] = (
+            self.labels() if self.weights is None else self.weights)
+        res = sitk.GetImageFromArray(dense)
+        res.SetSpacing(self.spacing)
+        res.SetOrigin(self.origin)
+        return res
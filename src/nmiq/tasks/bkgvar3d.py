@@ -1,19 +1,74 @@
 from typing import Any
 import SimpleITK as sitk
 import numpy as np
-import numpy.typing as npt
 import nmiq
 import os
 
 
-def _bkg_var_func(x: npt.NDArray[np.float64]) -> float:
+def _bkg_var_radius(img: sitk.Image, task_dict: dict[str, Any],
+                    roi_radius: float) \
+        -> tuple[nmiq.SparseROI, dict[str, Any]]:
     """
-    Function that calculates background variability from a set of measured
-    ROI values.
-    The background varaibility is defined as the sample standard deviation
-    divided by the mean of the samples.
+    Place spheres of one radius in the cylinder given in task_dict and
+    compute the background variability from their means. Returns the
+    sphere mask and a dict object with the result, its standard error, the
+    number of spheres and, if requested, the number of blocks and the
+    bootstrap standard error and confidence interval.
     """
-    return float(np.std(x, ddof=1) / np.mean(x))
+
+    # Compute masks given cylinder and ROI geometry
+    print("Placing spheres in cylinder.")
+    mask = nmiq.sparse_spheres_in_cylinder_3d(
+        image_size=img.GetSize(),
+        image_spacing=img.GetSpacing(),
+        image_origin=img.GetOrigin(),
+        cylinder_start_z=task_dict['start_z'],
+        cylinder_end_z=task_dict['end_z'],
+        cylinder_center_x=task_dict['cylinder_center_x'],
+        cylinder_center_y=task_dict['cylinder_center_y'],
+        cylinder_radius=task_dict['cylinder_radius'],
+        roi_radius=roi_radius
+    )
+
+    # Compute the mean voxel intensity in each sphere
+    stats = nmiq.label_statistics(img, mask)
+    means = stats['mean'][1:]
+
+    # The number of spheres placed in the cylinder
+    max_label = len(means)
+    print(f'{max_label} spheres placed in cylinder.')
+    for label in range(max_label):
+        print(f'Sphere {label} mean = {means[label]:.2f}')
+
+    # Group the spheres by z-layer. All spheres in a layer share the
+    # z-coordinate of their centre.
+    layers = None
+    if task_dict.get('block_jackknife', False) and mask.centres is not None:
+        layers = np.unique(mask.centres[:, 2], return_inverse=True)[1]
+        print(f'{len(np.unique(layers))} layers of spheres.')
+
+    # Compute background variability and standard error. The background
+    # variability is the coefficient of variation of the ROI means (sample
+    # standard deviation divided by the mean).
+    bkg_var, se = nmiq.jackknife('cv', means, groups=layers)
+    print(f"Result: N = {bkg_var:.4f} +/- {se:.4f}")
+    res: dict[str, Any] = {'result': float(bkg_var), 'se': float(se),
+                           'k': int(max_label)}
+    if layers is not None:
+        res['blocks'] = len(np.unique(layers))
+
+    # Bootstrap standard error and confidence interval
+    if 'bootstrap' in task_dict:
+        _, boot_se, ci = nmiq.bootstrap(
+            'cv', means,
+            n_resamples=task_dict['bootstrap'],
+            seed=task_dict.get('seed'),
+            method=task_dict.get('bootstrap_method', 'percentile'))
+        print(f"Bootstrap: S.E. = {boot_se:.4f}, "
+              f"95% CI = [{ci[0]:.4f}, {ci[1]:.4f}]")
+        res['boot_se'] = float(boot_se)
+        res['ci'] = ci
+    return mask, res
 
 
 def bkgvar3d(task_dict: dict[str, Any]):
@@ -37,8 +92,24 @@ def bkgvar3d(task_dict: dict[str, Any]):
     be placed inside the cylinder, and the background variability measured
     from the mean values inside each ROI. The standard error of the background
     variability will be estimated by jackknife resampling.
+    ROIs in the same layer of the cylinder are spatially correlated through
+    the image resolution. To drop a whole layer of ROIs at a time (block
+    jackknife), set the key
+        block_jackknife     --  Estimate the standard error by deleting one
+                                z-layer of ROIs at a time (bool)
+    A bootstrap estimate of the standard error and a 95% confidence interval
+    is added to the results when the key
+        bootstrap           --  Number of bootstrap resamples (int)
+    is present. The optional keys
+        bootstrap_method    --  'percentile' (default) or 'bca'
+        seed                --  Seed for the bootstrap resampling (int)
+    control the confidence interval and make the resampling reproducible.
     Two files will be created as output: A text file containing the numerical
     results of the computation and an image file containing the spherical ROIs.
+    The key roi_radius may also be a list of radii, e.g. the six NEMA sphere
+    radii. The image and cylinder are then shared by all radii, an image
+    file with the ROIs is written for each radius (bkgvar3d_mask_r<radius>)
+    and the text file holds one table with a row of results per radius.
     """
 
     print("Starting BKGVAR3D task.")
@@ -47,47 +118,51 @@ def bkgvar3d(task_dict: dict[str, Any]):
     # Get image
     img = task_dict['image']
 
-    # Compute masks given cylinder and ROI geometry
-    print("Placing spheres in cylinder.")
-    mask = nmiq.spheres_in_cylinder_3d(
-        image_size=img.GetSize(),
-        image_spacing=img.GetSpacing(),
-        image_origin=img.GetOrigin(),
-        cylinder_start_z=task_dict['start_z'],
-        cylinder_end_z=task_dict['end_z'],
-        cylinder_center_x=task_dict['cylinder_center_x'],
-        cylinder_center_y=task_dict['cylinder_center_y'],
-        cylinder_radius=task_dict['cylinder_radius'],
-        roi_radius=task_dict['roi_radius']
-    )
-
-    # Find the number of spheres placed in the cylinder
-    max_label = np.max(sitk.GetArrayFromImage(mask))
-    print(f'{max_label} spheres placed in cylinder.')
+    # A single ROI radius gives the original result format, a list of
+    # radii gives one table with a row per radius.
+    radii = [float(r) for r in np.atleast_1d(task_dict['roi_radius'])]
+    table = len(radii) > 1
 
-    # Compute the mean voxel intensity in each spehere
-    label_stats_filter = sitk.LabelStatisticsImageFilter()
-    label_stats_filter.Execute(img, mask)
-    means = np.zeros(max_label)
-    for label in range(max_label):
-        m = label_stats_filter.GetMean(label + 1)
-        print(f'Sphere {label} mean = {m:.2f}')
-        means[label] = m
+    results = []
+    for roi_radius in radii:
+        if table:
+            print(f"ROI radius {roi_radius}:")
+        mask, res = _bkg_var_radius(img, task_dict, roi_radius)
+        results.append(res)
 
-    # Compute background variability and standard error
-    bkg_var, se = nmiq.jackknife(_bkg_var_func, means)
-    print(f"Result: N = {bkg_var:.4f} +/- {se:.4f}")
+        # Write mask
+        mask_name = (f'bkgvar3d_mask_r{roi_radius:g}.nii.gz' if table
+                     else 'bkgvar3d_mask.nii.gz')
+        sitk.WriteImage(mask.to_image(),
+                        os.path.join(task_dict['output_path'], mask_name))
 
     # Write output
     print("Writing output.")
-    mask_write_path = os.path.join(task_dict['output_path'],
-                                   'bkgvar3d_mask.nii.gz')
-    sitk.WriteImage(mask, mask_write_path)
-
     res_file = os.path.join(task_dict['output_path'], 'bkgvar3d_res.txt')
     with open(res_file, 'w') as f:
-        f.write(f"Result:\t{float(bkg_var)}\n")
-        f.write(f"S.E.:\t{float(se)}\n")
-        f.write(f"K:\t{int(max_label)}\n")
+        if table:
+            header = ["ROI radius", "Result", "S.E.", "K"]
+            if 'blocks' in results[0]:
+                header.append("Blocks")
+            if 'boot_se' in results[0]:
+                header += ["Bootstrap S.E.", "95% CI low", "95% CI high"]
+            f.write("\t".join(header) + "\n")
+            for roi_radius, res in zip(radii, results):
+                row = [roi_radius, res['result'], res['se'], res['k']]
+                if 'blocks' in res:
+                    row.append(res['blocks'])
+                if 'boot_se' in res:
+                    row += [res['boot_se'], res['ci'][0], res['ci'][1]]
+                f.write("\t".join(str(v) for v in row) + "\n")
+        else:
+            res = results[0]
+            f.write(f"Result:\t{res['result']}\n")
+            f.write(f"S.E.:\t{res['se']}\n")
+            f.write(f"K:\t{res['k']}\n")
+            if 'blocks' in res:
+                f.write(f"Blocks:\t{res['blocks']}\n")
+            if 'boot_se' in res:
+                f.write(f"Bootstrap S.E.:\t{res['boot_se']}\n")
+                f.write(f"95% CI:\t{res['ci'][0]}\t{res['ci'][1]}\n")
     print("BKGVAR3D task completed.")
     print()
@@ -1,9 +1,21 @@
 from typing import Any
 import nmiq
 import SimpleITK as sitk
+import numpy as np
+import numpy.typing as npt
 import os
 
 
+def _contrast(sums: npt.NDArray[np.float64], axis: int = 0) -> Any:
+    """
+    Contrast from the rows of per-slice sums (hot sum, hot count,
+    background sum, background count), summed along the given axis.
+    """
+    total = np.sum(sums, axis=axis)
+    return (total[..., 0] / total[..., 1]) / (total[..., 2] / total[..., 3]) \
+        - 1.0
+
+
 def contrast_cyl3d(task_dict: dict[str, Any]):
     """
     Cylinder contrast task.
@@ -30,10 +42,33 @@ def contrast_cyl3d(task_dict: dict[str, Any]):
     resampling. To use the original image for search, also set the key
         orig_image          --  The original (before resampling) image
                                 (SimpleITK Image)
+    The search for the hot cylinder can be spread over several processes,
+    one slice at a time, by setting the key
+        workers             --  Number of parallel workers (int, not used
+                                with warm_start)
+    To start the search on each slice from the position found on the
+    previous slice, which saves most of the search on long cylinders, set
+    the key
+        warm_start          --  Warm start the search for the hot cylinder
+                                (bool)
+    To make the hot cylinder straight rather than letting the circle move
+    freely on each slice, set the key
+        axis_fit_step       --  Search only every axis_fit_step'th slice and
+                                fit a straight cylinder axis through the
+                                centres found (int)
+    To measure the contrast on the native image grid without resampling, set
+    the key
+        subvoxel            --  Place the hot cylinder with sub-voxel
+                                precision and weight voxels on the edges of
+                                both cylinders by the fraction of the voxel
+                                inside the cylinder (bool)
 
     Given these inputs the function will automatically find the position of
     the cylinder (the position which gives the maximum signal for the hot
     cylinder) and compute the contrast and ratio to the background.
+    The standard error of the contrast is estimated by jackknife resampling,
+    deleting one slice at a time, and the contrast of each slice with both
+    cylinders is written to a separate file.
     The position of the cylinder is found slice by slice. On each slice a
     circle is drawn in a box in the region
         cylinder_center_x-radius <= x <= cylinder_center_x+radius
@@ -48,9 +83,12 @@ def contrast_cyl3d(task_dict: dict[str, Any]):
 
     # Compute hot cylinder mask
     print("Placing hot cylinder.")
+    subvoxel = task_dict.get('subvoxel', False)
+    warm_start = task_dict.get('warm_start', False)
+    search_stats: dict[str, int] = {}
     if 'orig_image' in task_dict:
         resampled_image: sitk.Image = task_dict['image']
-        hot_mask = nmiq.hottest_cylinder_3d(
+        hot_mask = nmiq.sparse_hottest_cylinder_3d(
             image=task_dict['orig_image'],
             cylinder_start_z=task_dict['start_z'],
             cylinder_end_z=task_dict['end_z'],
@@ -60,21 +98,37 @@ def contrast_cyl3d(task_dict: dict[str, Any]):
             mask_size=resampled_image.GetSize(),
             mask_origin=resampled_image.GetOrigin(),
             mask_spacing=resampled_image.GetSpacing(),
+            warm_start=warm_start,
+            search_stats=search_stats,
+            workers=task_dict.get('workers'),
+            axis_fit_step=task_dict.get('axis_fit_step'),
+            subvoxel=subvoxel,
+            partial_volume=subvoxel
         )
     else:
-        hot_mask = nmiq.hottest_cylinder_3d(
+        hot_mask = nmiq.sparse_hottest_cylinder_3d(
             image=task_dict['image'],
             cylinder_start_z=task_dict['start_z'],
             cylinder_end_z=task_dict['end_z'],
             cylinder_center_x=task_dict['cylinder_center_x'],
             cylinder_center_y=task_dict['cylinder_center_y'],
-            cylinder_radius=task_dict['cylinder_radius']
+            cylinder_radius=task_dict['cylinder_radius'],
+            warm_start=warm_start,
+            search_stats=search_stats,
+            workers=task_dict.get('workers'),
+            axis_fit_step=task_dict.get('axis_fit_step'),
+            subvoxel=subvoxel,
+            partial_volume=subvoxel
         )
+    print(f"{search_stats['evaluations']} candidate centres evaluated.")
+    if warm_start:
+        print(f"Warm start saved about {search_stats['evaluations_saved']} "
+              f"evaluations.")
 
     # Compute background cylinder mask
     img = task_dict['image']
     print("Placing background cylinder.")
-    bkg_mask = nmiq.cylinder_3d(
+    bkg_mask = nmiq.sparse_cylinder_3d(
         image_size=img.GetSize(),
         image_spacing=img.GetSpacing(),
         image_origin=img.GetOrigin(),
@@ -83,33 +137,49 @@ def contrast_cyl3d(task_dict: dict[str, Any]):
         cylinder_center_x=task_dict['background_center_x'],
         cylinder_center_y=task_dict['background_center_y'],
         cylinder_radius=task_dict['cylinder_radius'],
+        partial_volume=subvoxel
     )
 
-    # Compute the mean voxel intensity in each cylinder
-    label_stats_filter = sitk.LabelStatisticsImageFilter()
-
-    label_stats_filter.Execute(img, hot_mask)
-    hot_mean = label_stats_filter.GetMean(1)
+    # Sum the voxel values and weights (partial volume weights in subvoxel
+    # mode) of both cylinders on each slice, reading only their voxels
+    sums = []
+    for mask in (hot_mask, bkg_mask):
+        stats = nmiq.label_statistics(img, mask, per_slice=True)
+        sums += [stats['sum'][1], stats['count'][1]]
+    slice_sums = np.column_stack(sums)
 
-    label_stats_filter.Execute(img, bkg_mask)
-    bkg_mean = label_stats_filter.GetMean(1)
-
-    # Compute contrast and ratio
-    contrast = hot_mean / bkg_mean - 1.0
+    # Contrast on each slice with both cylinders, and of all slices with a
+    # jackknife standard error from deleting one slice at a time
+    in_use = np.flatnonzero((slice_sums[:, 1] > 0) | (slice_sums[:, 3] > 0))
+    slice_sums = slice_sums[in_use]
+    both = (slice_sums[:, 1] > 0) & (slice_sums[:, 3] > 0)
+    slice_contrast = _contrast(slice_sums[both, np.newaxis], axis=1)
+    contrast, se = nmiq.jackknife(_contrast, slice_sums, batched=True)
+    print(f"Contrast = {contrast:.4f} +/- {se:.4f} "
+          f"({len(in_use)} slices).")
 
     # Write output
     print("Writing output.")
     hot_write_path = os.path.join(task_dict['output_path'],
                                   'contrast_cyl3d_hot.nii.gz')
-    sitk.WriteImage(hot_mask, hot_write_path)
+    sitk.WriteImage(hot_mask.to_image(), hot_write_path)
 
     bkg_write_path = os.path.join(task_dict['output_path'],
                                   'contrast_cyl3d_bkg.nii.gz')
-    sitk.WriteImage(bkg_mask, bkg_write_path)
+    sitk.WriteImage(bkg_mask.to_image(), bkg_write_path)
 
     res_file = os.path.join(task_dict['output_path'], 'contrast_cyl3d_res.txt')
     with open(res_file, 'w') as f:
         f.write(f"Contrast:\t{float(contrast)}\n")
+        f.write(f"S.E.:\t{float(se)}\n")
+
+    slice_file = os.path.join(task_dict['output_path'],
+                              'contrast_cyl3d_slices.txt')
+    with open(slice_file, 'w') as f:
+        f.write("z\tContrast\n")
+        for iz, c in zip(in_use[both], slice_contrast):
+            z = img.TransformIndexToPhysicalPoint((0, 0, int(iz)))[2]
+            f.write(f"{z}\t{float(c)}\n")
 
     print("CONTRAST_CYL3D task completed.")
     print()
@@ -1,16 +1,566 @@
-from typing import Any
+from typing import Any, Callable
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 import SimpleITK as sitk
+import multiprocessing
 import nmiq
 import os
 import numpy as np
+import numpy.typing as npt
+from scipy import ndimage
 import matplotlib.pyplot as plt
 
 
+def _find_peaks(img_data: npt.NDArray[Any],
+                boxes: dict[tuple[int, int],
+                            tuple[tuple[int, ...], tuple[int, ...]]]
+                ) -> dict[tuple[int, int], tuple[int, int, int]]:
+    """
+    Find the maximum voxel in each of a set of search boxes. Each box is
+    given by its lower and upper (x, y, z) index, and only the z-slice of
+    the lower index is searched. Boxes with the same extent in x and y are
+    searched together with one argmax. As in a search looping over x and
+    then y, the first maximum voxel in that order is returned for each box.
+    """
+
+    # Group boxes by their extent in x and y
+    groups: dict[tuple[int, int, int, int], list[tuple[int, int]]] = {}
+    for key, (min_idx, max_idx) in boxes.items():
+        extent = (min_idx[0], max_idx[0], min_idx[1], max_idx[1])
+        groups.setdefault(extent, []).append(key)
+
+    peaks = {}
+    for (x0, x1, y0, y1), keys in groups.items():
+        z_idx = [boxes[key][0][2] for key in keys]
+        # Search boxes in (box, x, y) order
+        region = img_data[z_idx, y0:y1 + 1, x0:x1 + 1].transpose(0, 2, 1)
+        flat = np.argmax(region.reshape(len(keys), -1), axis=1)
+        px, py = np.unravel_index(flat, region.shape[1:])
+        for key, x, y, z in zip(keys, px, py, z_idx):
+            peaks[key] = (x0 + int(x), y0 + int(y), z)
+    return peaks
+
+
+def _group_by_length(profiles: dict[tuple[int, int], npt.NDArray[Any]]
+                     ) -> list[tuple[list[tuple[int, int]],
+                                     npt.NDArray[Any]]]:
+    """
+    Group a set of line profiles by their length, so profiles in a group can
+    be processed together. Returns the keys of each group along with the
+    profiles stacked as rows.
+    """
+    groups: dict[int, list[tuple[int, int]]] = {}
+    for key, profile in profiles.items():
+        groups.setdefault(len(profile), []).append(key)
+    return [(keys, np.array([profiles[key] for key in keys]))
+            for keys in groups.values()]
+
+
+def _nema_rows(stack: npt.NDArray[Any]) -> dict[str, npt.NDArray[Any]]:
+    """
+    NEMA FWHMs and FWTMs of a stack of line profiles.
+    """
+    return nmiq.nema_widths_batch(stack, [0.5, 0.1])
+
+
+def _gaussfit_rows(stack: npt.NDArray[Any]) -> dict[str, npt.NDArray[Any]]:
+    """
+    Gaussian fits of a stack of line profiles.
+    """
+    params, converged = nmiq.gaussfit_fwhm_batch(stack)
+    return {'params': params, 'converged': converged}
+
+
+def _process_pool(workers: int | None
+                  ) -> ProcessPoolExecutor | nullcontext[None]:
+    """
+    A pool of worker processes to use for all fits of a task, or a
+    context holding None if there is at most one worker. The processes are
+    spawned rather than forked, so the pool is safe to start from a process
+    with threads.
+    """
+    if workers is None or workers < 2:
+        return nullcontext()
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def _map_rows(func: Callable[[npt.NDArray[Any]],
+                             dict[str, npt.NDArray[Any]]],
+              stack: npt.NDArray[Any],
+              executor: ProcessPoolExecutor | None,
+              workers: int | None
+              ) -> dict[str, npt.NDArray[Any]]:
+    """
+    Apply func to a stack of line profiles. With a process pool and more
+    than one worker the rows are split into one chunk per worker and
+    processed in the pool. The results of the chunks are joined in order,
+    and since every row is processed on its own they are the same as for a
+    single call.
+    """
+    if executor is None or workers is None or workers < 2 or len(stack) < 2:
+        return func(stack)
+    chunks = np.array_split(stack, min(workers, len(stack)))
+    results = list(executor.map(func, chunks))
+    return {key: np.concatenate([res[key] for res in results])
+            for key in results[0]}
+
+
+def _nema_profiles(profiles: dict[tuple[int, int], npt.NDArray[Any]],
+                   executor: ProcessPoolExecutor | None = None,
+                   workers: int | None = None
+                   ) -> dict[tuple[int, int], dict[str, Any]]:
+    """
+    Compute NEMA FWHMs and FWTMs of a set of line profiles with
+    nmiq.nema_widths_batch, optionally spread over the workers of a process
+    pool (see _map_rows). Returns
+    the values computed for each profile (see nema_fwhm_batch), with the
+    FWTM added under the key 'fwtm'.
+    """
+    fwhms = {}
+    for keys, stack in _group_by_length(profiles):
+        res = _map_rows(_nema_rows, stack, executor, workers)
+        for j, key in enumerate(keys):
+            fwhms[key] = {
+                'fwhm': res['widths'][j, 0],
+                'fwtm': res['widths'][j, 1],
+                'x1': res['x1'][j],
+                'coeffs': res['coeffs'][j],
+                'hm': res['levels'][j, 0],
+                'left': res['left'][j, 0],
+                'left_int': res['left_int'][j, 0],
+                'right': res['right'][j, 0],
+                'right_int': res['right_int'][j, 0]
+            }
+    return fwhms
+
+
+def _gaussfit_profiles(profiles: dict[tuple[int, int], npt.NDArray[Any]],
+                       executor: ProcessPoolExecutor | None = None,
+                       workers: int | None = None
+                       ) -> dict[tuple[int, int], list[float]]:
+    """
+    Fit gaussians to a set of line profiles with nmiq.gaussfit_fwhm_batch,
+    optionally spread over the workers of a process pool (see _map_rows).
+    Returns the optimal parameters
+    a, b, w of each profile.
+    """
+    fits = {}
+    for keys, stack in _group_by_length(profiles):
+        res = _map_rows(_gaussfit_rows, stack, executor, workers)
+        for key, p, c in zip(keys, res['params'], res['converged']):
+            if not c:
+                print(f'Gauss fit did not converge at slice {key[0]}, '
+                      f'source {key[1]}.')
+            fits[key] = [float(v) for v in p]
+    return fits
+
+
+def _search_boxes(img: sitk.Image, task_dict: dict[str, Any], zs: int, n: int
+                  ) -> dict[tuple[int, int],
+                            tuple[tuple[int, ...], tuple[int, ...]]]:
+    """
+    Lower and upper (x, y, z) index of the search box of each line source on
+    each z-slice, keyed by (slice, source). The boxes are clipped to the
+    image in x and y. A ValueError is raised if a slice lies outside the
+    image, or a box does not overlap it.
+    """
+    size = img.GetSize()
+    boxes: dict[tuple[int, int],
+                tuple[tuple[int, ...], tuple[int, ...]]] = {}
+    for iz in range(zs):
+        z = task_dict['start_z'] + iz * task_dict['delta_z']
+        for i in range(n):
+            center_x = task_dict['center_x'][i]
+            center_y = task_dict['center_y'][i]
+            radius = task_dict['radius'][i]
+            min_idx = img.TransformPhysicalPointToIndex(
+                (center_x - radius, center_y - radius, z))
+            max_idx = img.TransformPhysicalPointToIndex(
+                (center_x + radius, center_y + radius, z))
+            if not 0 <= min_idx[2] < size[2]:
+                raise ValueError(
+                    f"Slice outside image: z = {z} "
+                    f"(image origin: {img.GetOrigin()}, "
+                    f"image spacing: {img.GetSpacing()}, "
+                    f"image size: {size}).")
+            if any(max_idx[d] < 0 or min_idx[d] >= size[d] for d in (0, 1)):
+                raise ValueError(
+                    f"Search box outside image: "
+                    f"x = {center_x - radius}:{center_x + radius}, "
+                    f"y = {center_y - radius}:{center_y + radius} "
+                    f"(image origin: {img.GetOrigin()}, "
+                    f"image spacing: {img.GetSpacing()}, "
+                    f"image size: {size}).")
+            boxes[iz, i] = (
+                (max(min_idx[0], 0), max(min_idx[1], 0), min_idx[2]),
+                (min(max_idx[0], size[0] - 1), min(max_idx[1], size[1] - 1),
+                 max_idx[2]))
+    return boxes
+
+
+def _band_profiles(img_data: npt.NDArray[Any], z_idx: npt.NDArray[Any],
+                   row_idx: npt.NDArray[Any], along_idx: npt.NDArray[Any],
+                   direction: str, band: int) -> npt.NDArray[Any]:
+    """
+    Gather k line profiles in the x or y direction and sum each over a
+    band of rows perpendicular to the profile. Profile j lies in slice
+    z_idx[j], is centred on row row_idx[j] and covers the voxels
+    along_idx[j]. The band is centred on the row (the extra row of an even
+    band goes before it). All profiles are gathered with one indexing
+    operation and summed with one reduction.
+    Returns a (k, m) array of profiles.
+    """
+    rows = (row_idx[:, None, None]
+            + np.arange(band)[None, :, None] - (band - 1) // 2)
+    along = along_idx[:, None, :]
+    if direction == 'x':
+        y_idx, x_idx = rows, along
+    elif direction == 'y':
+        y_idx, x_idx = along, rows
+    else:
+        raise ValueError(f"Unknown direction: {direction}")
+    if (np.any(x_idx < 0) or np.any(x_idx >= img_data.shape[2])
+            or np.any(y_idx < 0) or np.any(y_idx >= img_data.shape[1])):
+        raise ValueError("Line profiles extend outside the image")
+    profiles: npt.NDArray[Any] = \
+        img_data[z_idx[:, None, None], y_idx, x_idx].sum(axis=1)
+    return profiles
+
+
+def _peak_profiles(img: sitk.Image, img_data: npt.NDArray[Any],
+                   task_dict: dict[str, Any], zs: int, n: int
+                   ) -> dict[tuple[int, int],
+                             tuple[npt.NDArray[Any], npt.NDArray[Any], float]]:
+    """
+    Extract line profiles through the maximum voxel of each line source on
+    each z-slice, summed over task_dict.get('band', 1) rows. Returns the
+    profiles with their voxel indices and the voxel spacing along the
+    profile, keyed by (slice, source).
+    """
+
+    # Find the maximum voxel of each line source on all z-slices
+    boxes = _search_boxes(img, task_dict, zs, n)
+    peaks = _find_peaks(img_data, boxes)
+
+    # Extract line profiles through the maximum voxels of each source
+    band = int(task_dict.get('band', 1))
+    values = []
+    along = []
+    for i in range(n):
+        direction = task_dict['direction'][i]
+        axis = 0 if direction == 'x' else 1
+        min_idx, max_idx = boxes[0, i]
+        along.append(np.arange(max(min_idx[axis], 0),
+                               min(max_idx[axis],
+                                   img_data.shape[2 - axis] - 1) + 1))
+        peak_idx = np.array([peaks[iz, i] for iz in range(zs)])
+        values.append(_band_profiles(
+            img_data, peak_idx[:, 2], peak_idx[:, 1 - axis],
+            np.broadcast_to(along[i], (zs, len(along[i]))),
+            direction, band))
+
+    profiles = {}
+    for iz in range(zs):
+        z = task_dict['start_z'] + iz * task_dict['delta_z']
+        for i in range(n):
+            center_x = task_dict['center_x'][i]
+            center_y = task_dict['center_y'][i]
+            radius = task_dict['radius'][i]
+            peak_point = img.TransformIndexToPhysicalPoint(peaks[iz, i])
+            if task_dict['direction'][i] == 'x':
+                print(f'Computing FWHM at '
+                      f'x={center_x - radius}:{center_x + radius}, '
+                      f'y={peak_point[1]:.1f}, '
+                      f'z={z}')
+                spacing = float(img.GetSpacing()[0])
+            else:
+                print(f'Computing FWHM at '
+                      f'x={peak_point[0]:.1f}, '
+                      f'y={center_y - radius}:{center_y + radius}, '
+                      f'z={z}')
+                spacing = float(img.GetSpacing()[1])
+            profiles[iz, i] = (values[i][iz], along[i], spacing)
+    return profiles
+
+
+def _track_centres(img: sitk.Image, img_data: npt.NDArray[Any],
+                   task_dict: dict[str, Any], zs: int, n: int
+                   ) -> npt.NDArray[np.float64]:
+    """
+    Follow each line source along its fitted trajectory. The intensity
+    weighted centroid of each source is found in its search box on
+    task_dict['track'] z-slices spread evenly over the slices to analyse,
+    and a straight line is fitted through the centroids.
+    Returns a (zs, n, 3) array with the continuous (x, y, z) index of the
+    line of each source on each slice.
+    """
+
+    spacing = np.array(img.GetSpacing())
+    origin = np.array(img.GetOrigin())
+    z = task_dict['start_z'] + np.arange(zs) * task_dict['delta_z']
+    # Slice indices rounded like the other modes (halves round up)
+    z_idx = np.array([img.TransformPhysicalPointToIndex(
+        (float(origin[0]), float(origin[1]), float(zi)))[2] for zi in z])
+
+    # Slices where the sources are located
+    n_track = max(1, min(int(task_dict['track']), zs))
+    track_iz = np.unique(
+        np.rint(np.linspace(0, zs - 1, n_track)).astype(int))
+
+    centres = np.empty((zs, n, 3))
+    centres[:, :, 2] = z_idx[:, None]
+    for i in range(n):
+        center_x = task_dict['center_x'][i]
+        center_y = task_dict['center_y'][i]
+        radius = task_dict['radius'][i]
+
+        # Intensity weighted centroid of the voxels above half the maximum
+        # of each search box
+        x0, y0, _ = img.TransformPhysicalPointToIndex(
+            (center_x - radius, center_y - radius, float(z[0])))
+        x1, y1, _ = img.TransformPhysicalPointToIndex(
+            (center_x + radius, center_y + radius, float(z[0])))
+        x0, y0 = max(x0, 0), max(y0, 0)
+        region = img_data[z_idx[track_iz], y0:y1 + 1, x0:x1 + 1]
+        region = region - region.min(axis=(1, 2), keepdims=True)
+        region = np.where(
+            region >= 0.5 * region.max(axis=(1, 2), keepdims=True),
+            region, 0.0)
+        total = region.sum(axis=(1, 2))
+        if np.any(total <= 0):
+            raise ValueError(f"No line source found in the search box "
+                             f"at x = {center_x}, y = {center_y}")
+        cx = region.sum(axis=1) @ np.arange(x0, x0 + region.shape[2]) / total
+        cy = region.sum(axis=2) @ np.arange(y0, y0 + region.shape[1]) / total
+        cx = origin[0] + spacing[0] * cx
+        cy = origin[1] + spacing[1] * cy
+
+        # Fit the trajectory x = a + b * z, y = c + d * z
+        if len(track_iz) < 2:
+            bx, ax, by, ay = 0.0, cx[0], 0.0, cy[0]
+        else:
+            bx, ax = np.polyfit(z[track_iz], cx, 1)
+            by, ay = np.polyfit(z[track_iz], cy, 1)
+        print(f'Source at x={center_x}, y={center_y}: trajectory '
+              f'x={ax:.2f}{bx:+.4f}z, y={ay:.2f}{by:+.4f}z')
+        centres[:, i, 0] = (ax + bx * z - origin[0]) / spacing[0]
+        centres[:, i, 1] = (ay + by * z - origin[1]) / spacing[1]
+    return centres
+
+
+def _track_profiles(img: sitk.Image, img_data: npt.NDArray[Any],
+                    task_dict: dict[str, Any], zs: int, n: int
+                    ) -> dict[tuple[int, int],
+                              tuple[npt.NDArray[Any], npt.NDArray[Any],
+                                    float]]:
+    """
+    Extract line profiles along the fitted trajectory of each line source
+    (see _track_centres), summed over task_dict.get('band', 1) rows. The
+    profiles of a source on all slices are centred on the voxels nearest
+    to the line and gathered from the image at once. Returns the profiles
+    with their voxel indices and the voxel spacing along the profile,
+    keyed by (slice, source).
+    """
+
+    spacing = img.GetSpacing()
+    band = int(task_dict.get('band', 1))
+    centres = np.floor(
+        _track_centres(img, img_data, task_dict, zs, n) + 0.5).astype(int)
+
+    profiles = {}
+    for i in range(n):
+        direction = task_dict['direction'][i]
+        axis = 0 if direction == 'x' else 1
+        half = int(round(task_dict['radius'][i] / spacing[axis]))
+
+        # Gather the line profiles on all slices
+        along = centres[:, i, axis, None] + np.arange(-half, half + 1)
+        values = _band_profiles(img_data, centres[:, i, 2],
+                                centres[:, i, 1 - axis], along,
+                                direction, band)
+
+        for iz in range(zs):
+            profiles[iz, i] = (values[iz], along[iz], float(spacing[axis]))
+    return profiles
+
+
+def _interpolated_profiles(img: sitk.Image, img_data: npt.NDArray[Any],
+                           task_dict: dict[str, Any],
+                           centres: npt.NDArray[np.float64]
+                           ) -> dict[tuple[int, int],
+                                     tuple[npt.NDArray[Any],
+                                           npt.NDArray[Any], float]]:
+    """
+    Sample line profiles through the given (zs, n, 3) array of continuous
+    (x, y, z) indices by linear interpolation in the image slices. The
+    profile of source i makes the in-plane angle task_dict['angle'][i]
+    (degrees from the x-axis towards the y-axis) or follows its direction,
+    and is sampled every task_dict['profile_step'] mm. Without a step, the
+    distance between the voxel centres along the profile is used. The
+    profiles are summed over task_dict.get('band', 1) parallel lines,
+    spaced by the distance between voxel centres perpendicular to the
+    profile. All samples are interpolated with a single call to
+    map_coordinates.
+    Returns the profiles with their sample indices relative to the centre
+    and the sampling step, keyed by (slice, source).
+    """
+
+    spacing = img.GetSpacing()
+    zs, n = centres.shape[:2]
+    band = int(task_dict.get('band', 1))
+    lines = np.arange(band) - (band - 1) // 2
+
+    # Sampling offsets in voxel units of each source's profiles
+    offsets = []
+    steps = []
+    for i in range(n):
+        if 'angle' in task_dict:
+            angle = np.deg2rad(float(task_dict['angle'][i]))
+        elif task_dict['direction'][i] == 'x':
+            angle = 0.0
+        elif task_dict['direction'][i] == 'y':
+            angle = 0.5 * np.pi
+        else:
+            raise ValueError(
+                f"Unknown direction: {task_dict['direction'][i]}")
+        ux = np.cos(angle) / spacing[0]
+        uy = np.sin(angle) / spacing[1]
+        step = float(task_dict.get('profile_step', 1 / np.hypot(ux, uy)))
+        if step <= 0:
+            raise ValueError(f"profile_step must be positive (got {step})")
+        t = step * np.arange(-int(task_dict['radius'][i] / step),
+                             int(task_dict['radius'][i] / step) + 1)
+        # Parallel lines of the band, one voxel apart
+        vx = -np.sin(angle) / spacing[0]
+        vy = np.cos(angle) / spacing[1]
+        s = lines[:, None] / np.hypot(vx, vy)
+        offsets.append(((t * ux + s * vx).ravel(),
+                        (t * uy + s * vy).ravel()))
+        steps.append(step)
+
+    # Continuous (z, y, x) indices of all samples of all profiles
+    coords = [np.concatenate([
+                  np.repeat(centres[:, i, k], len(offsets[i][0]))
+                  + (np.tile(offsets[i][k], zs) if k < 2 else 0)
+                  for i in range(n)])
+              for k in (2, 1, 0)]
+    for k, c in zip((0, 1, 2), coords):
+        if np.any(c < -0.5) or np.any(c > img_data.shape[k] - 0.5):
+            raise ValueError("Line profiles extend outside the image")
+    values = ndimage.map_coordinates(img_data, coords, output=np.float64,
+                                     order=1, mode='nearest')
+
+    # Split the samples into the line profiles
+    profiles = {}
+    pos = 0
+    for i in range(n):
+        m = len(offsets[i][0]) // band
+        summed = values[pos:pos + zs * band * m].reshape(
+            zs, band, m).sum(axis=1)
+        for iz in range(zs):
+            profiles[iz, i] = (summed[iz],
+                               np.arange(m) - (m - 1) // 2, steps[i])
+        pos += zs * band * m
+    return profiles
+
+
+def _slice_order(zs: int) -> list[int]:
+    """
+    Order the slice indices 0, ..., zs - 1 by the base 2 van der Corput
+    sequence, so that every leading part of the order is spread evenly
+    over the slices.
+    """
+    bits = max(1, (zs - 1).bit_length())
+    order: list[int] = []
+    seen = set()
+    for k in range(2 ** bits):
+        # Reverse the bits of k to get the k'th van der Corput point
+        v = int(format(k, f'0{bits}b')[::-1], 2) / 2 ** bits
+        iz = int(v * zs)
+        if iz not in seen:
+            seen.add(iz)
+            order.append(iz)
+    return order
+
+
+def _mean_se(values: list[float]) -> tuple[float, float, int]:
+    """
+    The mean and standard error of the mean of a list of widths, leaving
+    out the NaN widths of profiles where no width was found.
+    Returns the mean, the standard error and the number of widths left out.
+    """
+    values_arr = np.asarray(values, dtype=np.float64)
+    n_valid = int(np.count_nonzero(~np.isnan(values_arr)))
+    if n_valid == 0:
+        return np.nan, np.nan, len(values_arr)
+    se = (np.nanstd(values_arr, ddof=1) / np.sqrt(n_valid)
+          if n_valid > 1 else np.nan)
+    return (float(np.nanmean(values_arr)), float(se),
+            len(values_arr) - n_valid)
+
+
+def _adaptive_fits(profiles: dict[tuple[int, int],
+                                  tuple[npt.NDArray[Any], npt.NDArray[Any],
+                                        float]],
+                   task_dict: dict[str, Any], zs: int, n: int,
+                   executor: ProcessPoolExecutor | None = None
+                   ) -> tuple[dict[tuple[int, int], dict[str, Any]],
+                              dict[tuple[int, int], list[float]],
+                              list[int]]:
+    """
+    Fit the line profiles of the slices in van der Corput order until the
+    standard errors of the mean NEMA and gaussian FWHMs are both at most
+    task_dict['target_se'], or all slices are used. After each round the
+    number of slices needed to reach the target is estimated from the
+    standard errors so far, which fall as one over the square root of the
+    number of slices. All rounds share the process pool executor, if given.
+    Returns the NEMA and gaussian fits, as _nema_profiles and
+    _gaussfit_profiles, and the sorted list of slices used.
+    """
+    target = float(task_dict['target_se'])
+    order = _slice_order(zs)
+    nema_fits: dict[tuple[int, int], dict[str, Any]] = {}
+    gauss_fits: dict[tuple[int, int], list[float]] = {}
+    used = 0
+    needed = min(2, zs)
+    while used < zs:
+        new = {(iz, i): profiles[iz, i][0]
+               for iz in order[used:needed] for i in range(n)}
+        nema_fits.update(_nema_profiles(new, executor,
+                                        task_dict.get('workers')))
+        gauss_fits.update(_gaussfit_profiles(new, executor,
+                                             task_dict.get('workers')))
+        used = needed
+
+        # Standard errors of the mean FWHMs so far
+        ses = []
+        for fwhms in ([profiles[key][2] * fit['fwhm']
+                       for key, fit in nema_fits.items()],
+                      [profiles[key][2] * fit[2]
+                       for key, fit in gauss_fits.items()]):
+            se = _mean_se(fwhms)[1]
+            ses.append(se if np.isfinite(se) else np.inf)
+        se = max(ses)
+        print(f'{used} of {zs} slices analysed, S.E. = {se:.4f}.')
+        if se <= target:
+            break
+        if np.isfinite(se) and target > 0:
+            needed = int(np.ceil(used * (se / target) ** 2))
+        else:
+            needed = 2 * used
+        needed = min(max(needed, used + 1), zs)
+    return nema_fits, gauss_fits, sorted(order[:used])
+
+
 def lsf(task_dict: dict[str, Any]):
     """
     Line Spread Function (LSF) Full width half maximum (FWHM) calculation.
     This function computes the FWHM of an image slice of one or more
-    line sources. The sources should be aligned with the z-axis.
+    line sources. By default the sources should be aligned with the z-axis,
+    but sources that are tilted with respect to the z-axis can be followed
+    and measured along any in-plane angle (see the keys track and angle
+    below).
     The input to the task is a dictionary object, where the following keys
     should be defined:
         image               --  The image to analyse (SimpleITK Image)
@@ -39,8 +589,57 @@ def lsf(task_dict: dict[str, Any]):
     The function then moves on to the next z-position (increasing the z-value
     by delta_z), until z_end has been reached. The final FWHM-values will be
     the average of all the estimates for each separate algorithm. The standard
-    error on the mean is also computed and reported. Finally, an image file is
-    generated where the fits to the line profiles can be inspected.
+    error on the mean is also computed and reported. The full width at tenth
+    maximum (FWTM) is found with the NEMA algorithm in the same pass and
+    reported in the same way. Finally, an image file is generated where the
+    fits to the line profiles can be inspected.
+    A bootstrap estimate of the standard errors and 95% confidence intervals
+    of the mean FWHMs are added to the results when the key
+        bootstrap           --  Number of bootstrap resamples (int)
+    is present. The optional keys
+        bootstrap_method    --  'percentile' (default) or 'bca'
+        seed                --  Seed for the bootstrap resampling (int)
+    control the confidence intervals and make the resampling reproducible.
+    As in NEMA NU 2, the line profiles can be summed over a band of
+    parallel rows centred on the profile with the key
+        band                --  Number of rows summed into each line
+                                profile (int, default 1)
+    Instead of analysing all slices, the slices can be analysed in an
+    order spread evenly between start_z and end_z (van der Corput order)
+    until the standard errors of both mean FWHMs have reached the key
+        target_se           --  Target standard error of the mean FWHMs
+    The number of slices used and the total number of slices are then
+    added as the last line of the results.
+    The NEMA FWHMs and gaussian fits of the line profiles are spread over a
+    pool of processes with the key
+        workers             --  Number of parallel workers (int)
+    The results do not depend on the number of workers.
+    Line sources that are not exactly parallel to the z-axis can be followed
+    by setting the key
+        track               --  Number of z-slices used to locate the
+                                sources (int)
+    Instead of searching for the maximum voxel on every slice, the intensity
+    weighted centroid of each source is then found in the box described
+    above on the given number of slices, spread evenly between start_z and
+    end_z. A straight line is fitted through the centroids of each source,
+    and on every slice the line profile is centred on the voxel nearest to
+    this line and extends radius to either side.
+    Finer or oblique line profiles are sampled by linear interpolation in
+    the image slices when one of the keys
+        angle               --  List of in-plane angles of the line
+                                profiles, in degrees from the x-axis
+                                towards the y-axis (replaces direction)
+        profile_step        --  Distance between the samples of the line
+                                profiles
+    is present. The profiles then go through the maximum voxel, or the
+    fitted trajectory when tracking, and extend radius to either side. By
+    default the angle follows direction (x: 0, y: 90) and the step is the
+    distance between voxel centres along the profile.
+    Profiles where no NEMA width or gaussian fit is found (e.g. a profile
+    that is cut off above the tenth maximum) are left out of the means and
+    standard errors. The number of profiles left out of the NEMA FWHM,
+    gaussian FWHM and FWTM means are then added as the last line of the
+    results.
     """
 
     print("Starting LSF task.")
@@ -48,10 +647,11 @@ def lsf(task_dict: dict[str, Any]):
 
     # Get image and numpy voxel array
     img = task_dict['image']
-    img_data = sitk.GetArrayFromImage(img)
+    img_data = sitk.GetArrayViewFromImage(img)
 
     # Storage for fwhms
     nema_fwhms = []
+    nema_fwtms = []
     gauss_fwhms = []
 
     # Get number of line sources, and check that all agree
@@ -64,7 +664,12 @@ def lsf(task_dict: dict[str, Any]):
         raise ValueError(f"Unequal number of FWHM points provided: "
                          f"len(center_x) = {n}, "
                          f"len(radius) = {len(task_dict['radius'])}")
-    if len(task_dict['direction']) != n:
+    if 'angle' in task_dict:
+        if len(task_dict['angle']) != n:
+            raise ValueError(f"Unequal number of FWHM points provided: "
+                             f"len(center_x) = {n}, "
+                             f"len(angle) = {len(task_dict['angle'])}")
+    elif len(task_dict['direction']) != n:
         raise ValueError(f"Unequal number of FWHM points provided: "
                          f"len(center_x) = {n}, "
                          f"len(direction) = {len(task_dict['direction'])}")
@@ -73,65 +678,58 @@ def lsf(task_dict: dict[str, Any]):
     zs = int(np.ceil((task_dict['end_z'] - task_dict['start_z'])
                      / task_dict['delta_z']))
 
+    # Extract line profiles of all sources on all z-slices
+    if 'angle' in task_dict or 'profile_step' in task_dict:
+        if 'track' in task_dict:
+            centres = _track_centres(img, img_data, task_dict, zs, n)
+        else:
+            peaks = _find_peaks(img_data, _search_boxes(img, task_dict, zs, n))
+            centres = np.array([[peaks[iz, i] for i in range(n)]
+                                for iz in range(zs)], dtype=np.float64)
+        profiles = _interpolated_profiles(img, img_data, task_dict, centres)
+    elif 'track' in task_dict:
+        profiles = _track_profiles(img, img_data, task_dict, zs, n)
+    else:
+        profiles = _peak_profiles(img, img_data, task_dict, zs, n)
+
+    # Compute NEMA FWHMs and fit gaussians to the line profiles, using one
+    # process pool for all fits
+    workers = task_dict.get('workers')
+    with _process_pool(workers) as executor:
+        if 'target_se' in task_dict:
+            nema_fits, gauss_fits, slices = _adaptive_fits(
+                profiles, task_dict, zs, n, executor)
+        else:
+            nema_fits = _nema_profiles(
+                {key: val[0] for key, val in profiles.items()},
+                executor, workers)
+            gauss_fits = _gaussfit_profiles(
+                {key: val[0] for key, val in profiles.items()},
+                executor, workers)
+            slices = list(range(zs))
+
     # Create matplotlib figure handles
-    fig, axs = plt.subplots(zs, n, figsize=(n*4, zs*3))
+    fig, axs = plt.subplots(len(slices), n,
+                            figsize=(n*4, len(slices)*3))
 
     # Iterate through z-slices
-    for iz in range(zs):
+    for row, iz in enumerate(slices):
 
         # Calculate current z
         z = task_dict['start_z'] + iz * task_dict['delta_z']
 
         # Iterate through line sources
         for i in range(n):
-            # Identify source position and direction
             center_x = task_dict['center_x'][i]
             center_y = task_dict['center_y'][i]
-            radius = task_dict['radius'][i]
-            direction = task_dict['direction'][i]
-
-            # Find position of maximum voxel
-            min_idx = img.TransformPhysicalPointToIndex(
-                (center_x - radius, center_y - radius, z))
-            max_idx = img.TransformPhysicalPointToIndex(
-                (center_x + radius, center_y + radius, z))
-            z_idx = min_idx[2]
-
-            peak_idx = min_idx
-            peak_val = img[peak_idx]
-            for x in range(min_idx[0], max_idx[0] + 1):
-                for y in range(min_idx[1], max_idx[1] + 1):
-                    if img[x, y, z_idx] > peak_val:
-                        peak_idx = (x, y, z_idx)
-                        peak_val = img[peak_idx]
-
-            # Create line profile through maximum voxel
-            if direction == 'x':
-                print(f'Computing FWHM at '
-                      f'x={center_x - radius}:{center_x + radius}, '
-                      f'y={img.TransformIndexToPhysicalPoint(
-                          peak_idx)[1]:.1f}, '
-                      f'z={z}')
-                profile = img_data[z_idx, peak_idx[1], min_idx[0]:max_idx[0]+1]
-                x_data = np.arange(min_idx[0], max_idx[0] + 1)
-                spacing = float(img.GetSpacing()[0])
-            elif direction == 'y':
-                print(f'Computing FWHM at '
-                      f'x={img.TransformIndexToPhysicalPoint(
-                          peak_idx)[0]:.1f}, '
-                      f'y={center_y - radius}:{center_y + radius}, '
-                      f'z={z}')
-                profile = img_data[z_idx, min_idx[1]:max_idx[1]+1, peak_idx[0]]
-                x_data = np.arange(min_idx[1], max_idx[1] + 1)
-                spacing = float(img.GetSpacing()[1])
-            else:
-                raise ValueError(f"Unknown direction: {direction}")
+            profile, x_data, spacing = profiles[iz, i]
 
             # Calculate FWHM (multiplied by spacing to get physical value)
-            nema_fwhm = nmiq.nema_fwhm_from_line_profile(profile)
-            nema_fwhm_phys = spacing * nema_fwhm[0]
+            nema_fwhm = nema_fits[iz, i]
+            nema_fwhm_phys = spacing * nema_fwhm['fwhm']
             nema_fwhms.append(nema_fwhm_phys)
-            gauss_fwhm = nmiq.gaussfit_fwhm_from_line_profile(profile)
+            nema_fwtms.append(spacing * nema_fwhm['fwtm'])
+            gauss_fwhm = gauss_fits[iz, i]
             gauss_fwhm_phys = spacing * gauss_fwhm[2]
             gauss_fwhms.append(gauss_fwhm_phys)
             print(f'NEMA FWHM = {nema_fwhm_phys:.2f}, '
@@ -139,46 +737,50 @@ def lsf(task_dict: dict[str, Any]):
 
             # Plot line profile and fits
             x_plot_gauss = np.linspace(np.min(x_data), np.max(x_data), 1000)
-            axs[iz, i].plot(x_data, profile,
-                            'k.', markersize=15, label='Profile')
-            axs[iz, i].plot(x_plot_gauss,
-                            gauss_fwhm[0] * np.exp(
+            axs[row, i].plot(x_data, profile,
+                             'k.', markersize=15, label='Profile')
+            axs[row, i].plot(x_plot_gauss,
+                             gauss_fwhm[0] * np.exp(
                                 -4 * np.log(2.0) *
                                 (x_plot_gauss - x_data[0] - gauss_fwhm[1])**2 /
                                 (gauss_fwhm[2] ** 2)),
-                            '-', linewidth=2, color='darkorange',
-                            label='Gauss fit')
-            axs[iz, i].plot([x_data[0] + gauss_fwhm[1] - 0.5 * gauss_fwhm[2],
+                             '-', linewidth=2, color='darkorange',
+                             label='Gauss fit')
+            axs[row, i].plot([x_data[0] + gauss_fwhm[1] - 0.5 * gauss_fwhm[2],
                              x_data[0] + gauss_fwhm[1] + 0.5 * gauss_fwhm[2]],
-                            [0.5 * gauss_fwhm[0], 0.5 * gauss_fwhm[0]],
-                            '--', color='darkorange', linewidth=2)
-            x_plot_nema = np.linspace(
-                nema_fwhm[1]['x1'], nema_fwhm[1]['x1'] + 2, 1000)
-            axs[iz, i].plot(x_plot_nema + x_data[0],
-                            nema_fwhm[1]['poly'](x_plot_nema),
-                            '-', color='royalblue', linewidth=2,
-                            label='Nema fit')
-            axs[iz, i].plot(
-                [nema_fwhm[1]['left'] + x_data[0],
-                 nema_fwhm[1]['left'] + x_data[0] + 1],
-                [profile[nema_fwhm[1]['left']],
-                 profile[nema_fwhm[1]['left'] + 1]],
-                '--', color='royalblue', linewidth=1)
-            axs[iz, i].plot(
-                [nema_fwhm[1]['right'] + x_data[0],
-                 nema_fwhm[1]['right'] + x_data[0] + 1],
-                [profile[nema_fwhm[1]['right']],
-                 profile[nema_fwhm[1]['right'] + 1]],
-                '--', color='royalblue', linewidth=1)
-            axs[iz, i].plot(
-                [nema_fwhm[1]['left_int'] + x_data[0],
-                 nema_fwhm[1]['right_int'] + x_data[0]],
-                [nema_fwhm[1]['hm'], nema_fwhm[1]['hm']],
-                '--', color='royalblue', linewidth=2)
-            axs[iz, i].set_title(f'x = {center_x}, '
-                                 f'y = {center_y}, '
-                                 f'z = {z}')
-            axs[iz, i].grid()
+                             [0.5 * gauss_fwhm[0], 0.5 * gauss_fwhm[0]],
+                             '--', color='darkorange', linewidth=2)
+            if np.isnan(nema_fwhm['fwhm']):
+                print('No NEMA FWHM found for this profile.')
+            else:
+                x_plot_nema = np.linspace(
+                    nema_fwhm['x1'], nema_fwhm['x1'] + 2, 1000)
+                a, b, c = nema_fwhm['coeffs']
+                axs[row, i].plot(x_plot_nema + x_data[0],
+                                 a * x_plot_nema**2 + b * x_plot_nema + c,
+                                 '-', color='royalblue', linewidth=2,
+                                 label='Nema fit')
+                axs[row, i].plot(
+                    [nema_fwhm['left'] + x_data[0],
+                     nema_fwhm['left'] + x_data[0] + 1],
+                    [profile[nema_fwhm['left']],
+                     profile[nema_fwhm['left'] + 1]],
+                    '--', color='royalblue', linewidth=1)
+                axs[row, i].plot(
+                    [nema_fwhm['right'] + x_data[0],
+                     nema_fwhm['right'] + x_data[0] + 1],
+                    [profile[nema_fwhm['right']],
+                     profile[nema_fwhm['right'] + 1]],
+                    '--', color='royalblue', linewidth=1)
+                axs[row, i].plot(
+                    [nema_fwhm['left_int'] + x_data[0],
+                     nema_fwhm['right_int'] + x_data[0]],
+                    [nema_fwhm['hm'], nema_fwhm['hm']],
+                    '--', color='royalblue', linewidth=2)
+            axs[row, i].set_title(f'x = {center_x}, '
+                                  f'y = {center_y}, '
+                                  f'z = {z}')
+            axs[row, i].grid()
 
     print("All FWHM calculations done. Printing output.")
     axs[0, 0].legend()
@@ -188,11 +790,15 @@ def lsf(task_dict: dict[str, Any]):
     plt.savefig(os.path.join(task_dict['output_path'], 'fwhm.png'))
 
     # Calculate mean and standard error on fwhm estimates
-    nema_fwhm_mean = np.mean(nema_fwhms)
-    nema_se = np.std(nema_fwhms, ddof=1)/np.sqrt(len(nema_fwhms))
-
-    gauss_fwhm_mean = np.mean(gauss_fwhms)
-    gauss_se = np.std(gauss_fwhms, ddof=1) / np.sqrt(len(gauss_fwhms))
+    # (profiles where no width was found are left out)
+    nema_fwhm_mean, nema_se, nema_dropped = _mean_se(nema_fwhms)
+    gauss_fwhm_mean, gauss_se, gauss_dropped = _mean_se(gauss_fwhms)
+    nema_fwtm_mean, nema_fwtm_se, fwtm_dropped = _mean_se(nema_fwtms)
+    dropped = (nema_dropped, gauss_dropped, fwtm_dropped)
+    for name, count in zip(['NEMA FWHM', 'Gauss FWHM', 'FWTM'], dropped):
+        if count > 0:
+            print(f'{count} of {len(nema_fwhms)} profiles dropped from the '
+                  f'mean {name} (no width found).')
 
     # Print results
     res_file = os.path.join(task_dict['output_path'], 'lsf_res.txt')
@@ -201,6 +807,23 @@ def lsf(task_dict: dict[str, Any]):
         f.write(f"S.E.:\t{float(nema_se)}\n")
         f.write(f"Gauss:\t{float(gauss_fwhm_mean)}\n")
         f.write(f"S.E.:\t{float(gauss_se)}\n")
+        f.write(f"FWTM:\t{float(nema_fwtm_mean)}\n")
+        f.write(f"S.E.:\t{float(nema_fwtm_se)}\n")
+        if 'bootstrap' in task_dict:
+            for name, fwhms in [('NEMA', nema_fwhms), ('Gauss', gauss_fwhms)]:
+                fwhms_arr = np.array(fwhms)
+                _, boot_se, ci = nmiq.bootstrap(
+                    'mean', fwhms_arr[~np.isnan(fwhms_arr)],
+                    n_resamples=task_dict['bootstrap'],
+                    seed=task_dict.get('seed'),
+                    method=task_dict.get('bootstrap_method', 'percentile'))
+                f.write(f"{name} bootstrap S.E.:\t{float(boot_se)}\n")
+                f.write(f"{name} 95% CI:\t{ci[0]}\t{ci[1]}\n")
+        if 'target_se' in task_dict:
+            f.write(f"Slices:\t{len(slices)}\t{zs}\n")
+        if any(dropped):
+            f.write(f"Dropped:\t{nema_dropped}\t{gauss_dropped}\t"
+                    f"{fwtm_dropped}\n")
 
     print("LSF task done!")
     print()
@@ -2,6 +2,7 @@ import unittest
 import nmiq.tasks.bkgvar3d
 import SimpleITK as sitk
 import os
+import numpy as np
 
 
 class TestBkgVar3D_task(unittest.TestCase):
@@ -122,8 +123,148 @@ class TestBkgVar3D_task(unittest.TestCase):
 
             self.assertEqual("K:\t4", lines[2].strip())
 
+    def test_bkg_var_block_jackknife(self):
+
+        img = sitk.Image((10, 10, 16), sitk.sitkFloat32)
+        img.SetSpacing((1, 1, 1))
+        img.SetOrigin((0, 0, 0))
+        img += 1.0
+
+        task_dict = {
+            'image': img,
+            'start_z': 1.0,
+            'end_z': 13.0,
+            'cylinder_center_x': 5.0,
+            'cylinder_center_y': 5.0,
+            'cylinder_radius': 3.5,
+            'roi_radius': 0.9,
+            'block_jackknife': True,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.bkgvar3d(task_dict)
+
+        with open(os.path.join('test', 'bkgvar3d_res.txt'), 'r') as f:
+            lines = f.readlines()
+            self.assertEqual(4, len(lines))
+            self.assertEqual("Result:\t0.0", lines[0].strip())
+            self.assertEqual("S.E.:\t0.0", lines[1].strip())
+            self.assertEqual("Blocks:\t4", lines[3].strip())
+
+    def test_bkg_var_block_jackknife_off_grid(self):
+
+        # Off-grid spacing and origin: spheres in one layer cover different
+        # slices depending on their in-plane position
+        rng = np.random.default_rng(5)
+        img = sitk.GetImageFromArray(rng.normal(10.0, 1.0, (30, 30, 30)))
+        img.SetSpacing((0.7, 0.9, 0.8))
+        img.SetOrigin((0.31, -0.23, 0.37))
+
+        task_dict = {
+            'image': img,
+            'start_z': 2.0,
+            'end_z': 14.0,
+            'cylinder_center_x': 10.1,
+            'cylinder_center_y': 11.3,
+            'cylinder_radius': 7.0,
+            'roi_radius': 1.6,
+            'block_jackknife': True,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.bkgvar3d(task_dict)
+
+        with open(os.path.join('test', 'bkgvar3d_res.txt'), 'r') as f:
+            lines = f.readlines()
+            self.assertEqual("K:\t33", lines[2].strip())
+            self.assertEqual("Blocks:\t3", lines[3].strip())
+
+    def test_bkg_var_bootstrap(self):
+
+        img = sitk.Image((6, 6, 16), sitk.sitkFloat32)
+        img.SetSpacing((1, 1, 1))
+        img.SetOrigin((0, 0, 0))
+        img[:, :, 4:7] = 3.0
+        img[:, :, 7:10] = 4.0
+        img[:, :, 10:16] = 7.0
+        img[:, :, 0:4] = 1.0
+
+        task_dict = {
+            'image': img,
+            'start_z': 1.0,
+            'end_z': 13.0,
+            'cylinder_center_x': 3.0,
+            'cylinder_center_y': 3.0,
+            'cylinder_radius': 1.5,
+            'roi_radius': 0.9,
+            'bootstrap': 1000,
+            'seed': 5,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.bkgvar3d(task_dict)
+
+        with open(os.path.join('test', 'bkgvar3d_res.txt'), 'r') as f:
+            lines = f.readlines()
+            self.assertEqual(5, len(lines))
+            self.assertEqual("K:\t4", lines[2].strip())
+            line3 = lines[3].strip().split('\t')
+            self.assertEqual("Bootstrap S.E.:", line3[0])
+            self.assertLess(0.0, float(line3[1]))
+            line4 = lines[4].strip().split('\t')
+            self.assertEqual("95% CI:", line4[0])
+            self.assertLessEqual(float(line4[1]), 0.6666667)
+            self.assertGreaterEqual(float(line4[2]), 0.6666667)
+
+    def test_bkg_var_radii(self):
+
+        img = sitk.Image((10, 10, 16), sitk.sitkFloat32)
+        img.SetSpacing((1, 1, 1))
+        img.SetOrigin((0, 0, 0))
+        img[:, :, 4:7] = 3.0
+        img[:, :, 7:10] = 4.0
+        img[:, :, 10:16] = 7.0
+        img[:, :, 0:4] = 1.0
+        img[5:, :, :] += 1.0
+
+        task_dict = {
+            'image': img,
+            'start_z': 1.0,
+            'end_z': 13.0,
+            'cylinder_center_x': 5.0,
+            'cylinder_center_y': 5.0,
+            'cylinder_radius': 3.5,
+            'roi_radius': [0.9, 1.4],
+            'block_jackknife': True,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.bkgvar3d(task_dict)
+
+        with open(os.path.join('test', 'bkgvar3d_res.txt'), 'r') as f:
+            lines = f.readlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual("ROI radius\tResult\tS.E.\tK\tBlocks",
+                         lines[0].strip())
+        for radius in [0.9, 1.4]:
+            self.assertTrue(os.path.isfile(
+                os.path.join('test', f'bkgvar3d_mask_r{radius:g}.nii.gz')))
+
+        # Each row equals the result of a run with a single radius
+        for row, radius in zip(lines[1:], [0.9, 1.4]):
+            task_dict['roi_radius'] = radius
+            nmiq.tasks.bkgvar3d(task_dict)
+            with open(os.path.join('test', 'bkgvar3d_res.txt'), 'r') as f:
+                single = [line.strip().split('\t')[1] for line in f]
+            self.assertEqual([str(radius)] + single,
+                             row.strip().split('\t'))
+
     def tearDown(self):
         if os.path.exists(os.path.join('test', 'bkgvar3d_mask.nii.gz')):
             os.remove(os.path.join('test', 'bkgvar3d_mask.nii.gz'))
+        for radius in [0.9, 1.4]:
+            path = os.path.join('test', f'bkgvar3d_mask_r{radius:g}.nii.gz')
+            if os.path.exists(path):
+                os.remove(path)
         if os.path.exists(os.path.join('test', 'bkgvar3d_res.txt')):
             os.remove(os.path.join('test', 'bkgvar3d_res.txt'))
@@ -1,6 +1,7 @@
 import unittest
 import nmiq.tasks.contrast_cyl3d
 import SimpleITK as sitk
+import numpy as np
 import os
 
 
@@ -141,10 +142,119 @@ class TestContrastCyl3D_task(unittest.TestCase):
         nmiq.tasks.contrast_cyl3d(task_dict)
         with open(os.path.join('test', 'contrast_cyl3d_res.txt'), 'r') as f:
             lines = f.readlines()
-            self.assertEqual(1, len(lines))
+            self.assertEqual(2, len(lines))
             line0 = lines[0].strip().split()
             self.assertEqual("Contrast:", line0[0])
             self.assertAlmostEqual(9.0, float(line0[1]), places=6)
+            line1 = lines[1].strip().split()
+            self.assertEqual("S.E.:", line1[0])
+            self.assertAlmostEqual(np.sqrt(1 / 6), float(line1[1]), places=6)
+
+    def test_contrast_slices(self):
+        src = sitk.Image((10, 10, 10), sitk.sitkFloat32)
+        src.SetSpacing((1, 1, 2))
+        src.SetOrigin((0, 0, -1))
+
+        src[2, 3, 2] = 1.0
+        src[7, 7, 2] = 0.1
+        src[2, 3, 3] = 1.1
+        src[7, 7, 3] = 0.1
+        src[2, 3, 4] = 0.9
+        src[7, 7, 4] = 0.2
+
+        task_dict = {
+            'image': src,
+            'start_z': 3.0,
+            'end_z': 7.0,
+            'cylinder_center_x': 3.0,
+            'cylinder_center_y': 3.0,
+            'background_center_x': 7.0,
+            'background_center_y': 7.0,
+            'cylinder_radius': 0.5,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.contrast_cyl3d(task_dict)
+        with open(os.path.join('test', 'contrast_cyl3d_slices.txt'),
+                  'r') as f:
+            lines = f.readlines()
+        self.assertEqual("z\tContrast", lines[0].strip())
+        self.assertEqual(4, len(lines))
+        for line, z, c in zip(lines[1:], [3.0, 5.0, 7.0], [9.0, 10.0, 3.5]):
+            z_line, c_line = line.strip().split('\t')
+            self.assertEqual(z, float(z_line))
+            self.assertAlmostEqual(c, float(c_line), places=6)
+
+    def test_contrast_result_warm_start(self):
+        src = sitk.Image((10, 10, 10), sitk.sitkFloat32)
+        src.SetSpacing((1, 1, 1))
+        src.SetOrigin((0, 0, 0))
+
+        # Hot line drifting by one voxel in x halfway along the cylinder
+        src[2, 3, 2] = 1.0
+        src[7, 7, 2] = 0.1
+        src[2, 3, 3] = 1.1
+        src[7, 7, 3] = 0.1
+        src[3, 3, 4] = 0.9
+        src[7, 7, 4] = 0.1
+        src[3, 3, 5] = 1.0
+        src[7, 7, 5] = 0.1
+
+        task_dict = {
+            'image': src,
+            'start_z': 2.0,
+            'end_z': 5.0,
+            'cylinder_center_x': 3.0,
+            'cylinder_center_y': 3.0,
+            'background_center_x': 7.0,
+            'background_center_y': 7.0,
+            'cylinder_radius': 0.5,
+            'warm_start': True,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.contrast_cyl3d(task_dict)
+        hot = sitk.ReadImage(os.path.join('test', 'contrast_cyl3d_hot.nii.gz'))
+        self.assertEqual(1, hot[2, 3, 2])
+        self.assertEqual(1, hot[3, 3, 5])
+        with open(os.path.join('test', 'contrast_cyl3d_res.txt'), 'r') as f:
+            line0 = f.readline().strip().split()
+            self.assertEqual("Contrast:", line0[0])
+            self.assertAlmostEqual(9.0, float(line0[1]), places=6)
+
+    def test_contrast_result_subvoxel(self):
+        src = sitk.Image((20, 20, 10), sitk.sitkFloat32)
+        src.SetSpacing((1, 1, 1))
+        src.SetOrigin((0, 0, 0))
+        src += 1.0
+        src[5, 6, 2] = 10.0
+        src[5, 6, 3] = 10.0
+        src[5, 6, 4] = 10.0
+
+        task_dict = {
+            'image': src,
+            'start_z': 2.0,
+            'end_z': 4.0,
+            'cylinder_center_x': 5.0,
+            'cylinder_center_y': 6.0,
+            'background_center_x': 14.0,
+            'background_center_y': 14.0,
+            'cylinder_radius': 3.0,
+            'subvoxel': True,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.contrast_cyl3d(task_dict)
+        hot = sitk.ReadImage(os.path.join('test', 'contrast_cyl3d_hot.nii.gz'))
+        hot_data = sitk.GetArrayFromImage(hot)
+        self.assertAlmostEqual(9.0 * np.pi, np.sum(hot_data[2]), delta=0.1)
+        with open(os.path.join('test', 'contrast_cyl3d_res.txt'), 'r') as f:
+            lines = f.readlines()
+            self.assertEqual(2, len(lines))
+            line0 = lines[0].strip().split()
+            self.assertEqual("Contrast:", line0[0])
+            expected = 9.0 / (9.0 * np.pi)
+            self.assertAlmostEqual(expected, float(line0[1]), places=2)
 
     def tearDown(self):
         if os.path.exists(os.path.join('test', 'contrast_cyl3d_hot.nii.gz')):
@@ -153,3 +263,5 @@ class TestContrastCyl3D_task(unittest.TestCase):
             os.remove(os.path.join('test', 'contrast_cyl3d_bkg.nii.gz'))
         if os.path.exists(os.path.join('test', 'contrast_cyl3d_res.txt')):
             os.remove(os.path.join('test', 'contrast_cyl3d_res.txt'))
+        if os.path.exists(os.path.join('test', 'contrast_cyl3d_slices.txt')):
+            os.remove(os.path.join('test', 'contrast_cyl3d_slices.txt'))
@@ -43,6 +43,167 @@ class TestJackknife(unittest.TestCase):
         self.assertEqual(0.5, m)
         self.assertAlmostEqual(0.245452, se, places=6)
 
+    def test_bkg_var_closed_form(self):
+        data = np.array([1.0, 2.0, 3.0])
+
+        m, se = nmiq.jackknife('cv', data)
+        self.assertEqual(0.5, m)
+        self.assertAlmostEqual(0.245452, se, places=6)
+
+    def test_closed_form_matches_loop(self):
+        rng = np.random.default_rng(3)
+        data = rng.normal(10.0, 2.0, 50)
+
+        funcs = {
+            'mean': lambda x: float(np.mean(x)),
+            'std': lambda x: float(np.std(x, ddof=1)),
+            'cv': lambda x: float(np.std(x, ddof=1) / np.mean(x))
+        }
+        for name, func in funcs.items():
+            m0, se0 = nmiq.jackknife(func, data)
+            m1, se1 = nmiq.jackknife(name, data)
+            self.assertAlmostEqual(m0, m1, places=12)
+            self.assertAlmostEqual(se0, se1, places=12)
+
+    def test_batched(self):
+        rng = np.random.default_rng(4)
+        data = rng.normal(10.0, 2.0, 20)
+
+        def func(x: npt.NDArray[np.float64], axis: int | None = None):
+            return np.median(x, axis=axis)
+
+        m0, se0 = nmiq.jackknife(func, data)
+        m1, se1 = nmiq.jackknife(func, data, batched=True)
+        self.assertEqual(m0, m1)
+        self.assertAlmostEqual(se0, se1, places=12)
+
+    def test_delete_d(self):
+        rng = np.random.default_rng(5)
+        data = rng.normal(10.0, 2.0, 8)
+
+        # Brute force delete-2 jackknife of the coefficient of variation
+        jks = []
+        for i in range(8):
+            for j in range(i + 1, 8):
+                x = np.delete(data, [i, j])
+                jks.append(np.std(x, ddof=1) / np.mean(x))
+        jk = np.array(jks)
+        se = np.sqrt(6.0 / (2.0 * 28.0) * np.sum((jk - np.mean(jk)) ** 2))
+
+        def func(x: npt.NDArray[np.float64], axis: int | None = None):
+            return np.std(x, ddof=1, axis=axis) / np.mean(x, axis=axis)
+
+        _, se0 = nmiq.jackknife(func, data, d=2)
+        _, se1 = nmiq.jackknife(func, data, batched=True, d=2)
+        _, se2 = nmiq.jackknife('cv', data, d=2)
+        self.assertAlmostEqual(se, se0, places=12)
+        self.assertAlmostEqual(se, se1, places=12)
+        self.assertAlmostEqual(se, se2, places=12)
+
+    def test_block(self):
+        rng = np.random.default_rng(6)
+        data = rng.normal(10.0, 2.0, 9)
+        groups = np.array([0, 0, 1, 1, 1, 2, 3, 3, 3])
+
+        # Brute force block jackknife of the mean
+        jks = np.array([np.mean(data[groups != g]) for g in range(4)])
+        se = np.sqrt(3.0 / 4.0 * np.sum((jks - np.mean(jks)) ** 2))
+
+        def func(x: npt.NDArray[np.float64], axis: int | None = None):
+            return np.mean(x, axis=axis)
+
+        m0, se0 = nmiq.jackknife(func, data, groups=groups)
+        m1, se1 = nmiq.jackknife(func, data, batched=True, groups=groups)
+        m2, se2 = nmiq.jackknife('mean', data, groups=groups)
+        self.assertAlmostEqual(np.mean(data), m0, places=12)
+        self.assertAlmostEqual(se, se0, places=12)
+        self.assertAlmostEqual(se, se1, places=12)
+        self.assertAlmostEqual(se, se2, places=12)
+
+    def test_singleton_blocks(self):
+        data = np.array([1.0, 2.0, 3.0])
+
+        m, se = nmiq.jackknife('cv', data, groups=[7, 3, 5])
+        self.assertEqual(0.5, m)
+        self.assertAlmostEqual(0.245452, se, places=6)
+
+    def test_too_many_deleted(self):
+        with self.assertRaises(ValueError):
+            nmiq.jackknife('mean', np.array([1.0, 2.0]), d=3)
+        with self.assertRaises(ValueError):
+            nmiq.jackknife('mean', np.array([1.0, 2.0]), groups=[0])
+
+    def test_single_value(self):
+        data = np.array([2.0])
+
+        with np.errstate(all='ignore'):
+            for name in ['std', 'cv']:
+                m, se = nmiq.jackknife(name, data)
+                self.assertTrue(np.isnan(m))
+                self.assertTrue(np.isnan(se))
+
+    def test_unknown_statistic(self):
+        with self.assertRaises(ValueError):
+            nmiq.jackknife('var', np.array([1.0, 2.0]))
+
+
+def _median(x: npt.NDArray[np.float64], axis: int | None = None):
+    return np.median(x, axis=axis)
+
+
+class TestBootstrap(unittest.TestCase):
+
+    def test_reproducible(self):
+        data = np.random.default_rng(7).normal(10.0, 2.0, 30)
+
+        res0 = nmiq.bootstrap('cv', data, n_resamples=500, seed=11)
+        res1 = nmiq.bootstrap('cv', data, n_resamples=500, seed=11)
+        self.assertEqual(res0, res1)
+
+    def test_mean(self):
+        data = np.random.default_rng(8).normal(10.0, 2.0, 100)
+
+        m, se, ci = nmiq.bootstrap('mean', data, n_resamples=5000, seed=1)
+        se_mean = np.std(data, ddof=1) / np.sqrt(100)
+        self.assertEqual(np.mean(data), m)
+        self.assertAlmostEqual(se_mean, se, delta=0.05 * se_mean)
+        self.assertAlmostEqual(m - 1.96 * se_mean, ci[0], delta=0.1 * se_mean)
+        self.assertAlmostEqual(m + 1.96 * se_mean, ci[1], delta=0.1 * se_mean)
+
+    def test_batched_and_workers(self):
+        data = np.random.default_rng(9).normal(10.0, 2.0, 25)
+
+        res0 = nmiq.bootstrap(_median, data, n_resamples=400, seed=2,
+                              method='bca')
+        res1 = nmiq.bootstrap(_median, data, n_resamples=400, seed=2,
+                              method='bca', batched=True)
+        res2 = nmiq.bootstrap(_median, data, n_resamples=400, seed=2,
+                              method='bca', workers=2)
+        self.assertEqual(res0, res1)
+        self.assertEqual(res0, res2)
+
+    def test_bca(self):
+        data = np.random.default_rng(10).gamma(2.0, 2.0, 60)
+
+        m, _, ci = nmiq.bootstrap('cv', data, n_resamples=4000, seed=3,
+                                  method='bca')
+        _, _, ci_p = nmiq.bootstrap('cv', data, n_resamples=4000, seed=3)
+        self.assertLess(ci[0], m)
+        self.assertGreater(ci[1], m)
+        self.assertNotEqual(ci, ci_p)
+
+    def test_single_value(self):
+        with np.errstate(all='ignore'):
+            m, se, ci = nmiq.bootstrap('cv', np.array([2.0]), seed=0)
+        self.assertTrue(np.isnan(m))
+        self.assertTrue(np.isnan(se))
+        self.assertTrue(np.isnan(ci[0]))
+        self.assertTrue(np.isnan(ci[1]))
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            nmiq.bootstrap('mean', np.array([1.0, 2.0]), method='normal')
+
 
 class TestLoadImages(unittest.TestCase):
 
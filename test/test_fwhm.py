@@ -1,6 +1,8 @@
 import unittest
 import nmiq.fwhm
 import numpy as np
+import os
+import SimpleITK as sitk
 
 
 class TestNemaFWHMFromLineProfile(unittest.TestCase):
@@ -14,10 +16,174 @@ class TestNemaFWHMFromLineProfile(unittest.TestCase):
         self.assertEqual(nmiq.fwhm.nema_fwhm_from_line_profile(line)[0], 5.0)
 
 
+class TestNemaFWHMBatch(unittest.TestCase):
+
+    def test_example_fwhm(self):
+        lines = np.array([[0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+                          [1.0, 2.0, 4.0, 6.0, 7.75, 9.75, 9.75, 6.0, 4.0]])
+        res = nmiq.fwhm.nema_fwhm_batch(lines)
+        self.assertEqual(1.0, res['fwhm'][0])
+        self.assertEqual(5.0, res['fwhm'][1])
+        self.assertEqual((2, 3), res['coeffs'].shape)
+
+    def test_matches_single_profiles(self):
+        rng = np.random.default_rng(2)
+        x = np.arange(15)
+        lines = np.array([
+            a * np.exp(-4 * np.log(2.0) * (x - b) ** 2 / w ** 2)
+            + rng.normal(0.0, 0.05 * a, 15)
+            for a, b, w in zip(rng.uniform(1, 10, 50),
+                               rng.uniform(5.0, 9.0, 50),
+                               rng.uniform(1.5, 5.0, 50))])
+
+        res = nmiq.fwhm.nema_fwhm_batch(lines)
+        for j, line in enumerate(lines):
+            fwhm, info = nmiq.fwhm.nema_fwhm_from_line_profile(line)
+            self.assertEqual(fwhm, res['fwhm'][j])
+            for key in ['x1', 'hm', 'left', 'left_int', 'right',
+                        'right_int']:
+                self.assertEqual(info[key], res[key][j])
+            a, b, c = res['coeffs'][j]
+            self.assertEqual(info['poly'](2.5), a * 2.5**2 + b * 2.5 + c)
+
+    def test_edge_cases(self):
+        lines = np.array([[5.0, 3.0, 1.0, 0.0, 0.0],
+                          [0.0, 1.0, 2.0, 3.0, 5.0],
+                          [4.0, 4.0, 5.0, 4.0, 4.0]])
+        res = nmiq.fwhm.nema_fwhm_batch(lines)
+        self.assertTrue(np.all(np.isnan(res['fwhm'])))
+        self.assertTrue(np.all(np.isnan(res['coeffs'])))
+        self.assertTrue(np.all(res['left'] == -1))
+
+
+class TestNemaWidths(unittest.TestCase):
+
+    def test_fwhm_and_fwtm(self):
+        x = np.arange(81)
+        line = np.exp(-4 * np.log(2.0) * (x - 40.3) ** 2 / 12.0 ** 2)
+        fwhm, fwtm = nmiq.fwhm.nema_widths_from_line_profile(line)
+        self.assertAlmostEqual(12.0, fwhm, delta=0.1)
+        self.assertAlmostEqual(12.0 * np.sqrt(np.log(10) / np.log(2)), fwtm,
+                               delta=0.1)
+
+    def test_fwhm_matches_nema_fwhm(self):
+        line = np.array([1.0, 2.0, 4.0, 6.0, 7.75, 9.75, 9.75, 6.0, 4.0])
+        widths = nmiq.fwhm.nema_widths_from_line_profile(line, [0.5])
+        self.assertEqual([5.0], widths)
+
+    def test_batch_levels(self):
+        lines = np.array([[0.0, 1.0, 4.0, 8.0, 4.0, 1.0, 0.0],
+                          [0.0, 0.0, 2.0, 4.0, 2.0, 0.0, 0.0]])
+        res = nmiq.fwhm.nema_widths_batch(lines, [0.5, 0.25, 0.1])
+        self.assertEqual((2, 3), res['widths'].shape)
+        np.testing.assert_allclose(res['levels'],
+                                   [[4.0, 2.0, 0.8], [2.0, 1.0, 0.4]])
+        np.testing.assert_allclose(res['widths'][0], [2.0, 10 / 3, 4.4])
+        np.testing.assert_allclose(res['widths'][1], [2.0, 3.0, 3.6])
+
+    def test_missing_crossing(self):
+        line = np.array([2.0, 3.0, 5.0, 3.0, 2.0])
+        fwhm, fwtm = nmiq.fwhm.nema_widths_from_line_profile(line)
+        self.assertEqual(3.0, fwhm)
+        self.assertTrue(np.isnan(fwtm))
+
+    def test_truncated_left_tail(self):
+        line = np.array([2.0, 3.0, 5.0, 3.0, 2.0, 1.0, 0.0])
+        res = nmiq.fwhm.nema_widths_batch(line[np.newaxis, :])
+        self.assertEqual(3.0, res['widths'][0, 0])
+        self.assertTrue(np.isnan(res['widths'][0, 1]))
+        self.assertEqual(-1, res['left'][0, 1])
+        self.assertEqual(-1, res['right'][0, 1])
+
+
 class TestGaussfitFWHMFromLineProfile(unittest.TestCase):
 
     def test_example_fwhm(self):
         line = np.array([0.1, 0.3, 1.2, 1.1, 0.4])
         self.assertAlmostEqual(
             nmiq.fwhm.gaussfit_fwhm_from_line_profile(line)[2],
-            2.18388493, places=8)
+            2.18388438, places=8)
+
+    def test_noiseless_fast_path(self):
+        x = np.arange(21)
+        line = 3.0 * np.exp(-4 * np.log(2.0) * (x - 15.3) ** 2 / 7.5 ** 2)
+        p = nmiq.fwhm.gaussfit_fwhm_from_line_profile(line)
+        self.assertAlmostEqual(3.0, p[0], places=10)
+        self.assertAlmostEqual(15.3, p[1], places=10)
+        self.assertAlmostEqual(7.5, p[2], places=10)
+
+    def test_off_centre_wide_peak(self):
+        rng = np.random.default_rng(1)
+        x = np.arange(21)
+        line = 3.0 * np.exp(-4 * np.log(2.0) * (x - 4.2) ** 2 / 8.0 ** 2)
+        line += rng.normal(0.0, 0.03, 21)
+        p = nmiq.fwhm.gaussfit_fwhm_from_line_profile(line)
+        self.assertAlmostEqual(8.0, p[2], delta=0.3)
+        self.assertAlmostEqual(4.2, p[1], delta=0.2)
+
+    def test_real_profile(self):
+        # Profile of a line source in the bundled test image, with its peak
+        # next to the start. The earlier curve_fit stopped at a width of
+        # -0.14 mm on this profile.
+        img = sitk.ReadImage(os.path.join(
+            'test', 'data', 'res',
+            'Patient_test20250806_Study_1_Scan_6_Bed_1_Dyn_20.dcm'))
+        line = sitk.GetArrayViewFromImage(img)[22, 77, 60:71]
+        a, b, w = nmiq.fwhm.gaussfit_fwhm_from_line_profile(
+            np.array(line, dtype=np.float64))
+        self.assertAlmostEqual(1.44578, b, places=4)
+        self.assertAlmostEqual(10.2191, w * img.GetSpacing()[0], places=3)
+
+
+class TestGaussfitFWHMBatch(unittest.TestCase):
+
+    def test_example_fwhm(self):
+        lines = np.array([[0.1, 0.3, 1.2, 1.1, 0.4],
+                          [0.0, 1.0, 3.0, 1.0, 0.0]])
+        p, converged = nmiq.fwhm.gaussfit_fwhm_batch(lines)
+        self.assertEqual((2, 3), p.shape)
+        self.assertTrue(np.all(converged))
+        self.assertAlmostEqual(p[0, 2], 2.1838844, places=7)
+        self.assertAlmostEqual(p[1, 1], 2.0, places=8)
+
+    def test_matches_single_fits(self):
+        rng = np.random.default_rng(0)
+        x = np.arange(15)
+        lines = np.array([
+            a * np.exp(-4 * np.log(2.0) * (x - b) ** 2 / w ** 2)
+            + rng.normal(0.0, 0.02 * a, 15)
+            for a, b, w in zip(rng.uniform(1, 10, 20),
+                               rng.uniform(5.5, 8.5, 20),
+                               rng.uniform(1.5, 5.0, 20))])
+
+        p, converged = nmiq.fwhm.gaussfit_fwhm_batch(lines)
+        self.assertTrue(np.all(converged))
+        for line, p_line in zip(lines, p):
+            p_single = nmiq.fwhm.gaussfit_fwhm_from_line_profile(line)
+            self.assertAlmostEqual(abs(p_single[2]), p_line[2], places=4)
+
+        # Results do not depend on the other profiles in the batch
+        p_chunks = np.concatenate([
+            nmiq.fwhm.gaussfit_fwhm_batch(lines[i:i + 3])[0]
+            for i in range(0, 20, 3)])
+        self.assertTrue(np.array_equal(p, p_chunks))
+
+    def test_noiseless_fast_path(self):
+        x = np.arange(21)
+        lines = np.array([
+            2.0 * np.exp(-4 * np.log(2.0) * (x - 3.7) ** 2 / 4.1 ** 2),
+            5.0 * np.exp(-4 * np.log(2.0) * (x - 12.5) ** 2 / 9.0 ** 2)])
+        p, converged = nmiq.fwhm.gaussfit_fwhm_batch(lines, max_iter=0)
+        self.assertTrue(np.all(converged))
+        np.testing.assert_allclose(p, [[2.0, 3.7, 4.1], [5.0, 12.5, 9.0]],
+                                   rtol=1e-10)
+
+    def test_flat_profile(self):
+        p, converged = nmiq.fwhm.gaussfit_fwhm_batch(np.zeros((1, 7)))
+        self.assertTrue(converged[0])
+        self.assertEqual(0.0, p[0, 0])
+
+    def test_not_converged(self):
+        lines = np.array([[0.1, 0.3, 1.2, 1.1, 0.4]])
+        _, converged = nmiq.fwhm.gaussfit_fwhm_batch(lines, max_iter=1)
+        self.assertFalse(converged[0])
@@ -0,0 +1,140 @@
+import unittest
+import nmiq.labelstats
+import nmiq.roi
+import SimpleITK as sitk
+import numpy as np
+
+
+class TestLabelStatistics(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        self.data = rng.normal(10.0, 2.0, (6, 7, 8))
+        self.labels = rng.integers(0, 4, (6, 7, 8)).astype(np.uint8)
+        self.img = sitk.GetImageFromArray(self.data)
+        self.label_img = sitk.GetImageFromArray(self.labels)
+
+    def test_matches_sitk(self):
+        stats = nmiq.labelstats.label_statistics(self.img, self.label_img)
+        f = sitk.LabelStatisticsImageFilter()
+        f.Execute(self.img, self.label_img)
+        self.assertEqual(4, len(stats['count']))
+        for label in range(4):
+            self.assertEqual(f.GetCount(label), stats['count'][label])
+            self.assertAlmostEqual(f.GetSum(label), stats['sum'][label],
+                                   places=10)
+            self.assertAlmostEqual(f.GetMean(label), stats['mean'][label],
+                                   places=10)
+            self.assertAlmostEqual(f.GetVariance(label),
+                                   stats['variance'][label], places=10)
+            self.assertEqual(f.GetMinimum(label), stats['min'][label])
+            self.assertEqual(f.GetMaximum(label), stats['max'][label])
+
+    def test_arrays(self):
+        stats = nmiq.labelstats.label_statistics(self.data, self.labels == 2)
+        values = self.data[self.labels == 2]
+        self.assertEqual(2, len(stats['mean']))
+        self.assertAlmostEqual(np.mean(values), stats['mean'][1], places=10)
+        self.assertAlmostEqual(np.var(values, ddof=1), stats['variance'][1],
+                               places=10)
+
+    def test_missing_label(self):
+        labels = np.where(self.labels == 2, 3, self.labels)
+        stats = nmiq.labelstats.label_statistics(self.data, labels)
+        self.assertEqual(0, stats['count'][2])
+        self.assertTrue(np.isnan(stats['mean'][2]))
+        self.assertTrue(np.isnan(stats['variance'][2]))
+        self.assertTrue(np.isnan(stats['min'][2]))
+        self.assertTrue(np.isnan(stats['max'][2]))
+
+    def test_weights(self):
+        weights = np.linspace(0.0, 1.0, self.data.size).reshape(
+            self.data.shape)
+        stats = nmiq.labelstats.label_statistics(self.img, self.label_img,
+                                                 weights=weights)
+        for label in range(4):
+            inside = self.labels == label
+            w = weights[inside]
+            x = self.data[inside]
+            mean = np.sum(w * x) / np.sum(w)
+            self.assertAlmostEqual(np.sum(w), stats['count'][label],
+                                   places=10)
+            self.assertAlmostEqual(mean, stats['mean'][label], places=10)
+            self.assertAlmostEqual(
+                np.sum(w * (x - mean) ** 2) / (np.sum(w) - 1),
+                stats['variance'][label], places=10)
+            self.assertEqual(np.min(x[w > 0]), stats['min'][label])
+            self.assertEqual(np.max(x[w > 0]), stats['max'][label])
+
+    def test_per_slice(self):
+        stats = nmiq.labelstats.label_statistics(self.img, self.label_img,
+                                                 per_slice=True)
+        self.assertEqual((4, 6), stats['mean'].shape)
+        for label in range(4):
+            for z in range(6):
+                x = self.data[z][self.labels[z] == label]
+                self.assertEqual(len(x), stats['count'][label, z])
+                self.assertAlmostEqual(np.mean(x), stats['mean'][label, z],
+                                       places=10)
+                self.assertEqual(np.max(x), stats['max'][label, z])
+
+    def test_slice_range(self):
+        # Label 3 only on slices 2 to 4
+        labels = self.labels.copy()
+        labels[[0, 1, 5]] %= 3
+        stats = nmiq.labelstats.label_statistics(self.data, labels)
+        self.assertEqual(2, stats['first_slice'][3])
+        self.assertEqual(4, stats['last_slice'][3])
+        for label in range(4):
+            z = np.nonzero(labels == label)[0]
+            self.assertEqual(np.min(z), stats['first_slice'][label])
+            self.assertEqual(np.max(z), stats['last_slice'][label])
+
+    def test_background(self):
+        # No background on the first and last slices
+        labels = self.labels.copy()
+        labels[[0, 5]] = np.maximum(labels[[0, 5]], 1)
+        stats = nmiq.labelstats.label_statistics(self.data, labels)
+        self.assertEqual(1, stats['first_slice'][0])
+        self.assertEqual(4, stats['last_slice'][0])
+        self.assertEqual(np.min(self.data[labels == 0]), stats['min'][0])
+        self.assertEqual(np.max(self.data[labels == 0]), stats['max'][0])
+        stats = nmiq.labelstats.label_statistics(self.data, labels,
+                                                 per_slice=True)
+        self.assertTrue(np.isnan(stats['min'][0, 0]))
+        self.assertTrue(np.isnan(stats['max'][0, 5]))
+        self.assertEqual(np.min(self.data[2][labels[2] == 0]),
+                         stats['min'][0, 2])
+
+    def test_sparse_roi(self):
+        indices = np.flatnonzero(self.labels)
+        order = np.argsort(self.labels.ravel()[indices], kind='stable')
+        roi = nmiq.roi.SparseROI(
+            size=(8, 7, 6), spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0),
+            indices=indices[order],
+            offsets=np.concatenate(
+                ([0], np.cumsum(np.bincount(self.labels.ravel())[1:]))),
+            weights=np.linspace(0.1, 1.0, len(indices)).astype(np.float32))
+        weights = np.zeros(self.data.size)
+        weights[roi.indices] = roi.weights
+        for per_slice in (False, True):
+            sparse = nmiq.labelstats.label_statistics(self.img, roi,
+                                                      per_slice=per_slice)
+            dense = nmiq.labelstats.label_statistics(
+                self.img, self.label_img, weights=weights,
+                per_slice=per_slice)
+            self.assertEqual(0, np.max(sparse['count'][0]))
+            for key in dense:
+                np.testing.assert_allclose(dense[key][1:], sparse[key][1:],
+                                           rtol=1e-12)
+        roi.size = (8, 7, 5)
+        self.assertRaises(ValueError, nmiq.labelstats.label_statistics,
+                          self.img, roi)
+
+    def test_size_mismatch(self):
+        self.assertRaises(ValueError, nmiq.labelstats.label_statistics,
+                          self.data, self.labels[1:])
+        self.assertRaises(ValueError, nmiq.labelstats.label_statistics,
+                          self.data, self.labels, np.ones(3))
+        self.assertRaises(ValueError, nmiq.labelstats.label_statistics,
+                          self.data, -self.labels.astype(int))
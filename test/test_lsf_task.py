@@ -1,6 +1,7 @@
 import unittest
 import nmiq.tasks.lsf
 import SimpleITK as sitk
+import numpy as np
 import os
 
 
@@ -76,7 +77,7 @@ class TestLSF_task(unittest.TestCase):
 
         with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
             lines = f.readlines()
-            self.assertEqual(4, len(lines))
+            self.assertEqual(7, len(lines))
             line0 = lines[0].strip().split()
             self.assertEqual("NEMA:", line0[0])
             self.assertAlmostEqual(3.51165675, float(line0[1]), places=8)
@@ -87,11 +88,22 @@ class TestLSF_task(unittest.TestCase):
 
             line2 = lines[2].strip().split()
             self.assertEqual("Gauss:", line2[0])
-            self.assertAlmostEqual(4.09120, float(line2[1]), places=5)
+            self.assertAlmostEqual(4.09119, float(line2[1]), places=5)
 
             line3 = lines[3].strip().split()
             self.assertEqual("S.E.:", line3[0])
-            self.assertAlmostEqual(0.41674, float(line3[1]), places=5)
+            self.assertAlmostEqual(0.41675, float(line3[1]), places=5)
+
+            line4 = lines[4].strip().split()
+            self.assertEqual("FWTM:", line4[0])
+            self.assertAlmostEqual(7.60819979, float(line4[1]), places=8)
+
+            line5 = lines[5].strip().split()
+            self.assertEqual("S.E.:", line5[0])
+            self.assertAlmostEqual(0.80729, float(line5[1]), places=5)
+
+            # The first profile is cut off above the tenth maximum
+            self.assertEqual("Dropped:\t0\t0\t1", lines[6].strip())
 
     def test_fwhm_with_spacing_resfile(self):
 
@@ -163,7 +175,7 @@ class TestLSF_task(unittest.TestCase):
 
         with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
             lines = f.readlines()
-            self.assertEqual(4, len(lines))
+            self.assertEqual(7, len(lines))
             line0 = lines[0].strip().split()
             self.assertEqual("NEMA:", line0[0])
             self.assertAlmostEqual(12.14422123, float(line0[1]), places=8)
@@ -174,11 +186,22 @@ class TestLSF_task(unittest.TestCase):
 
             line2 = lines[2].strip().split()
             self.assertEqual("Gauss:", line2[0])
-            self.assertAlmostEqual(14.2018, float(line2[1]), places=4)
+            self.assertAlmostEqual(14.2017, float(line2[1]), places=4)
 
             line3 = lines[3].strip().split()
             self.assertEqual("S.E.:", line3[0])
-            self.assertAlmostEqual(3.95191, float(line3[1]), places=5)
+            self.assertAlmostEqual(3.95187, float(line3[1]), places=5)
+
+            line4 = lines[4].strip().split()
+            self.assertEqual("FWTM:", line4[0])
+            self.assertAlmostEqual(30.4097489, float(line4[1]), places=6)
+
+            line5 = lines[5].strip().split()
+            self.assertEqual("S.E.:", line5[0])
+            self.assertAlmostEqual(8.58191, float(line5[1]), places=5)
+
+            # The first profile is cut off above the tenth maximum
+            self.assertEqual("Dropped:\t0\t0\t1", lines[6].strip())
 
     def test_fwhm_image_file(self):
         img = sitk.Image((100, 100, 100), sitk.sitkFloat32)
@@ -330,8 +353,447 @@ class TestLSF_task(unittest.TestCase):
 
         self.assertRaises(ValueError, nmiq.tasks.lsf, task_dict)
 
+    def test_peak_ties(self):
+
+        x = np.arange(40)
+        data = np.zeros((4, 40, 40))
+        profile = np.exp(-0.5 * (x - 10) ** 2 / 2.0 ** 2)
+        for z in [1, 3]:
+            data[z, 10, :20] = profile[:20]
+            data[z, 20:, 30] = profile[:20]
+            # Voxels as hot as the peaks, earlier in y but later in x
+            data[z, 5, 12] = 1.0
+            data[z, 25, 33] = 1.0
+        img = sitk.GetImageFromArray(data)
+
+        task_dict = {
+            'image': img,
+            'start_z': 1.0,
+            'end_z': 4.0,
+            'delta_z': 2.0,
+            'center_x': [10, 30],
+            'center_y': [10, 30],
+            'radius': [8, 8],
+            'direction': ['x', 'y'],
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.lsf(task_dict)
+
+        # The first maximum with x varying slowest is used for the profiles
+        fwhm = nmiq.nema_fwhm_from_line_profile(profile[2:19])[0]
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            lines = f.readlines()
+            line0 = lines[0].strip().split()
+            self.assertAlmostEqual(fwhm, float(line0[1]), places=10)
+
+    def test_fwhm_bootstrap(self):
+
+        x = np.arange(40)
+        data = np.zeros((10, 40, 40))
+        for z, width in [(2, 2.0), (4, 2.5), (6, 3.0), (8, 2.2)]:
+            profile = np.exp(-0.5 * (x - 10) ** 2 / width ** 2)
+            data[z, 10, :20] = profile[:20]
+            data[z, 20:, 30] = profile[:20]
+        img = sitk.GetImageFromArray(data)
+
+        task_dict = {
+            'image': img,
+            'start_z': 2.0,
+            'end_z': 9.0,
+            'delta_z': 2.0,
+            'center_x': [10, 30],
+            'center_y': [10, 30],
+            'radius': [8, 8],
+            'direction': ['x', 'y'],
+            'bootstrap': 500,
+            'bootstrap_method': 'bca',
+            'seed': 1,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            lines = f.readlines()
+
+        self.assertEqual(10, len(lines))
+        for i, name in [(0, 'NEMA'), (2, 'Gauss')]:
+            mean = float(lines[i].strip().split('\t')[1])
+            line_se = lines[6 + i].strip().split('\t')
+            self.assertEqual(f"{name} bootstrap S.E.:", line_se[0])
+            self.assertLess(0.0, float(line_se[1]))
+            line_ci = lines[7 + i].strip().split('\t')
+            self.assertEqual(f"{name} 95% CI:", line_ci[0])
+            self.assertLess(float(line_ci[1]), mean)
+            self.assertGreater(float(line_ci[2]), mean)
+
+        # The same seed gives the same result
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            self.assertEqual(lines, f.readlines())
+
     def tearDown(self):
         if os.path.exists(os.path.join('test', 'lsf_res.txt')):
             os.remove(os.path.join('test', 'lsf_res.txt'))
         if os.path.exists(os.path.join('test', 'fwhm.png')):
             os.remove(os.path.join('test', 'fwhm.png'))
+
+    def test_track_tilted_sources(self):
+
+        # Two gaussian line sources tilting in x and y, respectively
+        sigma = 1.5
+        z, y, x = np.mgrid[0:20, 0:50, 0:50]
+        data = (np.exp(-0.5 * ((x - 20 - 0.4 * z) ** 2 + (y - 15) ** 2)
+                       / sigma ** 2)
+                + np.exp(-0.5 * ((x - 35) ** 2 + (y - 25 - 0.3 * z) ** 2)
+                         / sigma ** 2))
+        img = sitk.GetImageFromArray(data)
+
+        task_dict = {
+            'image': img,
+            'start_z': 0.0,
+            'end_z': 20.0,
+            'delta_z': 2.0,
+            'center_x': [24, 35],
+            'center_y': [15, 28],
+            'radius': [7, 7],
+            'direction': ['x', 'y'],
+            'track': 4,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            lines = f.readlines()
+
+        # The profiles are centred on the sources and sample the gaussians
+        self.assertEqual(6, len(lines))
+        fwhm = 2 * np.sqrt(2 * np.log(2)) * sigma
+        self.assertAlmostEqual(fwhm, float(lines[2].strip().split()[1]),
+                               places=6)
+        self.assertAlmostEqual(fwhm, float(lines[0].strip().split()[1]),
+                               delta=0.1)
+
+    def test_track_half_voxel_slices(self):
+
+        # Sources whose width grows from slice to slice, sampled at z on the
+        # boundaries between slices
+        z, y, x = np.mgrid[0:6, 0:40, 0:40]
+        sigma = 1.0 + 0.3 * z
+        data = (np.exp(-0.5 * ((x - 20) ** 2 + (y - 15) ** 2) / sigma ** 2)
+                + np.exp(-0.5 * ((x - 12) ** 2 + (y - 25) ** 2)
+                         / sigma ** 2))
+        img = sitk.GetImageFromArray(data)
+        img.SetSpacing((1, 1, 2))
+
+        task_dict = {
+            'image': img,
+            'start_z': 1.0,
+            'end_z': 8.0,
+            'delta_z': 2.0,
+            'center_x': [20, 12],
+            'center_y': [15, 25],
+            'radius': [7, 7],
+            'direction': ['x', 'y'],
+            'output_path': os.path.join('test')
+        }
+
+        # Track mode measures the same slices as peak mode
+        results = []
+        for track in (None, 3):
+            if track is not None:
+                task_dict['track'] = track
+            nmiq.tasks.lsf(task_dict)
+            with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+                results.append(f.readlines())
+        self.assertEqual(results[0], results[1])
+
+    def test_track_no_source(self):
+
+        img = sitk.Image((50, 50, 20), sitk.sitkFloat32)
+
+        task_dict = {
+            'image': img,
+            'start_z': 0.0,
+            'end_z': 20.0,
+            'delta_z': 2.0,
+            'center_x': [24, 35],
+            'center_y': [15, 28],
+            'radius': [7, 7],
+            'direction': ['x', 'y'],
+            'track': 4,
+            'output_path': os.path.join('test')
+        }
+
+        self.assertRaises(ValueError, nmiq.tasks.lsf, task_dict)
+
+    def test_interpolated_oblique_profiles(self):
+
+        # Two gaussian line sources at sub-voxel positions
+        sigma = 2.0
+        z, y, x = np.mgrid[0:6, 0:60, 0:60]
+        data = (np.exp(-0.5 * ((x - 20.3) ** 2 + (y - 20.6) ** 2)
+                       / sigma ** 2)
+                + np.exp(-0.5 * ((x - 40.5) ** 2 + (y - 39.8) ** 2)
+                         / sigma ** 2))
+        img = sitk.GetImageFromArray(data)
+
+        task_dict = {
+            'image': img,
+            'start_z': 1.0,
+            'end_z': 5.0,
+            'delta_z': 2.0,
+            'center_x': [20, 40],
+            'center_y': [20, 40],
+            'radius': [10, 10],
+            'angle': [45, 120],
+            'profile_step': 0.25,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            lines = f.readlines()
+
+        # Finely sampled profiles resolve the gaussians in any direction
+        fwhm = 2 * np.sqrt(2 * np.log(2)) * sigma
+        for i in [0, 2]:
+            self.assertAlmostEqual(fwhm, float(lines[i].strip().split()[1]),
+                                   delta=0.1)
+
+    def test_interpolated_native_step(self):
+
+        img = sitk.Image((100, 100, 100), sitk.sitkFloat32)
+        img.SetSpacing((2, 2, 2))
+        for x, v in enumerate([1.0, 3.0, 7.0, 4.0, 1.0]):
+            img.SetPixel(18 + x, 20, 1, v)
+            img.SetPixel(30, 18 + x, 1, v)
+            img.SetPixel(18 + x, 20, 3, v)
+            img.SetPixel(30, 18 + x, 3, v)
+
+        task_dict = {
+            'image': img,
+            'start_z': 2.0,
+            'end_z': 7.0,
+            'delta_z': 4.0,
+            'center_x': [40, 60],
+            'center_y': [40, 40],
+            'radius': [8, 8],
+            'direction': ['x', 'y'],
+            'profile_step': 2.0,
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            lines = f.readlines()
+
+        # At the voxel spacing the profiles are the voxel values
+        fwhm = 2 * nmiq.nema_fwhm_from_line_profile(
+            np.array([0.0, 0.0, 1.0, 3.0, 7.0, 4.0, 1.0, 0.0, 0.0]))[0]
+        self.assertAlmostEqual(fwhm, float(lines[0].strip().split()[1]),
+                               places=10)
+        self.assertAlmostEqual(0.0, float(lines[1].strip().split()[1]),
+                               places=10)
+
+    def test_interpolated_errors(self):
+
+        img = sitk.Image((50, 50, 10), sitk.sitkFloat32)
+        task_dict = {
+            'image': img,
+            'start_z': 1.0,
+            'end_z': 5.0,
+            'delta_z': 2.0,
+            'center_x': [10, 40],
+            'center_y': [10, 40],
+            'radius': [8, 8],
+            'angle': [0],
+            'output_path': os.path.join('test')
+        }
+        self.assertRaises(ValueError, nmiq.tasks.lsf, task_dict)
+
+        # Profiles leaving the image
+        task_dict['angle'] = [0, 90]
+        task_dict['radius'] = [12, 12]
+        self.assertRaises(ValueError, nmiq.tasks.lsf, task_dict)
+
+    def test_search_box_clipped(self):
+
+        # One source next to the x = 0 edge of the image, with a search box
+        # reaching past it, and one inside
+        img = sitk.Image((40, 40, 4), sitk.sitkFloat32)
+        line = [0.0, 0.0, 1.0, 3.0, 7.0, 4.0, 1.0, 0.0, 0.0]
+        for z in range(4):
+            for y, v in enumerate(line):
+                img[1, 16 + y, z] = v
+                img[30, 16 + y, z] = v
+        task_dict = {
+            'image': img,
+            'start_z': 0.0,
+            'end_z': 4.0,
+            'delta_z': 1.0,
+            'center_x': [3, 30],
+            'center_y': [20, 20],
+            'radius': [5, 5],
+            'direction': ['y', 'y'],
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            lines = f.readlines()
+        fwhm = nmiq.nema_fwhm_from_line_profile(np.array(line))[0]
+        self.assertAlmostEqual(fwhm, float(lines[0].strip().split()[1]),
+                               places=10)
+        self.assertAlmostEqual(0.0, float(lines[1].strip().split()[1]),
+                               places=10)
+
+        # Search box entirely outside the image
+        task_dict['center_x'] = [-10, 30]
+        with self.assertRaisesRegex(ValueError, 'Search box outside image'):
+            nmiq.tasks.lsf(task_dict)
+
+        # Slices outside the image
+        task_dict['center_x'] = [3, 30]
+        task_dict['end_z'] = 6.0
+        with self.assertRaisesRegex(ValueError, 'Slice outside image'):
+            nmiq.tasks.lsf(task_dict)
+
+    def test_workers(self):
+
+        # Noisy line sources, so the gaussian fits take some iterations
+        rng = np.random.default_rng(3)
+        x = np.arange(40)
+        data = np.zeros((16, 40, 40))
+        for z in range(16):
+            width = 2.0 + 0.1 * z
+            profile = np.exp(-0.5 * (x - 10) ** 2 / width ** 2)
+            data[z, 10, :20] = profile[:20] + 0.05 * rng.random(20)
+            data[z, 20:, 30] = profile[:20] + 0.05 * rng.random(20)
+        img = sitk.GetImageFromArray(data)
+
+        task_dict = {
+            'image': img,
+            'start_z': 0.0,
+            'end_z': 16.0,
+            'delta_z': 1.0,
+            'center_x': [10, 30],
+            'center_y': [10, 30],
+            'radius': [8, 8],
+            'direction': ['x', 'y'],
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            serial = f.read()
+
+        task_dict['workers'] = 3
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            parallel = f.read()
+
+        self.assertEqual(serial, parallel)
+
+        # Adaptive slices, with several rounds of fits in the same pool
+        task_dict['target_se'] = 0.2
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            parallel = f.read()
+
+        del task_dict['workers']
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            serial = f.read()
+
+        self.assertEqual(serial, parallel)
+        self.assertIn("Slices:\t15\t16\n", serial)
+
+    def test_band(self):
+
+        # Gaussian line sources, offset from the voxel rows
+        sigma = 1.5
+        z, y, x = np.mgrid[0:6, 0:40, 0:40]
+        data = (np.exp(-0.5 * ((x - 10) ** 2 + (y - 10.4) ** 2)
+                       / sigma ** 2)
+                + np.exp(-0.5 * ((x - 29.7) ** 2 + (y - 30) ** 2)
+                         / sigma ** 2))
+        img = sitk.GetImageFromArray(data)
+
+        task_dict = {
+            'image': img,
+            'start_z': 1.0,
+            'end_z': 5.0,
+            'delta_z': 2.0,
+            'center_x': [10, 30],
+            'center_y': [10, 30],
+            'radius': [8, 8],
+            'direction': ['x', 'y'],
+            'output_path': os.path.join('test')
+        }
+
+        # The summed profiles are the sums of the single row profiles
+        rows = [np.sum(data[1, 8:13, 2:19], axis=0),
+                np.sum(data[1, 22:39, 28:33], axis=1)]
+        fwhm = np.mean([nmiq.nema_fwhm_from_line_profile(r)[0]
+                        for r in rows])
+        for key, value in [('band', 5), ('track', 3), ('profile_step', 1.0)]:
+            task_dict[key] = value
+            nmiq.tasks.lsf(task_dict)
+            with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+                lines = f.readlines()
+            self.assertAlmostEqual(fwhm, float(lines[0].strip().split()[1]),
+                                   places=10)
+
+    def test_target_se(self):
+
+        # Line sources with slowly varying widths
+        rng = np.random.default_rng(5)
+        x = np.arange(40)
+        data = np.zeros((16, 40, 40))
+        for z in range(16):
+            for row, width in [(10, 2.0), (30, 2.5)]:
+                width = width + 0.05 * rng.standard_normal()
+                profile = np.exp(-0.5 * (x - 10) ** 2 / width ** 2)
+                data[z, row, :20] = profile[:20]
+        img = sitk.GetImageFromArray(data)
+
+        task_dict = {
+            'image': img,
+            'start_z': 0.0,
+            'end_z': 16.0,
+            'delta_z': 1.0,
+            'center_x': [10, 10],
+            'center_y': [10, 30],
+            'radius': [8, 8],
+            'direction': ['x', 'x'],
+            'output_path': os.path.join('test')
+        }
+
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            full = f.readlines()
+
+        # Stop early at a loose target
+        task_dict['target_se'] = 0.3
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            lines = f.readlines()
+        self.assertEqual(7, len(lines))
+        line6 = lines[6].strip().split('\t')
+        self.assertEqual("Slices:", line6[0])
+        self.assertLess(int(line6[1]), 16)
+        self.assertEqual(16, int(line6[2]))
+        for i in [1, 3]:
+            self.assertGreaterEqual(0.3, float(lines[i].strip().split()[1]))
+
+        # An unreachable target uses all slices
+        task_dict['target_se'] = 0.0
+        nmiq.tasks.lsf(task_dict)
+        with open(os.path.join('test', 'lsf_res.txt'), 'r') as f:
+            lines = f.readlines()
+        self.assertEqual("Slices:\t16\t16", lines[6].strip())
+        for i in range(6):
+            self.assertAlmostEqual(float(full[i].strip().split()[1]),
+                                   float(lines[i].strip().split()[1]),
+                                   places=10)
@@ -23,6 +23,47 @@ class TestBkgVar3D_main(unittest.TestCase):
         self.assertTrue(os.path.isfile(os.path.join(out_path,
                                                     'bkgvar3d_res.txt')))
 
+    def test_bootstrap(self):
+
+        img_path = os.path.join(
+            'test', 'data', '300',
+            'Patient_unif290725_Study_1_Scan_5_Bed_1_Dyn_1.dcm')
+        out_path = os.path.join('test')
+
+        __main__.main(['bkgvar3d', '-i', img_path, '-o', out_path,
+                       '--start_z', '1100', '--end_z', '1150',
+                       '--center_x', '0', '--center_y', '0',
+                       '--cyl_radius', '30', '--roi_radius', '20',
+                       '--bootstrap', '200', '--bootstrap_method', 'bca',
+                       '--seed', '1'])
+
+        with open(os.path.join(out_path, 'bkgvar3d_res.txt'), 'r') as f:
+            lines = f.readlines()
+            self.assertEqual(5, len(lines))
+            self.assertTrue(lines[3].startswith("Bootstrap S.E.:"))
+            self.assertTrue(lines[4].startswith("95% CI:"))
+
+    def test_roi_radii(self):
+
+        img_path = os.path.join(
+            'test', 'data', '300',
+            'Patient_unif290725_Study_1_Scan_5_Bed_1_Dyn_1.dcm')
+        out_path = os.path.join('test')
+
+        __main__.main(['bkgvar3d', '-i', img_path, '-o', out_path,
+                       '--start_z', '1100', '--end_z', '1150',
+                       '--center_x', '0', '--center_y', '0',
+                       '--cyl_radius', '30', '--roi_radius', '10', '20'])
+
+        with open(os.path.join(out_path, 'bkgvar3d_res.txt'), 'r') as f:
+            lines = f.readlines()
+            self.assertEqual(3, len(lines))
+            self.assertTrue(lines[1].startswith("10.0\t"))
+            self.assertTrue(lines[2].startswith("20.0\t"))
+        for radius in ['10', '20']:
+            self.assertTrue(os.path.isfile(os.path.join(
+                out_path, f'bkgvar3d_mask_r{radius}.nii.gz')))
+
     def test_resample(self):
 
         img_path = os.path.join(
@@ -59,6 +100,10 @@ class TestBkgVar3D_main(unittest.TestCase):
     def tearDown(self):
         if os.path.exists(os.path.join('test', 'bkgvar3d_mask.nii.gz')):
             os.remove(os.path.join('test', 'bkgvar3d_mask.nii.gz'))
+        for radius in ['10', '20']:
+            path = os.path.join('test', f'bkgvar3d_mask_r{radius}.nii.gz')
+            if os.path.exists(path):
+                os.remove(path)
         if os.path.exists(os.path.join('test', 'bkgvar3d_res.txt')):
             os.remove(os.path.join('test', 'bkgvar3d_res.txt'))
 
@@ -85,6 +130,15 @@ class TestLSF_main(unittest.TestCase):
         self.assertTrue(os.path.isfile(os.path.join(out_path,
                                                     'fwhm.png')))
 
+        with open(os.path.join(out_path, 'lsf_res.txt'), 'r') as f:
+            lines = f.readlines()
+        self.assertEqual("NEMA:", lines[0].split()[0])
+        self.assertAlmostEqual(11.01196, float(lines[0].split()[1]),
+                               places=4)
+        self.assertEqual("Gauss:", lines[2].split()[0])
+        self.assertAlmostEqual(10.73110, float(lines[2].split()[1]),
+                               places=4)
+
     def tearDown(self):
         if os.path.exists(os.path.join('test', 'lsf_res.txt')):
             os.remove(os.path.join('test', 'lsf_res.txt'))
@@ -140,6 +194,52 @@ class TestContrastCyl3D_main(unittest.TestCase):
         self.assertEqual(0, mask_hot[309, 355, 27])
         self.assertEqual(1, mask_hot[310, 355, 27])
 
+    def test_workers(self):
+
+        img_path = os.path.join(
+            'test', 'data', 'cyl',
+            'Patient_phantomg9_220925_Study_6_Scan_5_Bed_1_Dyn_20.dcm')
+        out_path = os.path.join('test')
+
+        __main__.main(['contrast_cyl3d', '-i', img_path, '-o', out_path,
+                       '--resample', '1,1,0',
+                       '--start_z', '1156.2', '--end_z', '1190.7',
+                       '--cyl_center_x', '6.3',
+                       '--cyl_center_y', '57.3',
+                       '--bkg_center_x', '5.4',
+                       '--bkg_center_y', '-43.0',
+                       '--cyl_radius', '12.0',
+                       '--workers', '4'])
+
+        mask_hot = sitk.ReadImage(
+            os.path.join(out_path, 'contrast_cyl3d_hot.nii.gz'))
+
+        self.assertEqual(0, mask_hot[309, 355, 27])
+        self.assertEqual(1, mask_hot[310, 355, 27])
+
+    def test_warm_start(self):
+
+        img_path = os.path.join(
+            'test', 'data', 'cyl',
+            'Patient_phantomg9_220925_Study_6_Scan_5_Bed_1_Dyn_20.dcm')
+        out_path = os.path.join('test')
+
+        __main__.main(['contrast_cyl3d', '-i', img_path, '-o', out_path,
+                       '--resample', '1,1,0',
+                       '--start_z', '1156.2', '--end_z', '1190.7',
+                       '--cyl_center_x', '6.3',
+                       '--cyl_center_y', '57.3',
+                       '--bkg_center_x', '5.4',
+                       '--bkg_center_y', '-43.0',
+                       '--cyl_radius', '12.0',
+                       '--warm_start'])
+
+        mask_hot = sitk.ReadImage(
+            os.path.join(out_path, 'contrast_cyl3d_hot.nii.gz'))
+
+        self.assertEqual(0, mask_hot[309, 355, 27])
+        self.assertEqual(1, mask_hot[310, 355, 27])
+
     def tearDown(self):
         if os.path.exists(os.path.join('test', 'contrast_cyl3d_hot.nii.gz')):
             os.remove(os.path.join('test', 'contrast_cyl3d_hot.nii.gz'))
@@ -147,3 +247,5 @@ class TestContrastCyl3D_main(unittest.TestCase):
             os.remove(os.path.join('test', 'contrast_cyl3d_bkg.nii.gz'))
         if os.path.exists(os.path.join('test', 'contrast_cyl3d_res.txt')):
             os.remove(os.path.join('test', 'contrast_cyl3d_res.txt'))
+        if os.path.exists(os.path.join('test', 'contrast_cyl3d_slices.txt')):
+            os.remove(os.path.join('test', 'contrast_cyl3d_slices.txt'))
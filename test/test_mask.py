@@ -1,4 +1,5 @@
 import unittest
+from typing import Any
 
 import numpy as np
 import SimpleITK as sitk
@@ -314,6 +315,50 @@ class TestSpheresInCylinder3D(unittest.TestCase):
 
         self.assertEqual(56, np.max(sitk.GetArrayFromImage(img)))
 
+    def test_sphere_voxels_within_radius(self):
+        img = nmiq.mask.spheres_in_cylinder_3d(
+            image_size=(20, 16, 12),
+            image_spacing=(0.7, 0.9, 1.3),
+            image_origin=(-3.1, 2.2, 5.0),
+            cylinder_start_z=7.0,
+            cylinder_end_z=14.0,
+            cylinder_center_x=3.6,
+            cylinder_center_y=9.1,
+            cylinder_radius=4.0,
+            roi_radius=3.0
+        )
+
+        # A single sphere is placed at the cylinder centre
+        z, y, x = np.meshgrid(5.0 + 1.3 * np.arange(12),
+                              2.2 + 0.9 * np.arange(16),
+                              -3.1 + 0.7 * np.arange(20),
+                              indexing='ij')
+        d2 = (x - 3.6) ** 2 + (y - 9.1) ** 2 + (z - 10.0) ** 2
+        expected = (d2 <= 3.0 ** 2).astype(np.uint8)
+
+        self.assertEqual(sitk.sitkUInt8, img.GetPixelID())
+        np.testing.assert_array_equal(expected, sitk.GetArrayFromImage(img))
+
+    def test_many_spheres(self):
+        img = nmiq.mask.spheres_in_cylinder_3d(
+            image_size=(40, 40, 12),
+            image_spacing=(1, 1, 1),
+            image_origin=(0, 0, 0),
+            cylinder_start_z=1.0,
+            cylinder_end_z=10.0,
+            cylinder_center_x=20.0,
+            cylinder_center_y=20.0,
+            cylinder_radius=18.0,
+            roi_radius=1.0
+        )
+
+        # More than 255 spheres need a wider label type, and every label
+        # is placed in the image
+        self.assertEqual(sitk.sitkUInt16, img.GetPixelID())
+        counts = np.bincount(sitk.GetArrayViewFromImage(img).ravel())
+        self.assertEqual(526, len(counts))
+        self.assertTrue(np.all(counts[1:] > 0))
+
 
 class TestCylinder3D(unittest.TestCase):
 
@@ -641,6 +686,32 @@ class TestCylinder3D(unittest.TestCase):
         self.assertFalse(np.any(mask[:, :, 8]))
         self.assertFalse(np.any(mask[:, :, 9]))
 
+    def test_partial_volume(self):
+        mask = nmiq.mask.cylinder_3d(
+            image_size=(20, 20, 6),
+            image_spacing=(1, 1, 1),
+            image_origin=(0, 0, 0),
+            cylinder_start_z=1.0,
+            cylinder_end_z=4.0,
+            cylinder_center_x=9.3,
+            cylinder_center_y=10.6,
+            cylinder_radius=4.0,
+            partial_volume=True
+        )
+        mask_data = sitk.GetArrayFromImage(mask)
+
+        # Weights lie in [0, 1] and add up to the disk area in each slice
+        self.assertEqual(sitk.sitkFloat32, mask.GetPixelID())
+        self.assertTrue(np.all(mask_data >= 0.0))
+        self.assertTrue(np.all(mask_data <= 1.0))
+        self.assertEqual(0, np.max(mask_data[0]))
+        self.assertEqual(0, np.max(mask_data[5]))
+        for z in range(1, 5):
+            self.assertAlmostEqual(np.pi * 16.0, np.sum(mask_data[z]),
+                                   delta=0.2)
+        self.assertEqual(1.0, mask_data[2, 10, 9])
+        self.assertEqual(0.0, mask_data[2, 10, 15])
+
 
 class TestHottestCylinder3D(unittest.TestCase):
 
@@ -990,3 +1061,278 @@ class TestHottestCylinder3D(unittest.TestCase):
         self.assertEqual(np.max(mask[:, :, 7]), 0.0)
         self.assertEqual(np.max(mask[:, :, 8]), 0.0)
         self.assertEqual(np.max(mask[:, :, 9]), 0.0)
+
+    def test_search_stays_inside_image(self):
+        src = sitk.Image((10, 10, 4), sitk.sitkFloat32)
+        src.SetSpacing((1, 1, 1))
+        src.SetOrigin((0, 0, 0))
+
+        # Signal increases towards the image edge at x = 0
+        for x in range(10):
+            for y in range(10):
+                src[x, y, 1] = 10.0 - x
+
+        mask = nmiq.mask.hottest_cylinder_3d(
+            image=src,
+            cylinder_start_z=1.0,
+            cylinder_end_z=1.0,
+            cylinder_center_x=5.0,
+            cylinder_center_y=5.0,
+            cylinder_radius=1.0
+        )
+
+        # The disk is stopped where it touches the image edge
+        self.assertEqual(mask[0, 5, 1], 1)
+        self.assertEqual(mask[1, 5, 1], 1)
+        self.assertEqual(mask[2, 5, 1], 1)
+        self.assertEqual(mask[1, 4, 1], 1)
+        self.assertEqual(mask[1, 6, 1], 1)
+        self.assertEqual(5, np.sum(sitk.GetArrayFromImage(mask)))
+
+    def test_warm_start_search_stats(self):
+        src = sitk.Image((30, 30, 20), sitk.sitkFloat32)
+        src.SetSpacing((1, 1, 1))
+        src.SetOrigin((0, 0, 0))
+
+        # Broad hot spot away from the given centre, drifting slowly with z
+        for z in range(20):
+            for x in range(30):
+                for y in range(30):
+                    src[x, y, z] = float(np.exp(
+                        -((x - 20 - z // 4) ** 2 + (y - 17) ** 2) / 20.0))
+
+        search_stats: dict[str, int] = {}
+        mask = nmiq.mask.hottest_cylinder_3d(
+            image=src,
+            cylinder_start_z=0.0,
+            cylinder_end_z=19.0,
+            cylinder_center_x=12.0,
+            cylinder_center_y=12.0,
+            cylinder_radius=3.0,
+            warm_start=True,
+            search_stats=search_stats
+        )
+        cold_stats: dict[str, int] = {}
+        cold_mask = nmiq.mask.hottest_cylinder_3d(
+            image=src,
+            cylinder_start_z=0.0,
+            cylinder_end_z=19.0,
+            cylinder_center_x=12.0,
+            cylinder_center_y=12.0,
+            cylinder_radius=3.0,
+            warm_start=False,
+            search_stats=cold_stats
+        )
+
+        np.testing.assert_array_equal(sitk.GetArrayFromImage(cold_mask),
+                                      sitk.GetArrayFromImage(mask))
+        self.assertEqual(1, mask[20, 17, 0])
+        self.assertEqual(1, mask[24, 17, 19])
+        self.assertNotIn('evaluations_saved', cold_stats)
+        self.assertLess(search_stats['evaluations'],
+                        cold_stats['evaluations'] / 4)
+
+        # The saving is estimated from the cost of the first slice, which
+        # is searched from the given position either way. The hot spot
+        # moves away from it, so the later cold searches cost a bit more.
+        estimate = (search_stats['evaluations'] +
+                    search_stats['evaluations_saved'])
+        self.assertEqual(0, estimate % 20)
+        self.assertLessEqual(estimate, cold_stats['evaluations'])
+        self.assertGreater(estimate, 0.8 * cold_stats['evaluations'])
+
+    def test_workers_deterministic(self):
+        rng = np.random.default_rng(42)
+        src = sitk.GetImageFromArray(rng.random((12, 30, 30)))
+        src.SetSpacing((1, 1, 1))
+        src.SetOrigin((0, 0, 0))
+
+        masks = [sitk.GetArrayFromImage(nmiq.mask.hottest_cylinder_3d(
+            image=src,
+            cylinder_start_z=1.0,
+            cylinder_end_z=10.0,
+            cylinder_center_x=15.0,
+            cylinder_center_y=15.0,
+            cylinder_radius=4.0,
+            workers=workers)) for workers in (None, 1, 2, 5)]
+
+        for mask in masks[1:]:
+            np.testing.assert_array_equal(masks[0], mask)
+
+    def test_workers_warm_start_warning(self):
+        src = sitk.Image((20, 20, 5), sitk.sitkFloat32)
+        src.SetSpacing((1, 1, 1))
+        src.SetOrigin((0, 0, 0))
+
+        with self.assertWarns(UserWarning):
+            nmiq.mask.hottest_cylinder_3d(
+                image=src,
+                cylinder_start_z=1.0,
+                cylinder_end_z=3.0,
+                cylinder_center_x=10.0,
+                cylinder_center_y=10.0,
+                cylinder_radius=3.0,
+                warm_start=True,
+                workers=2)
+
+    def test_fitted_axis(self):
+        rng = np.random.default_rng(7)
+        z, y, x = np.meshgrid(np.arange(24), np.arange(40), np.arange(40),
+                              indexing='ij')
+
+        # Hot insert with a tilted axis x = 12 + 0.5 z, y = 20 plus noise
+        data = np.exp(-((x - 12 - 0.5 * z) ** 2 + (y - 20) ** 2) / 30.0)
+        data += 0.05 * rng.standard_normal(data.shape)
+        src = sitk.GetImageFromArray(data)
+        src.SetSpacing((1, 1, 1))
+        src.SetOrigin((0, 0, 0))
+
+        search_stats: dict[str, int] = {}
+        mask = nmiq.mask.hottest_cylinder_3d(
+            image=src,
+            cylinder_start_z=1.0,
+            cylinder_end_z=22.0,
+            cylinder_center_x=12.0,
+            cylinder_center_y=20.0,
+            cylinder_radius=3.0,
+            axis_fit_step=5,
+            search_stats=search_stats
+        )
+        full_stats: dict[str, int] = {}
+        nmiq.mask.hottest_cylinder_3d(
+            image=src,
+            cylinder_start_z=1.0,
+            cylinder_end_z=22.0,
+            cylinder_center_x=12.0,
+            cylinder_center_y=20.0,
+            cylinder_radius=3.0,
+            search_stats=full_stats
+        )
+        mask_data = sitk.GetArrayFromImage(mask)
+
+        # Every slice holds a disk centred close to the true axis
+        d2 = (x - 12 - 0.5 * z) ** 2 + (y - 20) ** 2
+        self.assertEqual(0, np.max(mask_data[0]))
+        self.assertEqual(0, np.max(mask_data[23]))
+        self.assertTrue(np.all(mask_data[1:23][d2[1:23] <= 2.0 ** 2] == 1))
+        self.assertTrue(np.all(mask_data[d2 > 4.0 ** 2] == 0))
+        self.assertLess(search_stats['evaluations'],
+                        full_stats['evaluations'] / 2)
+
+    def test_subvoxel_centre(self):
+        z, y, x = np.meshgrid(np.arange(10), np.arange(30), np.arange(30),
+                              indexing='ij')
+
+        # Hot insert centred between voxels at x = 14.5, y = 15.25
+        data = np.exp(-((x - 14.5) ** 2 + (y - 15.25) ** 2) / 20.0)
+        src = sitk.GetImageFromArray(data)
+        src.SetSpacing((1, 1, 1))
+        src.SetOrigin((0, 0, 0))
+
+        mask = nmiq.mask.hottest_cylinder_3d(
+            image=src,
+            cylinder_start_z=2.0,
+            cylinder_end_z=7.0,
+            cylinder_center_x=14.0,
+            cylinder_center_y=15.0,
+            cylinder_radius=4.0,
+            subvoxel=True,
+            partial_volume=True
+        )
+        mask_data = sitk.GetArrayFromImage(mask)
+
+        # The weighted centroid of the mask is the true centre
+        self.assertEqual(sitk.sitkFloat32, mask.GetPixelID())
+        for iz in range(2, 8):
+            w = mask_data[iz]
+            self.assertAlmostEqual(14.5, np.sum(w * x[iz]) / np.sum(w),
+                                   delta=0.1)
+            self.assertAlmostEqual(15.25, np.sum(w * y[iz]) / np.sum(w),
+                                   delta=0.1)
+        self.assertEqual(0, np.max(mask_data[1]))
+        self.assertEqual(0, np.max(mask_data[8]))
+
+
+class TestSparseMasks(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.img = sitk.GetImageFromArray(rng.random((12, 30, 32)))
+        self.img.SetSpacing((0.9, 1.1, 1.3))
+        self.img.SetOrigin((-14.0, -16.0, -2.0))
+
+    def test_sparse_spheres(self):
+        geometry: dict[str, Any] = dict(
+            image_size=(32, 30, 12),
+            image_spacing=(0.9, 1.1, 1.3),
+            image_origin=(-14.0, -16.0, -2.0),
+            cylinder_start_z=0.0,
+            cylinder_end_z=12.0,
+            cylinder_center_x=0.0,
+            cylinder_center_y=0.0,
+            cylinder_radius=12.0,
+            roi_radius=2.0
+        )
+        roi = nmiq.mask.sparse_spheres_in_cylinder_3d(**geometry)
+        img = nmiq.mask.spheres_in_cylinder_3d(**geometry)
+        labels = sitk.GetArrayViewFromImage(img).ravel()
+
+        # Only the sphere voxels are stored, label by label
+        self.assertEqual(np.max(labels), roi.n_labels)
+        self.assertEqual(np.count_nonzero(labels), len(roi.indices))
+        np.testing.assert_array_equal(labels[roi.indices], roi.labels())
+        self.assertIsNone(roi.weights)
+        assert roi.centres is not None
+        self.assertEqual((roi.n_labels, 3), roi.centres.shape)
+        self.assertEqual(sitk.sitkUInt8, roi.to_image().GetPixelID())
+
+    def test_sparse_cylinder(self):
+        for partial_volume in (False, True):
+            geometry: dict[str, Any] = dict(
+                image_size=(32, 30, 12),
+                image_spacing=(0.9, 1.1, 1.3),
+                image_origin=(-14.0, -16.0, -2.0),
+                cylinder_start_z=1.0,
+                cylinder_end_z=9.0,
+                cylinder_center_x=1.3,
+                cylinder_center_y=-0.4,
+                cylinder_radius=7.5,
+                partial_volume=partial_volume
+            )
+            roi = nmiq.mask.sparse_cylinder_3d(**geometry)
+            mask_data = sitk.GetArrayFromImage(
+                nmiq.mask.cylinder_3d(**geometry)).ravel()
+
+            self.assertEqual(1, roi.n_labels)
+            self.assertEqual(np.count_nonzero(mask_data), len(roi.indices))
+            if partial_volume:
+                assert roi.weights is not None
+                np.testing.assert_array_equal(mask_data[roi.indices],
+                                              roi.weights)
+            else:
+                self.assertTrue(np.all(mask_data[roi.indices] == 1))
+
+    def test_sparse_hottest_cylinder(self):
+        for subvoxel in (False, True):
+            arguments: dict[str, Any] = dict(
+                image=self.img,
+                cylinder_start_z=1.0,
+                cylinder_end_z=9.0,
+                cylinder_center_x=0.0,
+                cylinder_center_y=0.0,
+                cylinder_radius=5.0,
+                mask_size=(64, 60, 24),
+                mask_spacing=(0.45, 0.55, 0.65),
+                mask_origin=(-14.2, -16.2, -2.2),
+                subvoxel=subvoxel,
+                partial_volume=subvoxel
+            )
+            roi = nmiq.mask.sparse_hottest_cylinder_3d(**arguments)
+            mask = nmiq.mask.hottest_cylinder_3d(**arguments)
+
+            self.assertEqual((64, 60, 24), roi.size)
+            self.assertEqual(mask.GetSpacing(), roi.spacing)
+            self.assertEqual(mask.GetOrigin(), roi.origin)
+            np.testing.assert_array_equal(
+                sitk.GetArrayFromImage(mask),
+                sitk.GetArrayFromImage(roi.to_image()))
@@ -0,0 +1,40 @@
+import unittest
+import nmiq.roi
+import SimpleITK as sitk
+import numpy as np
+
+
+class TestSparseROI(unittest.TestCase):
+
+    def setUp(self):
+        # Label 1: voxels 0 and 5, label 2: no voxels, label 3: voxel 23
+        self.roi = nmiq.roi.SparseROI(
+            size=(4, 3, 2),
+            spacing=(0.5, 1.0, 2.0),
+            origin=(1.0, -1.0, 3.0),
+            indices=np.array([0, 5, 23]),
+            offsets=np.array([0, 2, 2, 3]))
+
+    def test_labels(self):
+        self.assertEqual(3, self.roi.n_labels)
+        np.testing.assert_array_equal([1, 1, 3], self.roi.labels())
+
+    def test_to_image(self):
+        img = self.roi.to_image()
+        self.assertEqual((4, 3, 2), img.GetSize())
+        self.assertEqual((0.5, 1.0, 2.0), img.GetSpacing())
+        self.assertEqual((1.0, -1.0, 3.0), img.GetOrigin())
+        self.assertEqual(sitk.sitkUInt16, img.GetPixelID())
+        expected = np.zeros(24, dtype=np.uint16)
+        expected[[0, 5, 23]] = [1, 1, 3]
+        np.testing.assert_array_equal(expected.reshape(2, 3, 4),
+                                      sitk.GetArrayFromImage(img))
+
+    def test_to_image_weights(self):
+        self.roi.weights = np.array([0.25, 1.0, 0.5], dtype=np.float32)
+        self.roi.dtype = np.float32
+        img = self.roi.to_image()
+        self.assertEqual(sitk.sitkFloat32, img.GetPixelID())
+        data = sitk.GetArrayFromImage(img).ravel()
+        np.testing.assert_array_equal([0.25, 1.0, 0.5], data[[0, 5, 23]])
+        self.assertEqual(1.75, np.sum(data))